@@ -0,0 +1,69 @@
+"""Import-time benchmark for the CLI entry point.
+
+Measures how long `import main` takes in a fresh interpreter (minus bare
+interpreter start-up) and fails if it exceeds a threshold or if any of the
+heavy client libraries are imported eagerly.
+
+Usage:
+    python benchmarks/import_time.py [--runs 7] [--threshold-ms 150]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported when a code path actually needs them
+HEAVY_MODULES = ("openai", "tiktoken", "dotenv")
+
+def _time_interpreter(code: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, check=True)
+    return time.perf_counter() - start
+
+def _median_ms(code: str, runs: int) -> float:
+    return statistics.median(_time_interpreter(code) for _ in range(runs)) * 1000
+
+def eagerly_imported_modules() -> list:
+    """Return the heavy modules that are loaded as a side effect of `import main`."""
+    check = (
+        "import sys, main; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, "-c", check], cwd=REPO_ROOT,
+                            check=True, capture_output=True, text=True)
+    output = result.stdout.strip()
+    return output.split(",") if output else []
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=7, help="interpreter launches per measurement")
+    parser.add_argument("--threshold-ms", type=float, default=150.0,
+                        help="maximum allowed import cost of main.py in milliseconds")
+    args = parser.parse_args()
+
+    baseline_ms = _median_ms("pass", args.runs)
+    import_ms = _median_ms("import main", args.runs)
+    cost_ms = max(0.0, import_ms - baseline_ms)
+
+    print(f"interpreter start-up: {baseline_ms:.1f} ms")
+    print(f"import main:          {import_ms:.1f} ms")
+    print(f"import cost:          {cost_ms:.1f} ms (threshold {args.threshold_ms:.1f} ms)")
+
+    failed = False
+    eager = eagerly_imported_modules()
+    if eager:
+        print(f"❌ Heavy modules imported eagerly: {', '.join(eager)}")
+        failed = True
+    if cost_ms > args.threshold_ms:
+        print("❌ Import time regression")
+        failed = True
+    if not failed:
+        print("✅ Import time within threshold")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+"""Microbenchmarks for the personality storage and merge hot paths.
+
+Generates synthetic data in a temporary directory (personalities whose section
+lists hold up to 10k entries, a personality with up to a thousand relationship
+files, transcripts of up to 100k messages) and times loading, saving, merging
+and prompt building at several sizes. Each case reports ops/sec, the peak
+memory allocated by one operation, the memory still held by what it returns
+(the resident size of loaded state) and the allocated blocks it leaves behind;
+each benchmark reports how its cost grows with the data (1.0 means linear).
+
+Results can be saved as a baseline and later runs compared against it, failing
+when a case got slower than the tolerance allows:
+
+Usage:
+    python benchmarks/storage_bench.py [--scale small|full] [--only NAME ...] [--min-time 0.5]
+        [--save-baseline FILE] [--compare FILE] [--tolerance 0.25] [--json FILE]
+"""
+import argparse
+import gc
+import json
+import marshal
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from chatbot.chatbot import ChatBot  # noqa: E402
+from chatbot.dedup import merge_list  # noqa: E402
+from chatbot.personality_manager import PersonalityManager  # noqa: E402
+from chatbot.personality_pool import PersonalityPool  # noqa: E402
+from chatbot.relationship_manager import RelationshipManager  # noqa: E402
+from chatbot.snapshot import PersonalitySnapshot  # noqa: E402
+
+# Data sizes per benchmark parameter at each scale
+SCALES = {
+    "small": {"entries": [100, 1000], "relationships": [10, 100], "messages": [1000, 10000]},
+    "full": {"entries": [100, 1000, 10000], "relationships": [10, 100, 1000], "messages": [1000, 10000, 100000]},
+}
+
+# Entries per list in generated relationship files, when the file count is what varies
+RELATIONSHIP_ENTRIES = 50
+
+PERSONALITY = "bench"
+OTHER = "partner"
+
+# Synthetic data
+
+class DataGenerator:
+    """Deterministic synthetic personalities, relationships and transcripts."""
+
+    def __init__(self, seed: int = 7):
+        self.rng = random.Random(seed)
+        syllables = ["ka", "lo", "mi", "ren", "tu", "sha", "vor", "el", "qui", "dan", "pa", "zo", "thi", "gra", "nu"]
+        # A few thousand distinct words, so phrases rarely collapse as near-duplicates
+        self.words = sorted({"".join(self.rng.choice(syllables) for _ in range(self.rng.randint(2, 4)))
+                             for _ in range(6000)})
+
+    def phrase(self) -> str:
+        return " ".join(self.rng.choice(self.words) for _ in range(self.rng.randint(3, 7)))
+
+    def phrases(self, count: int) -> List[str]:
+        return [self.phrase() for _ in range(count)]
+
+    def personality(self, entries: int) -> Dict[str, Dict]:
+        """Section files of a personality with entries items in every list."""
+        return {
+            "core-identity.json": {"name": PERSONALITY, "background": self.phrase(),
+                                   "traits": self.phrases(entries), "personality_type": "synthetic"},
+            "interests-values.json": {"interests": self.phrases(entries), "values": self.phrases(entries),
+                                      "preferences": {"likes": self.phrases(entries)}},
+            "emotional-framework.json": {"emotional_range": self.phrases(entries),
+                                         "communication_style": self.phrases(entries),
+                                         "observed_responses": self.phrases(entries)},
+            "behavioral-patterns.json": {"habits": self.phrases(entries), "routines": self.phrases(entries),
+                                         "decision_making": self.phrases(entries)},
+            "cognitive-style.json": {"thinking_patterns": self.phrases(entries),
+                                     "learning_style": self.phrases(entries),
+                                     "problem_solving": self.phrases(entries)},
+            "memory-growth.json": {"experiences": self.phrases(entries), "learned_concepts": self.phrases(entries),
+                                   "growth_areas": self.phrases(entries)},
+        }
+
+    def relationship(self, entries: int) -> Dict:
+        """A relationship file with entries items in every list."""
+        return {
+            "interactions": self.phrases(entries),
+            "observed_traits": self.phrases(entries),
+            "shared_experiences": self.phrases(entries),
+            "emotional_dynamics": {"positive_moments": self.phrases(entries), "challenges": self.phrases(entries),
+                                   "trust_level": "medium"},
+            "communication_patterns": {"topics": self.phrases(entries), "style": self.phrases(entries),
+                                       "frequency": "regular"},
+            "relationship_development": {"milestones": self.phrases(entries), "current_status": "friend",
+                                         "growth_areas": self.phrases(entries)},
+            "social_preferences": {"preferred_topics": self.phrases(entries),
+                                   "interaction_style": self.phrases(entries), "boundaries": self.phrases(entries)},
+            "interaction_history": {"recent_interactions": self.phrases(entries), "key_moments": self.phrases(entries),
+                                    "conflicts": self.phrases(entries), "resolutions": self.phrases(entries)},
+        }
+
+    def relationship_updates(self, new_items: int = 10, repeated_from: Optional[Dict] = None) -> Dict:
+        """Analyzer-style updates: new phrases plus, if given, entries already in repeated_from."""
+        def items(existing: Optional[List[str]]) -> List[str]:
+            fresh = self.phrases(new_items)
+            if existing:
+                fresh += self.rng.sample(existing, min(new_items, len(existing)))
+            return fresh
+        source = repeated_from or {}
+        return {
+            "interactions": items(source.get("interactions")),
+            "observed_traits": items(source.get("observed_traits")),
+            "emotional_dynamics": {"positive_moments": items(source.get("emotional_dynamics", {}).get("positive_moments")),
+                                   "trust_level": "high"},
+            "communication_patterns": {"topics": items(source.get("communication_patterns", {}).get("topics"))},
+        }
+
+    def personality_updates(self, sections: Dict[str, Dict], new_items: int = 10) -> Dict:
+        """Analyzer-style personality updates mixing new and already known entries."""
+        def items(existing: List[str]) -> List[str]:
+            return self.phrases(new_items) + self.rng.sample(existing, min(new_items, len(existing)))
+        return {
+            "interests-values.json": {"interests": items(sections["interests-values.json"]["interests"]),
+                                      "values": items(sections["interests-values.json"]["values"])},
+            "emotional-framework.json": {
+                "observed_responses": items(sections["emotional-framework.json"]["observed_responses"])},
+        }
+
+    def transcript(self, messages: int) -> List[Dict]:
+        return [{"role": "user" if i % 2 == 0 else "assistant", "content": self.phrase()} for i in range(messages)]
+
+def write_personality(base_dir: str, sections: Dict[str, Dict]) -> str:
+    personality_dir = os.path.join(base_dir, "ai", PERSONALITY)
+    os.makedirs(os.path.join(personality_dir, "relationships"), exist_ok=True)
+    for filename, data in sections.items():
+        with open(os.path.join(personality_dir, filename), "w") as f:
+            json.dump(data, f, indent=2)
+    return personality_dir
+
+def write_relationships(personality_dir: str, count: int, generator: DataGenerator,
+                        entries: int = RELATIONSHIP_ENTRIES) -> List[str]:
+    names = [f"user{i:05d}" for i in range(count)]
+    for name in names:
+        with open(os.path.join(personality_dir, "relationships", f"{name}.json"), "w") as f:
+            json.dump(generator.relationship(entries), f, indent=2)
+    return names
+
+# Benchmarks: each takes a fresh base directory, a generator and a size, and
+# returns the operation to time
+
+def bench_load_personality_cold(base_dir: str, generator: DataGenerator, entries: int) -> Callable:
+    """Parse every section file (no snapshot)."""
+    write_personality(base_dir, generator.personality(entries))
+    manager = PersonalityManager(base_dir)
+    manager.personality_dir = os.path.join(base_dir, "ai", PERSONALITY)
+    return manager._load_personality_files
+
+def bench_load_personality_warm(base_dir: str, generator: DataGenerator, entries: int) -> Callable:
+    """Load every section from an up-to-date snapshot."""
+    write_personality(base_dir, generator.personality(entries))
+    manager = PersonalityManager(base_dir)
+    manager.load_personality(PERSONALITY)
+    return manager._load_personality_files
+
+def bench_save_personality_file(base_dir: str, generator: DataGenerator, entries: int) -> Callable:
+    """Atomically write one section file."""
+    sections = generator.personality(entries)
+    write_personality(base_dir, sections)
+    manager = PersonalityManager(base_dir)
+    manager.load_personality(PERSONALITY)
+    data = sections["interests-values.json"]
+    return lambda: manager.save_personality_file("interests-values.json", data)
+
+def bench_load_relationship(base_dir: str, generator: DataGenerator, count: int) -> Callable:
+    """Read one relationship file (no snapshot) among count others."""
+    personality_dir = write_personality(base_dir, generator.personality(10))
+    names = write_relationships(personality_dir, count, generator)
+    manager = RelationshipManager(personality_dir)
+    rng = random.Random(count)
+    return lambda: manager.load_relationship(rng.choice(names))
+
+def bench_sync_relationships(base_dir: str, generator: DataGenerator, count: int) -> Callable:
+    """Build the relationship part of a snapshot from count files."""
+    personality_dir = write_personality(base_dir, generator.personality(10))
+    write_relationships(personality_dir, count, generator)
+    return lambda: PersonalitySnapshot(personality_dir).sync_relationships()
+
+# The merge benchmarks merge into a freshly decoded copy each time, as an update
+# does with the data it has just loaded, so the data doesn't grow across runs
+
+def bench_relationship_merge(base_dir: str, generator: DataGenerator, entries: int) -> Callable:
+    """Merge analyzer updates into relationship data whose lists hold entries items."""
+    personality_dir = write_personality(base_dir, generator.personality(10))
+    manager = RelationshipManager(personality_dir)
+    data = generator.relationship(entries)
+    blob = marshal.dumps(data)
+    updates = [generator.relationship_updates(repeated_from=data) for _ in range(64)]
+    position = iter(range(sys.maxsize))
+    return lambda: manager._merge_relationship_data(marshal.loads(blob), updates[next(position) % len(updates)])
+
+def bench_personality_merge(base_dir: str, generator: DataGenerator, entries: int) -> Callable:
+    """ChatBot._merge_data of analyzer updates into sections whose lists hold entries items."""
+    sections = generator.personality(entries)
+    blob = marshal.dumps(sections)
+    updates = [generator.personality_updates(sections) for _ in range(64)]
+    merger = object.__new__(ChatBot)
+    position = iter(range(sys.maxsize))
+    def merge():
+        current = marshal.loads(blob)
+        for filename, new_data in updates[next(position) % len(updates)].items():
+            merger._merge_data(current[filename], new_data)
+    return merge
+
+def bench_system_message(base_dir: str, generator: DataGenerator, entries: int) -> Callable:
+    """Build the reply system prompt for a personality and relationship with entries items per list."""
+    personality_dir = write_personality(base_dir, generator.personality(entries))
+    with open(os.path.join(personality_dir, "relationships", f"{OTHER}.json"), "w") as f:
+        json.dump(generator.relationship(entries), f)
+    bot = ChatBot(PERSONALITY, pool=PersonalityPool(base_dir))
+    return lambda: bot._create_system_message(OTHER)
+
+def bench_build_messages(base_dir: str, generator: DataGenerator, messages: int) -> Callable:
+    """Assemble a reply prompt with a session history of messages messages."""
+    write_personality(base_dir, generator.personality(20))
+    bot = ChatBot(PERSONALITY, pool=PersonalityPool(base_dir))
+    bot.conversation_history = generator.transcript(messages)
+    return lambda: bot._build_messages("How was your day?", OTHER)
+
+def bench_resident_personality(base_dir: str, generator: DataGenerator, count: int) -> Callable:
+    """Load a personality with count relationship files into a pool and keep it resident.
+
+    Lists are built by merging, as the analyzers do, so entries carry last-seen
+    stamps, and every interaction is recorded in both participants' files.
+    """
+    sections = {}
+    for filename, data in generator.personality(RELATIONSHIP_ENTRIES).items():
+        sections[filename] = {}
+        for key, value in data.items():
+            if isinstance(value, list):
+                merge_list(sections[filename], key, value)
+            else:
+                sections[filename][key] = value
+    personality_dir = write_personality(base_dir, sections)
+    for name in [f"user{i:05d}" for i in range(count)]:
+        relationship = {}
+        for key, value in generator.relationship(RELATIONSHIP_ENTRIES).items():
+            if isinstance(value, list):
+                merge_list(relationship, key, value)
+            else:
+                relationship[key] = value
+        with open(os.path.join(personality_dir, "relationships", f"{name}.json"), "w") as f:
+            json.dump(relationship, f, indent=2)
+        # The other participant's file about this personality shares its interactions
+        mirror_dir = os.path.join(base_dir, "ai", name, "relationships")
+        os.makedirs(mirror_dir)
+        mirror = {}
+        merge_list(mirror, "interactions", relationship["interactions"])
+        with open(os.path.join(mirror_dir, f"{PERSONALITY}.json"), "w") as f:
+            json.dump(mirror, f, indent=2)
+    # The first load builds the snapshot; timed loads read it
+    PersonalityPool(base_dir).get(PERSONALITY)
+    def load():
+        entry = PersonalityPool(base_dir).get(PERSONALITY)
+        manager = entry.relationship_manager
+        return entry, [manager.load_relationship(name) for name in ("user00000", "user00001")]
+    return load
+
+# name -> (benchmark, size parameter)
+BENCHMARKS = {
+    "load_personality_cold": (bench_load_personality_cold, "entries"),
+    "load_personality_warm": (bench_load_personality_warm, "entries"),
+    "save_personality_file": (bench_save_personality_file, "entries"),
+    "load_relationship": (bench_load_relationship, "relationships"),
+    "sync_relationships": (bench_sync_relationships, "relationships"),
+    "relationship_merge": (bench_relationship_merge, "entries"),
+    "personality_merge": (bench_personality_merge, "entries"),
+    "system_message": (bench_system_message, "entries"),
+    "build_messages": (bench_build_messages, "messages"),
+    "resident_personality": (bench_resident_personality, "relationships"),
+}
+
+# Measurement
+
+def measure(operation: Callable, min_time: float) -> Dict:
+    """Time operation until min_time has passed (at least 3 runs), then trace one run's allocations."""
+    operation()
+    runs, start = 0, time.perf_counter()
+    while True:
+        operation()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time and runs >= 3:
+            break
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        # What the operation returns is held while measuring, so loads report what they keep resident
+        result = operation()
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    gc.collect()
+    return {
+        "ops_per_sec": round(runs / elapsed, 2),
+        "us_per_op": round(elapsed / runs * 1e6, 1),
+        "peak_kib": round(peak / 1024, 1),
+        "retained_kib": round(retained / 1024, 1),
+        "net_blocks": sys.getallocatedblocks() - blocks_before,
+    }
+
+def scaling_exponent(points: Dict[int, Dict]) -> Optional[float]:
+    """Least-squares slope of log(time per op) over log(size): 1.0 is linear, 0 is constant."""
+    sizes = sorted(points)
+    if len(sizes) < 2:
+        return None
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(points[size]["us_per_op"]) for size in sizes]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    denominator = sum((x - mean_x) ** 2 for x in xs)
+    return round(sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / denominator, 2)
+
+def run(names: List[str], scale: str, min_time: float) -> Dict:
+    results = {}
+    for name in names:
+        benchmark, parameter = BENCHMARKS[name]
+        points = {}
+        for size in SCALES[scale][parameter]:
+            base_dir = tempfile.mkdtemp(prefix="chatbot-bench-")
+            try:
+                operation = benchmark(base_dir, DataGenerator(), size)
+                points[size] = measure(operation, min_time)
+            finally:
+                shutil.rmtree(base_dir, ignore_errors=True)
+            point = points[size]
+            print(f"{name:<24} {parameter}={size:<7} {point['ops_per_sec']:>12.1f} ops/s "
+                  f"{point['us_per_op']:>12.1f} us/op {point['peak_kib']:>10.1f} KiB peak "
+                  f"{point['retained_kib']:>10.1f} KiB kept "
+                  f"{point['net_blocks']:>8} blocks", flush=True)
+        exponent = scaling_exponent(points)
+        if exponent is not None:
+            print(f"{name:<24} scaling exponent {exponent}")
+        results[name] = {"parameter": parameter, "scaling_exponent": exponent,
+                         "points": {str(size): point for size, point in points.items()}}
+    return results
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Cases slower than the baseline by more than tolerance (a fraction of the baseline ops/sec)."""
+    regressions = []
+    print(f"\n{'benchmark':<24} {'size':<8} {'baseline ops/s':>15} {'ops/s':>12} {'change':>8}")
+    for name, result in results.items():
+        base_points = baseline.get("results", {}).get(name, {}).get("points", {})
+        for size, point in result["points"].items():
+            base = base_points.get(size)
+            if base is None:
+                continue
+            change = point["ops_per_sec"] / base["ops_per_sec"] - 1
+            marker = ""
+            if change < -tolerance:
+                marker = "  ❌"
+                regressions.append(f"{name} at {size}: {change:+.0%}")
+            print(f"{name:<24} {size:<8} {base['ops_per_sec']:>15.1f} {point['ops_per_sec']:>12.1f} "
+                  f"{change:>+8.0%}{marker}")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="full",
+                        help="data sizes to run (small skips the 10k-entry, 1000-file and 100k-message cases)")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), metavar="NAME",
+                        help=f"benchmarks to run (default all: {', '.join(BENCHMARKS)})")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to spend timing each case")
+    parser.add_argument("--json", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed ops/sec drop against the baseline before failing (fraction)")
+    args = parser.parse_args()
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "scale": args.scale,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": run(args.only or list(BENCHMARKS), args.scale, args.min_time),
+    }
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("python") != report["python"]:
+            print(f"Note: baseline was recorded with Python {baseline.get('python')}")
+        regressions = compare(report["results"], baseline, args.tolerance)
+        if regressions:
+            print(f"❌ Slower than the baseline by more than {args.tolerance:.0%}: {'; '.join(regressions)}")
+            return 1
+        print("✅ No regressions against the baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
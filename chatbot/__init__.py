@@ -1,5 +1,16 @@
 # chatbot/__init__.py
-from .chatbot import ChatBot
-from .autonomous_chat import AutonomousChat
+__all__ = ['ChatBot', 'AutonomousChat', 'GroupChat']
 
-__all__ = ['ChatBot', 'AutonomousChat']
\ No newline at end of file
+def __getattr__(name):
+    # Resolve the public classes on first use so importing a submodule
+    # (e.g. chatbot.personality_manager) doesn't pull in the whole package
+    if name == 'ChatBot':
+        from .chatbot import ChatBot
+        return ChatBot
+    if name == 'AutonomousChat':
+        from .autonomous_chat import AutonomousChat
+        return AutonomousChat
+    if name == 'GroupChat':
+        from .group_chat import GroupChat
+        return GroupChat
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -4,17 +4,18 @@ import json
 import os
 from typing import List, Dict, Optional
 from .chatbot import ChatBot
-from dotenv import load_dotenv
-from openai import OpenAI
+from .tracing import span
+from .token_ledger import token_ledger, pair_key
+from .model_router import model_router
+from .profiling import profiler
+from .job_journal import Job, register_job
+from .novelty import novelty_gate, count_entries
 
 class AutonomousChat:
-    def __init__(self, delay: float = 2.0):
+    def __init__(self, delay: Optional[float] = None):
+        # Optional pacing target: minimum seconds from the start of one turn to the
+        # next, counting the time spent generating. None or 0 runs turns back to back.
         self.delay = delay
-        load_dotenv()
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OpenAI API key not found in environment variables or .env file")
-        self.client = OpenAI(api_key=api_key)
 
     def _create_context_message(self, speaker_name: str, listener_name: str) -> str:
         """Create context message for the current speaker."""
@@ -27,15 +28,25 @@ class AutonomousChat:
         - Feel free to change topics if it feels natural
         - Express emotions, thoughts, and opinions freely"""
 
-    def _update_personality_files(self, speaker: ChatBot, listener: ChatBot, conversation_segment: List[Dict]):
-        """Update the personality files based on the conversation."""
+    @staticmethod
+    def analyze_conversation(speaker_name: str, listener_name: str, conversation_segment: List[Dict]) -> Optional[Dict]:
+        """Ask the analyzer what speaker's messages add to listener's personality files.
+
+        Returns the updates for the listener's apply_personality_updates, or None
+        when the analysis is deferred because the listener is over budget.
+        """
+        pair = pair_key(listener_name, speaker_name)
+        if not token_ledger.allow("personality", listener_name, pair):
+            print(f"Deferring {listener_name}'s personality analysis: over today's token budget")
+            return None
+        
         # print(f"\n{'='*50}")
-        # print(f"Analyzing conversation for {listener.name}'s personality updates...")
+        # print(f"Analyzing conversation for {listener_name}'s personality updates...")
         # print(f"Conversation segment length: {len(conversation_segment)} messages")
         
         # Separate messages by speaker
-        speaker_messages = [msg for msg in conversation_segment if msg["speaker"] == speaker.name]
-        listener_messages = [msg for msg in conversation_segment if msg["speaker"] == listener.name]
+        speaker_messages = [msg for msg in conversation_segment if msg["speaker"] == speaker_name]
+        listener_messages = [msg for msg in conversation_segment if msg["speaker"] == listener_name]
         
         # Create conversation pairs for analysis
         conversation_pairs = []
@@ -52,10 +63,10 @@ class AutonomousChat:
 
 IMPORTANT: Your entire response must be a valid JSON object, nothing else.
 
-Analyze how {speaker.name} presents themselves to {listener.name} and identify new information to add to {listener.name}'s understanding.
+Analyze how {speaker_name} presents themselves to {listener_name} and identify new information to add to {listener_name}'s understanding.
 
 Consider the following aspects:
-1. How {speaker.name} responds to {listener.name}'s messages
+1. How {speaker_name} responds to {listener_name}'s messages
 2. New interests or values revealed in the conversation
 3. Emotional responses and communication style
 4. Relationship dynamics and social preferences
@@ -72,7 +83,7 @@ Return format must be exactly:
     }},
     "social-dynamics.json": {{
         "relationship_dynamics": {{
-            "with_{speaker.name}": {{
+            "with_{speaker_name}": {{
                 "interactions": ["new interaction 1"],
                 "observed_traits": ["trait 1"]
             }}
@@ -82,82 +93,22 @@ Return format must be exactly:
 
 Only include files that need updates. Ensure the response is valid JSON."""
         
-        try:
-            # Format the conversation for analysis
-            conversation_text = "\n".join([
-                f"{pair['previous']['speaker']}: {pair['previous']['message']}\n{pair['current']['speaker']}: {pair['current']['message']}"
-                for pair in conversation_pairs
-            ])
-            
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Analyze this conversation:\n\n{conversation_text}"}
-            ]
-            
-            # print(f"\nSending conversation analysis request for {listener.name}...")
-            
-            # Get analysis from GPT
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=1000,
-                temperature=0.7
-            )
-            
-            response_content = response.choices[0].message.content
-            # print("\nAnalysis received. Processing updates...")
-            
-            try:
-                # Try to parse the JSON response
-                updates = json.loads(response_content)
-                # print(f"\nUpdates to be applied to {listener.name}'s personality:")
-                # print(json.dumps(updates, indent=2))
-                
-                # Apply updates to listener's personality files
-                for filename, new_data in updates.items():
-                    try:
-                        # Get current data from personality manager
-                        current_data = listener.personality_manager.current_personality.get(filename, {})
-                        
-                        # Merge new data with current data
-                        merged_data = self._merge_data(current_data, new_data)
-                        
-                        # Save the updated data
-                        listener.personality_manager.save_personality_file(filename, merged_data)
-                            
-                        # print(f"\n✅ Successfully updated {listener.name}'s {filename}")
-                        # print(f"Updated content preview:")
-                        # print(json.dumps(merged_data, indent=2)[:500] + "...")
-                        
-                    except Exception as e:
-                        # print(f"❌ Error updating {filename}: {e}")
-                        pass
-                
-            except json.JSONDecodeError as e:
-                # print(f"❌ Error parsing GPT response as JSON: {e}")
-                # print("Raw response was:", response_content)
-                pass
+        # Format the conversation for analysis
+        conversation_text = "\n".join([
+            f"{pair['previous']['speaker']}: {pair['previous']['message']}\n{pair['current']['speaker']}: {pair['current']['message']}"
+            for pair in conversation_pairs
+        ])
         
-        except Exception as e:
-            # print(f"❌ Error in personality update process: {e}")
-            pass
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Analyze this conversation:\n\n{conversation_text}"}
+        ]
         
-        # print(f"{'='*50}\n")
-
-    def _merge_data(self, current_data: Dict, new_data: Dict) -> Dict:
-        """Merge new data into current data, handling nested structures."""
-        for key, value in new_data.items():
-            if isinstance(value, dict):
-                if key not in current_data:
-                    current_data[key] = {}
-                current_data[key] = self._merge_data(current_data[key], value)
-            elif isinstance(value, list):
-                if key not in current_data:
-                    current_data[key] = []
-                current_data[key].extend(item for item in value if item not in current_data[key])
-            else:
-                current_data[key] = value
-        return current_data
+        # Get analysis from GPT
+        with span("personality_analysis", listener_name):
+            response = model_router.complete("personality", messages, listener_name, pair)
+        
+        return json.loads(response.choices[0].message.content)
 
     def start_conversation(self, bot1: ChatBot, bot2: ChatBot):
         """Start an autonomous conversation between two AI personalities."""
@@ -176,21 +127,25 @@ Only include files that need updates. Ensure the response is valid JSON."""
             {"speaker": bot1.name, "message": initial_message}
         ]
         
+        profiler.watch("autonomous.conversation_history", lambda: conversation_history)
+        for bot in (bot1, bot2):
+            profiler.watch(f"{bot.name}.conversation_history", lambda bot=bot: bot.conversation_history)
+            profiler.watch(f"{bot.name}.personality", lambda bot=bot: bot.personality_manager.current_personality)
+        
+        # Each turn only waits for generation: a bot's relationship and personality
+        # analysis runs on its update thread while the other bot is replying, and
+        # the bot waits for it to finish before its own next reply
         try:
             # First response from bot2
-            response = bot2.get_response(initial_message, bot1.name)
+            turn_started = time.perf_counter()
+            response = self._take_turn(bot2, bot1, initial_message)
             print(f"\n{bot2.name}: {response}")
             conversation_history.append({"speaker": bot2.name, "message": response})
-            
-            # Update relationship for bot2
-            if hasattr(bot2, 'relationship_manager'):
-                bot2.relationship_manager.update_relationship(
-                    bot1.name,
-                    [{"speaker": bot2.name, "message": response}]
-                )
+            self._pace(turn_started)
             
             # Main conversation loop
             for turn in range(1, num_turns):
+                turn_started = time.perf_counter()
                 # Get the last message from the conversation history
                 last_message = conversation_history[-1]
                 
@@ -203,36 +158,60 @@ Only include files that need updates. Ensure the response is valid JSON."""
                     other_speaker = bot2
                 
                 # Get response from current speaker
-                message = current_speaker.get_response(last_message["message"], other_speaker.name)
+                message = self._take_turn(current_speaker, other_speaker, last_message["message"])
                 print(f"\n{current_speaker.name}: {message}")
                 conversation_history.append({"speaker": current_speaker.name, "message": message})
                 
-                # Update relationship for current speaker
-                if hasattr(current_speaker, 'relationship_manager'):
-                    current_speaker.relationship_manager.update_relationship(
-                        other_speaker.name,
-                        [{"speaker": current_speaker.name, "message": message}]
-                    )
-                
                 # Update personality files every 10 turns
                 if turn % 10 == 0:
-                    print(f"\nUpdating personality files for {current_speaker.name} and {other_speaker.name}...")
+                    print(f"\nQueueing personality updates for {current_speaker.name} and {other_speaker.name}...")
                     # Get the last 10 messages for each bot
                     bot1_messages = [msg for msg in conversation_history[-20:] if msg["speaker"] == bot1.name]
                     bot2_messages = [msg for msg in conversation_history[-20:] if msg["speaker"] == bot2.name]
                     
-                    # Update personalities
-                    self._update_personality_files(bot1, bot2, bot1_messages)
-                    self._update_personality_files(bot2, bot1, bot2_messages)
-                    print("Personality files updated successfully.")
+                    # Each analysis is journaled and runs on the listener's update thread,
+                    # unless the speaker's messages add nothing the listener doesn't know
+                    for listener, speaker, messages in ((bot2, bot1, bot1_messages), (bot1, bot2, bot2_messages)):
+                        text = "\n".join(msg["message"] for msg in messages)
+                        if novelty_gate.should_analyze("conversation_analysis", listener.name, speaker.name, text,
+                                                       listener.known_keywords(speaker.name)):
+                            listener.submit_job("conversation_analysis", speaker=speaker.name, conversation=messages)
                 
-                # Add a small delay between turns
-                time.sleep(self.delay)
+                profiler.tick()
+                self._pace(turn_started)
                 
         except KeyboardInterrupt:
             print("\n\nConversation ended by user.")
         except Exception as e:
             print(f"\nError in conversation: {e}")
+        finally:
+            print("\nFinishing relationship and personality updates...")
+            bot1.end_session(bot2.name)
+            bot2.end_session(bot1.name)
+            for bot in (bot1, bot2):
+                try:
+                    bot.wait_for_updates()
+                except Exception as e:
+                    print(f"Error in {bot.name}'s updates: {e}")
+
+    def _take_turn(self, speaker: ChatBot, listener: ChatBot, message: str) -> str:
+        """Generate speaker's reply and queue its post-reply analysis in the background."""
+        # The prompt reads the speaker's relationship file, so its own last update must be in
+        speaker.wait_for_updates()
+        # While the upstream is down, wait for it instead of trading error replies
+        model_router.wait_until_available("reply")
+        with span("turn", speaker.name):
+            response = speaker.get_response(message, listener.name, record=False)
+        speaker.record_exchange(message, response, listener.name, background=True)
+        return response
+
+    def _pace(self, turn_started: float) -> None:
+        """Sleep off whatever is left of the pacing target for a turn that started at turn_started."""
+        if not self.delay:
+            return
+        remaining = self.delay - (time.perf_counter() - turn_started)
+        if remaining > 0:
+            time.sleep(remaining)
 
     def _create_system_message(self) -> str:
         """Create a system message that includes personality and relationship context."""
@@ -283,4 +262,14 @@ IMPORTANT CONVERSATION GUIDELINES:
    - Introduce a new topic or angle
    - End with an open-ended question or invitation to explore further
 
-Remember: Your goal is to have engaging, dynamic conversations that naturally flow between different subjects while maintaining depth and authenticity. Keep the conversation fresh and interesting by regularly introducing new topics and perspectives."""
\ No newline at end of file
+Remember: Your goal is to have engaging, dynamic conversations that naturally flow between different subjects while maintaining depth and authenticity. Keep the conversation fresh and interesting by regularly introducing new topics and perspectives."""
+
+def _analyze_conversation_job(listener: ChatBot, job: Job) -> Optional[Dict]:
+    with span("personality_update", listener.name):
+        return AutonomousChat.analyze_conversation(job.args["speaker"], listener.name, job.args["conversation"])
+
+def _apply_conversation_job(listener: ChatBot, job: Job, updates: Dict) -> None:
+    added = listener.apply_personality_updates(updates, job.key)
+    novelty_gate.record_yield(job.kind, listener.name, added, count_entries(updates))
+
+register_job("conversation_analysis", _analyze_conversation_job, _apply_conversation_job)
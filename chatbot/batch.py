@@ -0,0 +1,224 @@
+# chatbot/batch.py
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, IO, List, Optional, Tuple
+
+from .chatbot import ChatBot, DEGRADED_REPLY, ERROR_REPLY
+from .chat_utils import is_valid_name
+from .personality_pool import PersonalityPool
+from .profiling import profiler
+
+# Requests read ahead of the ones being answered, per unit of concurrency
+READ_AHEAD = 64
+
+class _Turn:
+    __slots__ = ("index", "request_id", "message", "read_at")
+
+    def __init__(self, index: int, request_id, message: str):
+        self.index = index
+        self.request_id = request_id
+        self.message = message
+        self.read_at = time.perf_counter()
+
+class _Conversation:
+    """The turns of one (user, AI personality) pair, answered in input order on one bot."""
+
+    __slots__ = ("user", "ai", "bot", "error", "turns", "running")
+
+    def __init__(self, user: str, ai: str):
+        self.user = user
+        self.ai = ai
+        self.bot: Optional[ChatBot] = None
+        self.error: Optional[str] = None
+        self.turns: Deque[_Turn] = deque()
+        self.running = False
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 1)
+
+class BatchRunner:
+    """Answers conversation requests read as JSONL and writes one JSON result per request.
+
+    Each input line is {"user": ..., "ai": ..., "message": ...}, optionally with
+    an "id" that is copied to its result. User and AI names must match
+    NAME_PATTERN, as in server mode; lines that don't get an error result
+    without running. Lines for the same user and AI
+    personality form one conversation and are answered in input order, with
+    the history and relationship updates of earlier turns; different
+    conversations run concurrently on up to concurrency threads. Results are
+    written as they complete, with their input line number and per-turn timings
+    in milliseconds:
+
+        queue_ms    from reading the request to starting it
+        wait_ms     waiting for the previous turn's updates in the conversation
+        reply_ms    building the prompt and generating the reply
+        record_ms   recording the exchange (the analysis itself runs in the background)
+        total_ms    from reading the request to writing its result
+
+    When every request is answered, each conversation is ended as a session,
+    moving it into the AI's episodic memory.
+    """
+
+    def __init__(self, output: IO[str], concurrency: int = 4, pool: Optional[PersonalityPool] = None):
+        self.output = output
+        self.concurrency = max(1, concurrency)
+        self.pool = pool
+        self._conversations: Dict[Tuple[str, str], _Conversation] = {}
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch")
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.concurrency * READ_AHEAD)
+        self._idle = threading.Condition(self._lock)
+        self._running = 0
+        self.results = {"ok": 0, "degraded": 0, "error": 0}
+        self._reply_ms: List[float] = []
+        self._total_ms: List[float] = []
+
+    def run(self, source: IO[str]) -> Dict:
+        """Answer every request in source; returns a summary of the run."""
+        started = time.perf_counter()
+        index = -1
+        for line in source:
+            if not line.strip():
+                continue
+            index += 1
+            try:
+                request = json.loads(line)
+                user, ai, message = (request.get(field) for field in ("user", "ai", "message"))
+                if not all(isinstance(value, str) and value.strip() for value in (user, ai, message)):
+                    raise ValueError('each line needs non-empty "user", "ai" and "message" strings')
+                user, ai = user.strip(), ai.strip()
+                for field, value in (("user", user), ("ai", ai)):
+                    if not is_valid_name(value):
+                        raise ValueError(f'"{field}" must be 1-64 letters, digits, \'-\' or \'_\'')
+            except (ValueError, AttributeError) as e:
+                self._write({"index": index, "status": "error", "error": f"Invalid request: {e}"}, "error")
+                continue
+            self._slots.acquire()
+            self._enqueue(user, ai, _Turn(index, request.get("id"), message))
+
+        with self._idle:
+            while self._running:
+                self._idle.wait()
+        self._end_sessions()
+        self._executor.shutdown()
+
+        elapsed = time.perf_counter() - started
+        answered = sum(self.results.values())
+        return {
+            "requests": answered,
+            "conversations": len(self._conversations),
+            **self.results,
+            "seconds": round(elapsed, 2),
+            "turns_per_second": round(answered / elapsed, 2) if elapsed else None,
+            "reply_ms_p50": _percentile(self._reply_ms, 0.5),
+            "reply_ms_p95": _percentile(self._reply_ms, 0.95),
+            "total_ms_p95": _percentile(self._total_ms, 0.95),
+        }
+
+    def _enqueue(self, user: str, ai: str, turn: _Turn) -> None:
+        with self._lock:
+            conversation = self._conversations.get((user, ai))
+            if conversation is None:
+                conversation = self._conversations[(user, ai)] = _Conversation(user, ai)
+            conversation.turns.append(turn)
+            if conversation.running:
+                return
+            conversation.running = True
+            self._running += 1
+        self._executor.submit(self._drain, conversation)
+
+    def _drain(self, conversation: _Conversation) -> None:
+        """Answer the conversation's queued turns until none are left."""
+        while True:
+            with self._lock:
+                if not conversation.turns:
+                    conversation.running = False
+                    self._running -= 1
+                    self._idle.notify_all()
+                    return
+                turn = conversation.turns.popleft()
+            try:
+                self._answer(conversation, turn)
+            except Exception as e:
+                self._write(self._result(conversation, turn, status="error", error=str(e)), "error")
+            finally:
+                self._slots.release()
+
+    def _answer(self, conversation: _Conversation, turn: _Turn) -> None:
+        started = time.perf_counter()
+        if conversation.bot is None and conversation.error is None:
+            try:
+                conversation.bot = ChatBot(conversation.ai, pool=self.pool)
+            except Exception as e:
+                conversation.error = str(e)
+        if conversation.error is not None:
+            self._write(self._result(conversation, turn, status="error", error=conversation.error), "error")
+            return
+
+        bot = conversation.bot
+        # The prompt reads the relationship file, so the previous turn's update must be in
+        bot.wait_for_updates()
+        replying = time.perf_counter()
+        reply = bot.get_response(turn.message, conversation.user, record=False)
+        recording = time.perf_counter()
+        bot.record_exchange(turn.message, reply, conversation.user, background=True)
+        done = time.perf_counter()
+        profiler.tick()
+
+        status = "ok"
+        if reply == ERROR_REPLY:
+            status = "error"
+        elif reply == DEGRADED_REPLY:
+            status = "degraded"
+        timings = {
+            "queue_ms": (started - turn.read_at) * 1000,
+            "wait_ms": (replying - started) * 1000,
+            "reply_ms": (recording - replying) * 1000,
+            "record_ms": (done - recording) * 1000,
+            "total_ms": (done - turn.read_at) * 1000,
+        }
+        with self._lock:
+            self._reply_ms.append(timings["reply_ms"])
+            self._total_ms.append(timings["total_ms"])
+        result = self._result(conversation, turn, status=status, reply=reply)
+        result["timings"] = {name: round(value, 1) for name, value in timings.items()}
+        self._write(result, status)
+
+    @staticmethod
+    def _result(conversation: _Conversation, turn: _Turn, **fields) -> Dict:
+        result = {"index": turn.index}
+        if turn.request_id is not None:
+            result["id"] = turn.request_id
+        result.update(user=conversation.user, ai=conversation.ai, **fields)
+        return result
+
+    def _write(self, result: Dict, status: str) -> None:
+        line = json.dumps(result, ensure_ascii=False)
+        with self._write_lock:
+            self.results[status] += 1
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def _end_sessions(self) -> None:
+        bots = []
+        for conversation in self._conversations.values():
+            if conversation.bot is not None:
+                conversation.bot.end_session(conversation.user)
+                bots.append(conversation.bot)
+        for bot in bots:
+            try:
+                bot.close()
+            except Exception as e:
+                print(f"Error in {bot.name}'s updates: {e}")
+
+def run_batch(source: IO[str], output: IO[str], concurrency: int = 4,
+              pool: Optional[PersonalityPool] = None) -> Dict:
+    """Answer the JSONL requests in source, writing JSONL results to output (see BatchRunner)."""
+    return BatchRunner(output, concurrency, pool).run(source)
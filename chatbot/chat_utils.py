@@ -1,6 +1,13 @@
 # chatbot/chat_utils.py
+import re
 from typing import Dict
 
+# Personality and user names end up in file paths, so keep them to a safe alphabet
+NAME_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+def is_valid_name(value) -> bool:
+    return isinstance(value, str) and NAME_PATTERN.fullmatch(value) is not None
+
 def create_welcome_message(name: str, user_profile: Dict, core_identity: Dict, emotional: Dict) -> str:
     relationship = user_profile.get('relationship', {})
     trust_level = relationship.get('trust_level', 0.0)
@@ -1,37 +1,54 @@
 # chatbot/chatbot.py
 import os
-from dotenv import load_dotenv
-from typing import Optional, Dict, List
-from openai import OpenAI
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional, Dict, FrozenSet, List, Iterator
 from .personality_manager import PersonalityManager
-from .relationship_manager import RelationshipManager
+from .relationship_manager import relationship_context
+from .personality_pool import PersonalityPool, default_pool
+from .memory_manager import MemoryManager
+from .dedup import merge_list, top_entries
+from .tracing import span
+from .token_ledger import token_ledger, pair_key
+from .model_router import model_router
+from .circuit_breaker import CircuitOpenError
+from .novelty import novelty_gate, data_keywords, count_entries
+from .job_journal import job_journal, register_job, has_handler, run_job, already_applied, mark_applied, Job
 import json
 
+# Reply given while every reply route's circuit breaker is open
+DEGRADED_REPLY = "I'm having trouble thinking right now. Give me a moment and try again."
+
+# Reply given when a completion fails
+ERROR_REPLY = "I'm sorry, I encountered an error. Could you please try again?"
+
 class ChatBot:
-    def __init__(self, personality_name: Optional[str] = None, is_user: bool = False):
-        # Load environment variables from .env file
-        load_dotenv()
-        
-        # Check for API key
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OpenAI API key not found in environment variables or .env file")
-            
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, personality_name: Optional[str] = None, is_user: bool = False,
+                 pool: Optional[PersonalityPool] = None):
+        # Completions go through model_router, whose providers only need
+        # credentials once a call is made
         self.personality_manager = PersonalityManager()
         self.name = personality_name
         self.is_user = is_user
         self.conversation_history = []
+        self.relationship_manager = None
+        # Post-reply analysis runs here when deferred, one update at a time in submission order
+        self._update_executor: Optional[ThreadPoolExecutor] = None
+        self._pending_update: Optional[Future] = None
         
         if personality_name:
-            success = self.personality_manager.load_personality(personality_name, is_user)
-            if not success:
-                raise ValueError(f"Failed to load personality: {personality_name}")
+            # Loaded personalities are shared through the pool, so repeated
+            # bots for the same personality don't re-read its files
+            loaded = (pool or default_pool).get(personality_name, is_user)
+            self.personality_manager = loaded.personality_manager
             # Initialize relationship manager only for AI personalities
             if not is_user:
-                self.relationship_manager = RelationshipManager(self.personality_manager.personality_dir)
+                self.relationship_manager = loaded.relationship_manager
         else:
             self._select_personality()
+        
+        # Promotion and consolidation run on this bot's update thread, episodes as journaled jobs
+        self.memory = MemoryManager(self.personality_manager, self.name, submit=self.submit_update,
+                                    submit_job=self.submit_job)
 
     def _select_personality(self) -> None:
         """Prompt for personality selection or user name."""
@@ -78,76 +95,185 @@ class ChatBot:
                     pass
                 print("Invalid choice. Please try again.")
 
-    def get_response(self, message: str, other_name: Optional[str] = None) -> str:
-        """Get a response from the AI, updating relationship data if available."""
+    def get_response(self, message: str, other_name: Optional[str] = None, record: bool = True) -> str:
+        """Get a response from the AI, updating relationship data if available.
+
+        With record=False the caller is responsible for calling record_exchange.
+        """
+        response_content = None
         try:
-            # Load relationship data if available
-            relationship_context = ""
-            if self.relationship_manager and other_name:
-                relationship_data = self.relationship_manager.load_relationship(other_name)
-                if relationship_data:
-                    relationship_context = self._create_relationship_context(relationship_data)
-            
-            # Create system message with relationship context
-            system_content = self._create_system_message(other_name)
-            
-            # Prepare messages for API
-            messages = [
-                {"role": "system", "content": system_content}
-            ] + self.conversation_history[-10:]  # Keep last 10 messages for context
-            
-            # Add the current message
-            messages.append({"role": "user", "content": message})
+            with span("prompt_build", self.name):
+                messages = self._build_messages(message, other_name)
             
             # Get response from OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=1000,
-                temperature=0.7
-            )
+            with span("completion", self.name):
+                response = model_router.complete("reply", messages, self.name, pair_key(self.name, other_name))
             
             response_content = response.choices[0].message.content
             
             # Return the response immediately
             return response_content
             
+        except CircuitOpenError as e:
+            # The upstream is known to be down: answer at once instead of waiting on it
+            print(f"Skipping completion: {e}")
+            return DEGRADED_REPLY
         except Exception as e:
             print(f"Error in get_response: {e}")
-            return "I'm sorry, I encountered an error. Could you please try again?"
+            return ERROR_REPLY
         finally:
             # Update conversation history and relationships after returning the response
-            try:
-                # Update conversation history
-                self.conversation_history.append({"role": "user", "content": message})
-                self.conversation_history.append({"role": "assistant", "content": response_content})
-                
-                # Update relationship if available
-                if self.relationship_manager and other_name:
-                    self.relationship_manager.update_relationship(
-                        other_name,
-                        [{"speaker": self.name, "message": response_content}]
-                    )
-                
-                # Update personality every 5 messages
-                if len(self.conversation_history) % 5 == 0:
-                    print(f"\nUpdating {self.name}'s personality based on recent interactions...")
-                    self._update_personality(message, other_name)
-            except Exception as e:
-                print(f"Error in post-response updates: {e}")
+            if record and response_content is not None:
+                self.record_exchange(message, response_content, other_name)
+
+    def stream_response(self, message: str, other_name: Optional[str] = None, record: bool = True) -> Iterator[str]:
+        """Yield the response in chunks as it is generated, then run the usual post-response updates."""
+        response_content = None
+        parts = []
+        try:
+            with span("prompt_build", self.name):
+                messages = self._build_messages(message, other_name)
+            
+            with span("completion", self.name):
+                stream = model_router.stream("reply", messages, self.name, pair_key(self.name, other_name))
+            
+                for chunk in stream:
+                    # The usage block arrives on a final chunk without choices
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+            
+            response_content = "".join(parts)
+            
+        except CircuitOpenError as e:
+            print(f"Skipping completion: {e}")
+            if not parts:
+                yield DEGRADED_REPLY
+        except Exception as e:
+            print(f"Error in stream_response: {e}")
+            if not parts:
+                yield ERROR_REPLY
+        finally:
+            if record and response_content is not None:
+                self.record_exchange(message, response_content, other_name)
+
+    def _build_messages(self, message: str, other_name: Optional[str] = None) -> List[Dict]:
+        """Assemble the API messages for a reply: system prompt, recent history and the new message."""
+        # Create system message with relationship context
+        system_content = self._create_system_message(other_name)
+        
+        # Prepare messages for API: older turns of this session are represented by
+        # the running session summary, followed by the most recent turns verbatim
+        messages = [{"role": "system", "content": system_content}]
+        if self.memory.session_summary:
+            messages.append({"role": "system",
+                             "content": f"Summary of the earlier part of this conversation:\n{self.memory.session_summary}"})
+        messages += self.memory.recent_messages(self.conversation_history)
+        
+        # Add the current message
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    def record_exchange(self, message: str, response_content: str, other_name: Optional[str] = None,
+                        background: bool = False) -> None:
+        """Update conversation history, relationship and personality after a reply.
+
+        The relationship and personality analysis is journaled as jobs first, so it
+        is resumed after a crash. With background=True only the history is updated
+        before returning and the jobs run on the update thread.
+        """
+        # Update conversation history
+        self.conversation_history.append({"role": "user", "content": message})
+        self.conversation_history.append({"role": "assistant", "content": response_content})
+        history_length = len(self.conversation_history)
+        try:
+            self.memory.fold_history(self.conversation_history, other_name)
+            self.memory.evict_working_memory(self.conversation_history, other_name)
+            
+            jobs = []
+            # Update relationship if available, from both sides of the exchange
+            if self.relationship_manager and other_name:
+                jobs.append(self._enqueue("relationship", other_name=other_name,
+                                          conversation=[{"speaker": other_name, "message": message},
+                                                        {"speaker": self.name, "message": response_content}]))
+            # Update personality every 5 messages, unless the message adds nothing new
+            if history_length % 5 == 0 and novelty_gate.should_analyze(
+                    "personality", self.name, other_name, message, self.known_keywords(other_name)):
+                jobs.append(self._enqueue("personality", message=message, other_name=other_name))
+            for job in jobs:
+                if background:
+                    self.submit_update(run_job, self, job.key)
+                else:
+                    run_job(self, job.key)
+        except Exception as e:
+            # The reply is already given; a failed update must not replace it
+            print(f"Error in post-response updates: {e}")
+
+    def _enqueue(self, kind: str, **args) -> Job:
+        return job_journal.enqueue(kind, self.name, dict(args, is_user=self.is_user))
+
+    def submit_job(self, kind: str, **args) -> Future:
+        """Journal a job for this bot and run it on the update thread."""
+        return self.submit_update(run_job, self, self._enqueue(kind, **args).key)
+
+    def known_keywords(self, other_name: Optional[str] = None) -> FrozenSet[str]:
+        """Keywords of this personality and its relationship with other_name, for the novelty gate."""
+        known = self.personality_manager.keywords()
+        if self.relationship_manager and other_name:
+            relationship_data = self.relationship_manager.load_relationship(other_name)
+            if relationship_data:
+                known = known | data_keywords(relationship_data)
+        return known
+
+    def submit_update(self, fn: Callable, *args) -> Future:
+        """Run fn(*args) on this bot's update thread after everything submitted before it."""
+        if self._update_executor is None:
+            self._update_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"updates-{self.name}")
+        self._pending_update = self._update_executor.submit(fn, *args)
+        return self._pending_update
+
+    def end_session(self, other_name: Optional[str]) -> None:
+        """Move the session's conversation into episodic memory; the summary is written in the background."""
+        self.memory.end_session(self.conversation_history, other_name)
+
+    def wait_for_updates(self) -> None:
+        """Block until every update submitted so far has finished."""
+        pending = self._pending_update
+        if pending is not None:
+            with span("update_wait", self.name):
+                pending.result()
+
+    def close(self) -> None:
+        """Wait for the submitted updates, then stop the update thread; a later update starts a new one."""
+        try:
+            self.wait_for_updates()
+        finally:
+            if self._update_executor is not None:
+                self._update_executor.shutdown()
+                self._update_executor = None
 
     def _create_relationship_context(self, relationship_data: Dict) -> str:
         """Create context from relationship data."""
         context = []
         
+        # Summaries of older interactions that have been rolled out of the raw fields
+        summary = relationship_context(relationship_data)
+        if summary:
+            context.append(summary + "\n")
+        
         if relationship_data["interactions"]:
             context.append("Previous interactions:")
             for interaction in relationship_data["interactions"][-3:]:  # Last 3 interactions
                 context.append(f"- {interaction}")
         
-        if relationship_data["observed_traits"]:
+        # The strongest traits by how often and how recently they were observed
+        traits = top_entries(relationship_data, "observed_traits")
+        if traits:
             context.append("\nObserved traits:")
-            for trait in relationship_data["observed_traits"]:
+            for trait in traits:
                 context.append(f"- {trait}")
         
         if relationship_data["emotional_dynamics"]["trust_level"] != "neutral":
@@ -189,6 +315,12 @@ class ChatBot:
         print(f"\n{'='*50}")
         print(f"Analyzing conversation for {listener.name}'s personality updates...")
         
+        pair = pair_key(listener.name, speaker_name)
+        if not token_ledger.allow("personality", listener.name, pair):
+            print(f"Deferring analysis: {listener.name} is over today's token budget")
+            print(f"{'='*50}\n")
+            return
+        
         system_prompt = f"""You are a personality analyzer. Your task is to analyze this conversation and return ONLY a valid JSON object.
 
 IMPORTANT: Your entire response must be a valid JSON object, nothing else.
@@ -267,12 +399,9 @@ Only include files that need updates. Ensure the response is valid JSON."""
             print(f"\nSending conversation analysis request for {listener.name}...")
             
             # Get analysis from GPT
-            response = listener.client.chat.completions.create(
-                model="gpt-4o-mini",  # Using GPT-4 for better analysis
-                messages=messages,
-                max_tokens=2000,  # Increased for more detailed analysis
-                temperature=0.7
-            )
+            with span("personality_analysis", listener.name):
+                # Larger than the route default for a more detailed analysis
+                response = model_router.complete("personality", messages, listener.name, pair, max_tokens=2000)
             
             response_content = response.choices[0].message.content
             print("\nAnalysis received. Processing updates...")
@@ -286,14 +415,11 @@ Only include files that need updates. Ensure the response is valid JSON."""
                 # Apply updates to listener's personality files
                 for filename, new_data in updates.items():
                     try:
-                        # Get current data from personality manager
-                        current_data = listener.personality_manager.current_personality.get(filename, {})
-                        
-                        # Merge new data with current data
-                        merged_data = self._merge_data(current_data, new_data)
-                        
-                        # Save the updated data
-                        listener.personality_manager.save_personality_file(filename, merged_data)
+                        # Merge new data into the saved file, re-reading it first if another
+                        # process changed it since it was loaded
+                        merged_data = listener.personality_manager.update_personality_file(
+                            filename, new_data, self._merge_data
+                        )
                             
                         print(f"\n✅ Successfully updated {listener.name}'s {filename}")
                         print(f"Updated content preview:")
@@ -322,40 +448,35 @@ Only include files that need updates. Ensure the response is valid JSON."""
                     current_data[key] = {}
                 current_data[key] = self._merge_data(current_data[key], value)
             elif isinstance(value, list):
-                if key not in current_data:
-                    current_data[key] = []
-                current_data[key].extend(item for item in value if item not in current_data[key])
+                # Near-duplicates of existing entries are counted instead of appended
+                merge_list(current_data, key, value)
             else:
                 current_data[key] = value
         return current_data
 
     def _create_system_message(self, other_name: Optional[str] = None) -> str:
         """Create a system message that includes personality and relationship context."""
-        # Load personality files
-        personality_files = [
-            "core-identity.json",
-            "interests-values.json",
-            "emotional-framework.json"
-        ]
-        
-        personality_description = []
-        for file_name in personality_files:
-            file_path = os.path.join(self.personality_manager.base_dir, self.name, file_name)
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    personality_description.append(json.load(f))
+        # Personality sections come from the loaded personality, rendered once per version
+        context = [self.personality_manager.prompt_fragment()]
         
         # Add relationship context if available
         if self.relationship_manager and other_name:
             relationship_data = self.relationship_manager.load_relationship(other_name)
             if relationship_data:
                 relationship_context = self._create_relationship_context(relationship_data)
-                personality_description.append(relationship_context)
+                if relationship_context:
+                    context.append(f"Your relationship with {other_name}:\n{relationship_context}")
+        
+        # Remembered facts and earlier sessions, within a fixed token budget
+        memory_context = self.memory.context(other_name)
+        if memory_context:
+            context.append(memory_context)
         
         # Create a comprehensive system message
+        context_text = "\n\n".join(context)
         return f"""You are {self.name}, an AI personality with the following characteristics:
 
-{json.dumps(personality_description, indent=2)}
+{context_text}
 
 IMPORTANT CONVERSATION GUIDELINES:
 1. Keep responses concise and natural, typically 1-3 sentences.
@@ -380,14 +501,40 @@ IMPORTANT CONVERSATION GUIDELINES:
 
 Remember: Your goal is to have engaging, dynamic conversations that naturally flow between different subjects while maintaining depth and authenticity. Keep the conversation fresh and interesting by regularly introducing new topics and perspectives."""
 
-    def _update_personality(self, message: str, other_name: str):
-        """Update personality based on the conversation."""
-        try:
-            # Get current personality data
-            current_data = self.personality_manager.current_personality
-            
-            # Create system prompt for personality update
-            system_prompt = f"""You are a personality analyzer. Your task is to analyze this conversation and return ONLY a valid JSON object.
+    def apply_personality_updates(self, updates: Dict, job_key: Optional[str] = None) -> int:
+        """Merge analyzer updates into the personality files, once per job_key and file.
+
+        Returns how many list entries were new rather than folded into existing ones.
+        """
+        added = 0
+        
+        def merge(current_data: Dict, new_data: Dict) -> Dict:
+            nonlocal added
+            if job_key and already_applied(current_data, job_key):
+                return current_data
+            before = count_entries(current_data)
+            merged_data = self._merge_data(current_data, new_data)
+            added += count_entries(merged_data) - before
+            return mark_applied(merged_data, job_key) if job_key else merged_data
+        
+        for filename, new_data in updates.items():
+            try:
+                # Merge new data into the saved file, re-reading it first if another
+                # process changed it since it was loaded
+                self.personality_manager.update_personality_file(filename, new_data, merge)
+            except Exception as e:
+                # print(f"❌ Error updating {filename}: {e}")
+                pass
+        return added
+
+    def _analyze_personality(self, message: str, other_name: str) -> Optional[Dict]:
+        """Ask the analyzer what the conversation adds to this personality; None if over budget."""
+        pair = pair_key(self.name, other_name)
+        if not token_ledger.allow("personality", self.name, pair):
+            return None
+        
+        # Create system prompt for personality update
+        system_prompt = f"""You are a personality analyzer. Your task is to analyze this conversation and return ONLY a valid JSON object.
 
 IMPORTANT: Your entire response must be a valid JSON object, nothing else.
 
@@ -405,59 +552,80 @@ Return format must be exactly:
     }},
     "social-dynamics.json": {{
         "relationship_dynamics": {{
-            "with_{other_name}": {{
-                "interactions": ["new interaction 1"],
-                "observed_traits": ["trait 1"]
-            }}
+        "with_{other_name}": {{
+            "interactions": ["new interaction 1"],
+            "observed_traits": ["trait 1"]
+        }}
         }}
     }}
 }}
 
 Only include files that need updates. Ensure the response is valid JSON."""
-            
-            # Format the conversation for analysis
-            conversation_text = f"{other_name}: {message}"
-            
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Analyze this conversation:\n\n{conversation_text}"}
-            ]
-            
-            # Get analysis from GPT
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=1000,
-                temperature=0.7
-            )
-            
-            response_content = response.choices[0].message.content
-            
-            try:
-                # Try to parse the JSON response
-                updates = json.loads(response_content)
-                
-                # Apply updates to personality files
-                for filename, new_data in updates.items():
-                    try:
-                        # Get current data from personality manager
-                        current_data = self.personality_manager.current_personality.get(filename, {})
-                        
-                        # Merge new data with current data
-                        merged_data = self._merge_data(current_data, new_data)
-                        
-                        # Save the updated data
-                        self.personality_manager.save_personality_file(filename, merged_data)
-                        
-                    except Exception as e:
-                        # print(f"❌ Error updating {filename}: {e}")
-                        pass
-                
-            except json.JSONDecodeError as e:
-                # print(f"❌ Error parsing GPT response as JSON: {e}")
-                # print("Raw response was:", response_content)
-                pass
         
-        except Exception as e:
-            # print(f"❌ Error in personality update process: {e}")
-            pass
\ No newline at end of file
+        # Format the conversation for analysis
+        conversation_text = f"{other_name}: {message}"
+        
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Analyze this conversation:\n\n{conversation_text}"}
+        ]
+        
+        # Get analysis from GPT
+        with span("personality_analysis", self.name):
+            response = model_router.complete("personality", messages, self.name, pair)
+        
+        response_content = response.choices[0].message.content
+        return json.loads(response_content)
+
+# Post-reply analysis jobs. Analysis returns the updates (None when over budget)
+# and is stored in the journal before they are applied, so a resumed job applies
+# the stored updates instead of analyzing again.
+
+def _analyze_relationship_job(bot: ChatBot, job: Job) -> Optional[Dict]:
+    with span("relationship_update", bot.name):
+        return bot.relationship_manager.analyze_relationship(job.args["other_name"], job.args["conversation"])
+
+def _apply_relationship_job(bot: ChatBot, job: Job, updates: Dict) -> None:
+    bot.relationship_manager.apply_relationship_update(job.args["other_name"], updates, job.key)
+
+def _analyze_personality_job(bot: ChatBot, job: Job) -> Optional[Dict]:
+    print(f"\nUpdating {bot.name}'s personality based on recent interactions...")
+    with span("personality_update", bot.name):
+        return bot._analyze_personality(job.args["message"], job.args["other_name"])
+
+def _apply_personality_job(bot: ChatBot, job: Job, updates: Dict) -> None:
+    added = bot.apply_personality_updates(updates, job.key)
+    novelty_gate.record_yield(job.kind, bot.name, added, count_entries(updates))
+
+def _analyze_episode_job(bot: ChatBot, job: Job) -> Optional[str]:
+    return bot.memory.summarize_episode(job.args["other_name"], job.args["messages"])
+
+def _apply_episode_job(bot: ChatBot, job: Job, summary: str) -> None:
+    bot.memory.record_episode(job.args["other_name"], summary, len(job.args["messages"]), job.key)
+
+register_job("relationship", _analyze_relationship_job, _apply_relationship_job)
+register_job("personality", _analyze_personality_job, _apply_personality_job)
+register_job("episode", _analyze_episode_job, _apply_episode_job)
+
+def resume_jobs(pool: Optional[PersonalityPool] = None,
+                owns: Optional[Callable[[str], bool]] = None) -> List[ChatBot]:
+    """Queue the jobs an earlier process left unfinished, on one bot per personality.
+
+    owns, if given, limits this to the personalities it returns True for. Returns the bots the jobs were queued on; their wait_for_updates() waits for them.
+    """
+    bots: Dict[tuple, ChatBot] = {}
+    for job in job_journal.unfinished():
+        if not has_handler(job.kind) or (owns is not None and not owns(job.owner)):
+            continue
+        owner = (job.owner, bool(job.args.get("is_user")))
+        if owner not in bots:
+            try:
+                bots[owner] = ChatBot(job.owner, is_user=owner[1], pool=pool)
+            except Exception as e:
+                # Left in the journal for a run that can load the personality
+                print(f"Cannot resume jobs for {job.owner}: {e}")
+                bots[owner] = None
+        bot = bots[owner]
+        if bot is not None:
+            bot.submit_update(run_job, bot, job.key)
+    return [bot for bot in bots.values() if bot is not None]
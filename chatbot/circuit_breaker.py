@@ -0,0 +1,97 @@
+# chatbot/circuit_breaker.py
+import threading
+import time
+from typing import Dict, Optional
+
+# Consecutive failures (errors or missed deadlines) that open a breaker, and how
+# long it stays open before a single probe request is let through
+FAILURE_THRESHOLD = 5
+RESET_SECONDS = 30.0
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, message: str, retry_in: float = 0.0):
+        super().__init__(message)
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    """Closed, open or half-open state of one upstream.
+
+    Closed passes every request. After failure_threshold consecutive failures it
+    opens and requests fail fast for reset_after seconds. Then it is half-open:
+    one probe request goes through, and its outcome closes or reopens it.
+    """
+
+    __slots__ = ("failure_threshold", "reset_after", "_failures", "_opened_at", "_probe_started", "_lock")
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_after: float = RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if now - self._opened_at < self.reset_after:
+            return "open"
+        return "half_open"
+
+    def available(self) -> bool:
+        """Whether allow() could currently succeed, without claiming the probe."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            return state == "closed" or (state == "half_open" and not self._probing(now))
+
+    def _probing(self, now: float) -> bool:
+        # A probe that never reported back stops blocking others after reset_after
+        return self._probe_started is not None and now - self._probe_started < self.reset_after
+
+    def allow(self) -> bool:
+        """Whether a request may go out now; in half-open state this claims the single probe."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == "closed":
+                return True
+            if state == "open" or self._probing(now):
+                return False
+            self._probe_started = now
+            return True
+
+    def retry_in(self) -> float:
+        """Seconds until the breaker lets a request through again."""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_after - time.monotonic())
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._failures += 1
+            if self._probe_started is not None or self._failures >= self.failure_threshold:
+                # A failed probe reopens for another full period
+                self._opened_at = now
+                self._probe_started = None
+
+    def describe(self) -> Dict:
+        with self._lock:
+            now = time.monotonic()
+            return {"state": self._state(now), "consecutive_failures": self._failures,
+                    "retry_in": max(0.0, self._opened_at + self.reset_after - now) if self._opened_at else 0.0}
@@ -0,0 +1,378 @@
+# chatbot/cluster.py
+import asyncio
+import bisect
+import hashlib
+import json
+import multiprocessing
+import os
+from typing import Dict, List, Optional, Tuple
+
+from .server import (ChatServer, HTTPError, MAX_HEADER_BYTES, Request, _require_name, read_request,
+                     send_internal_error, send_json)
+
+# Points per worker on the hash ring; more points spread personalities more evenly
+VIRTUAL_NODES = 64
+
+# Seconds a new worker process gets to load and bind its port
+WORKER_START_TIMEOUT = 60
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class HashRing:
+    """Consistent hashing of personality names onto workers.
+
+    Each worker owns VIRTUAL_NODES points on the ring and a name belongs to the
+    worker owning the first point at or after the name's hash, so adding a
+    worker only moves the names that now fall on its points.
+    """
+
+    __slots__ = ("replicas", "members", "_points", "_owners")
+
+    def __init__(self, members: Tuple[str, ...] = (), replicas: int = VIRTUAL_NODES):
+        self.replicas = replicas
+        self.members: List[str] = []
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for member in members:
+            self.add(member)
+
+    def add(self, member: str) -> None:
+        if member in self.members:
+            return
+        self.members.append(member)
+        for replica in range(self.replicas):
+            point = _hash(f"{member}#{replica}")
+            position = bisect.bisect(self._points, point)
+            self._points.insert(position, point)
+            self._owners.insert(position, member)
+
+    def remove(self, member: str) -> None:
+        if member not in self.members:
+            return
+        self.members.remove(member)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != member]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def owner(self, name: str) -> str:
+        if not self._points:
+            raise ValueError("The hash ring has no members")
+        position = bisect.bisect(self._points, _hash(name)) % len(self._points)
+        return self._owners[position]
+
+    def partitions(self, names: List[str]) -> Dict[str, List[str]]:
+        """The names each member owns."""
+        owned: Dict[str, List[str]] = {member: [] for member in self.members}
+        for name in names:
+            owned[self.owner(name)].append(name)
+        return owned
+
+def _run_worker(worker_id: str, members: List[str], conn, max_inflight: int, max_queue: int) -> None:
+    """Entry point of a worker process: a ChatServer on a free local port, reported back through conn."""
+    from . import autonomous_chat  # noqa: F401  (registers its analysis job kind for resuming)
+    from .chatbot import resume_jobs
+
+    ring = HashRing(tuple(members))
+    # Only this worker writes its partition, so only its jobs are resumed here
+    resume_jobs(owns=lambda name: ring.owner(name) == worker_id)
+
+    server = ChatServer("127.0.0.1", 0, max_inflight=max_inflight, max_queue=max_queue)
+
+    async def serve() -> None:
+        await server.start()
+        conn.send(server.port)
+        conn.close()
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+class WorkerProcess:
+    __slots__ = ("id", "process", "port")
+
+    def __init__(self, worker_id: str, process, port: int):
+        self.id = worker_id
+        self.process = process
+        self.port = port
+
+    def describe(self) -> Dict:
+        return {"worker": self.id, "pid": self.process.pid, "port": self.port, "alive": self.process.is_alive()}
+
+class ClusterDispatcher:
+    """Front end of cluster mode: routes each request to the worker process owning its personality.
+
+    Personalities are partitioned across workers by consistent hashing on the
+    AI name, so each personality's files are written by one process. Session
+    requests go to the worker that created the session; sessions stay there
+    when workers are added, while new sessions follow the new partitioning.
+    Workers that die are restarted on their next request.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8080, workers: int = 2, max_inflight: int = 8,
+                 max_queue: int = 32, base_dir: str = "my-personality"):
+        self.host = host
+        self.port = port
+        self.initial_workers = workers
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.base_dir = base_dir
+        self.ring = HashRing()
+        self.workers: Dict[str, WorkerProcess] = {}
+        # Session id -> id of the worker holding the session
+        self.sessions: Dict[str, str] = {}
+        self.proxied: Dict[str, int] = {}
+        self._context = multiprocessing.get_context("spawn")
+        self._spawn_lock = asyncio.Lock()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    # Workers
+
+    def _personalities(self) -> List[str]:
+        ai_dir = os.path.join(self.base_dir, "ai")
+        if not os.path.isdir(ai_dir):
+            return []
+        return sorted(name for name in os.listdir(ai_dir) if os.path.isdir(os.path.join(ai_dir, name)))
+
+    def _spawn(self, worker_id: str, members: List[str]) -> WorkerProcess:
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_run_worker, name=worker_id, daemon=True,
+                                        args=(worker_id, members, sender, self.max_inflight, self.max_queue))
+        process.start()
+        sender.close()
+        if not receiver.poll(WORKER_START_TIMEOUT):
+            process.terminate()
+            raise RuntimeError(f"{worker_id} did not start within {WORKER_START_TIMEOUT} seconds")
+        return WorkerProcess(worker_id, process, receiver.recv())
+
+    async def add_worker(self) -> Dict:
+        """Start one more worker and move the personalities that now hash to it."""
+        async with self._spawn_lock:
+            names = self._personalities()
+            before = {name: self.ring.owner(name) for name in names} if self.ring.members else {}
+            worker_id = f"worker-{len(self.workers)}"
+            loop = asyncio.get_running_loop()
+            worker = await loop.run_in_executor(None, self._spawn, worker_id, self.ring.members + [worker_id])
+            self.workers[worker_id] = worker
+            self.ring.add(worker_id)
+        moved = [name for name, owner in before.items() if self.ring.owner(name) != owner]
+        print(f"Started {worker_id} on port {worker.port} (pid {worker.process.pid}); "
+              f"{len(moved)} of {len(names)} personalities moved to it")
+        return {"worker": worker_id, "port": worker.port, "moved": moved}
+
+    async def _worker(self, worker_id: str) -> WorkerProcess:
+        worker = self.workers[worker_id]
+        if worker.process.is_alive():
+            return worker
+        async with self._spawn_lock:
+            worker = self.workers[worker_id]
+            if not worker.process.is_alive():
+                print(f"{worker_id} exited with code {worker.process.exitcode}; restarting it")
+                loop = asyncio.get_running_loop()
+                worker = await loop.run_in_executor(None, self._spawn, worker_id, list(self.ring.members))
+                self.workers[worker_id] = worker
+                # Its sessions were in the old process
+                self.sessions = {session: owner for session, owner in self.sessions.items() if owner != worker_id}
+        return worker
+
+    def describe(self) -> Dict:
+        return {
+            "workers": [worker.describe() for worker in self.workers.values()],
+            "virtual_nodes": self.ring.replicas,
+            "partitions": self.ring.partitions(self._personalities()),
+            "sessions": len(self.sessions),
+            "proxied": dict(self.proxied),
+        }
+
+    # Serving
+
+    async def start(self) -> None:
+        for _ in range(self.initial_workers):
+            await self.add_worker()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  limit=MAX_HEADER_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        print(f"Cluster dispatcher listening on http://{self.host}:{self.port} with {len(self.workers)} workers")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for worker in self.workers.values():
+            worker.process.terminate()
+        for worker in self.workers.values():
+            worker.process.join(timeout=5)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = None
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    keep_open = await self._dispatch(request, reader, writer)
+                except HTTPError as e:
+                    await send_json(writer, e.status, {"error": e.message}, keep_alive=False)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    # e.g. a worker response that doesn't parse
+                    await send_internal_error(writer, e, upgraded=request is not None and request.is_websocket)
+                    break
+                if not keep_open:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _route(self, request: Request) -> str:
+        """The id of the worker that should handle request."""
+        parts = [part for part in request.path.split("/") if part]
+        if parts == ["sessions"] and request.method == "POST":
+            return self.ring.owner(_require_name(request.json(), "ai"))
+        if len(parts) >= 2 and parts[0] == "sessions":
+            worker_id = self.sessions.get(parts[1])
+            if worker_id is None:
+                raise HTTPError(404, f"Unknown session: {parts[1]}")
+            return worker_id
+        if len(parts) == 2 and parts[0] == "relationships":
+            return self.ring.owner(_require_name({"name": parts[1]}, "name"))
+        # Process-wide views (metrics, usage, routes) of one worker, the first unless ?worker= names one
+        worker_id = request.query.get("worker", [self.ring.members[0]])[0]
+        if worker_id not in self.workers:
+            raise HTTPError(404, f"Unknown worker: {worker_id}")
+        return worker_id
+
+    async def _dispatch(self, request: Request, reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter) -> bool:
+        """Handle one request; returns whether the client connection stays open."""
+        parts = [part for part in request.path.split("/") if part]
+        if parts == ["cluster"] and request.method == "GET":
+            await send_json(writer, 200, self.describe(), request.keep_alive)
+            return request.keep_alive
+        if parts == ["cluster", "workers"] and request.method == "POST":
+            await send_json(writer, 201, await self.add_worker(), request.keep_alive)
+            return request.keep_alive
+        if parts == ["health"] and request.method == "GET":
+            await send_json(writer, 200, await self._health(), request.keep_alive)
+            return request.keep_alive
+
+        worker = await self._worker(self._route(request))
+        self.proxied[worker.id] = self.proxied.get(worker.id, 0) + 1
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", worker.port,
+                                                                             limit=MAX_HEADER_BYTES)
+        except OSError as e:
+            raise HTTPError(502, f"{worker.id} is unreachable: {e}")
+        try:
+            upstream_writer.write(_encode_request(request))
+            await upstream_writer.drain()
+            if request.is_websocket:
+                # After the upgrade both directions are relayed until either side closes
+                await asyncio.gather(_relay(reader, writer), _relay(upstream_reader, upstream_writer, writer),
+                                     return_exceptions=True)
+                return False
+            status, body, keep_open = await self._relay_response(upstream_reader, writer, request.keep_alive)
+        finally:
+            upstream_writer.close()
+
+        if parts == ["sessions"] and status == 201:
+            self.sessions[json.loads(body)["session_id"]] = worker.id
+        elif len(parts) == 2 and parts[0] == "sessions" and request.method == "DELETE":
+            self.sessions.pop(parts[1], None)
+        return keep_open
+
+    async def _relay_response(self, upstream: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                              keep_alive: bool) -> Tuple[int, bytes, bool]:
+        """Copy a worker's response to the client; returns its status, body (if sized) and keep-alive."""
+        head = await upstream.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")[:-2]
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {line.split(":", 1)[0].strip().lower(): line.split(":", 1)[1].strip()
+                   for line in lines[1:] if ":" in line}
+        if "content-length" not in headers:
+            # Streamed replies run until the worker closes, so the client connection ends with them
+            writer.write(head)
+            await _relay(upstream, writer)
+            return status, b"", False
+        body = await upstream.readexactly(int(headers["content-length"]))
+        keep_alive = keep_alive and headers.get("connection", "").lower() != "close"
+        lines = [line for line in lines if not line.lower().startswith("connection:")]
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+        return status, body, keep_alive
+
+    async def _health(self) -> Dict:
+        workers = {}
+        for worker_id in list(self.workers):
+            worker = self.workers[worker_id]
+            entry = worker.describe()
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", worker.port)
+                try:
+                    writer.write(f"GET /health HTTP/1.1\r\nHost: {worker.id}\r\nConnection: close\r\n\r\n".encode())
+                    await writer.drain()
+                    response = await reader.read()
+                finally:
+                    writer.close()
+                entry["health"] = json.loads(response.split(b"\r\n\r\n", 1)[1])
+            except (OSError, ValueError, IndexError) as e:
+                entry["error"] = str(e)
+            workers[worker_id] = entry
+        healthy = all("health" in entry for entry in workers.values())
+        return {"status": "ok" if healthy else "degraded", "sessions": len(self.sessions), "workers": workers}
+
+def _encode_request(request: Request) -> bytes:
+    """The request as sent to a worker: one request per connection, except WebSocket upgrades."""
+    lines = [f"{request.method} {request.target} HTTP/1.1"]
+    for key, value in request.headers.items():
+        if key in ("content-length", "keep-alive") or (key == "connection" and not request.is_websocket):
+            continue
+        lines.append(f"{key}: {value}")
+    if not request.is_websocket:
+        lines.append("Connection: close")
+    lines.append(f"Content-Length: {len(request.body)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + request.body
+
+async def _relay(source: asyncio.StreamReader, destination: asyncio.StreamWriter,
+                 *close_after: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            data = await source.read(65536)
+            if not data:
+                break
+            destination.write(data)
+            await destination.drain()
+    except ConnectionError:
+        pass
+    finally:
+        for writer in (destination,) + close_after:
+            writer.close()
+
+def run_cluster(host: str = "127.0.0.1", port: int = 8080, workers: int = 2, max_inflight: int = 8,
+                max_queue: int = 32) -> None:
+    """Run the dispatcher and its worker processes until interrupted."""
+    dispatcher = ClusterDispatcher(host, port, workers, max_inflight=max_inflight, max_queue=max_queue)
+
+    async def main() -> None:
+        try:
+            await dispatcher.serve_forever()
+        finally:
+            await dispatcher.stop()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nCluster stopped.")
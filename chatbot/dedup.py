@@ -0,0 +1,291 @@
+# chatbot/dedup.py
+import heapq
+import math
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+# Jaccard similarity of character trigrams above which two entries count as the
+# same, provided they also pass compatible()
+SIMILARITY_THRESHOLD = 0.7
+
+# MinHash signature length and LSH banding: 16 bands of 2 rows make pairs at the
+# threshold collide in some band with probability >0.99 while most unrelated
+# pairs never meet, so a lookup only compares against a few candidates
+NUM_PERMUTATIONS = 32
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+
+# Sibling key holding, per list, how many times each canonical entry was seen (when more than once)
+COUNTS_KEY = "_counts"
+
+# Sibling key holding, per list, when each entry was last merged (epoch seconds)
+SEEN_KEY = "_seen"
+
+# Prompts carry the PROMPT_LIST_ITEMS strongest entries of each list, scored by
+# how often an entry was seen, halved for every HALF_LIFE_SECONDS since it was last seen
+PROMPT_LIST_ITEMS = 8
+HALF_LIFE_SECONDS = 14 * 24 * 3600
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [((i * 0x9E3779B1 + 0x7F4A7C15) % _MERSENNE_PRIME | 1, (i * 0x85EBCA77 + 0xC2B2AE3D) % _MERSENNE_PRIME)
+                 for i in range(1, NUM_PERMUTATIONS + 1)]
+
+# Words that describe how a trait showed rather than the trait itself
+_FILLER_WORDS = frozenset("""
+a an the and or of to in on for with about at by is are was were be been being has have had
+very really quite often always sometimes shows showing showed displays displaying displayed
+seems seemed appears tends nature personality attitude demeanor their his her its they he she
+""".split())
+
+# Light suffix stripping so "curiosity"/"curious" and "supporting"/"support" line up
+_SUFFIXES = (("iosity", "ious"), ("ious", "ious"), ("fulness", "ful"), ("ness", ""), ("ity", ""),
+             ("ing", ""), ("ed", ""), ("ly", ""), ("es", ""), ("s", ""))
+
+# Words that flip an entry's meaning; "n't" contractions count as "not"
+_NEGATIONS = frozenset("no not never none nobody nothing nowhere neither nor without cannot".split())
+
+def _stem(word: str) -> str:
+    for suffix, replacement in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) + len(replacement) >= 3:
+            return word[:len(word) - len(suffix)] + replacement
+    return word
+
+def normalize(text: str) -> str:
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    content = [_stem(word) for word in words if word not in _FILLER_WORDS]
+    return " ".join(content or words)
+
+@lru_cache(maxsize=65536)
+def shingles(text: str) -> FrozenSet[str]:
+    """Character trigrams of the normalized text, padded so short words still get a few."""
+    padded = f" {normalize(text)} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+@lru_cache(maxsize=65536)
+def signature(text: str) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(shingle.encode()) for shingle in shingles(text)] or [0]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+@lru_cache(maxsize=65536)
+def _negations(text: str) -> FrozenSet[str]:
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    return frozenset("not" if word.endswith("n't") else word
+                     for word in words if word in _NEGATIONS or word.endswith("n't"))
+
+@lru_cache(maxsize=65536)
+def _content_words(text: str) -> Tuple[str, ...]:
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    kept = " ".join(word for word in words if word not in _NEGATIONS and not word.endswith("n't"))
+    return tuple(normalize(kept).split())
+
+def _same_word(first: str, second: str) -> bool:
+    if first == second:
+        return True
+    return min(len(first), len(second)) >= 4 and (first.startswith(second) or second.startswith(first))
+
+def compatible(first: str, second: str) -> bool:
+    """Whether two similar entries can be folded without losing meaning.
+
+    They must carry the same negations, their shared content words must come in
+    the same order (so "Lucy asked Rob" stays apart from "Rob asked Lucy"), and
+    only one of them may have words the other lacks: an added detail folds, a
+    swapped word ("snakes" for "cakes") does not.
+    """
+    if _negations(first) != _negations(second):
+        return False
+    a, b = _content_words(first), _content_words(second)
+    used = [False] * len(b)
+    last, extra_in_a = -1, False
+    for word in a:
+        position = next((i for i, other in enumerate(b) if not used[i] and _same_word(word, other)), None)
+        if position is None:
+            extra_in_a = True
+            continue
+        if position < last:
+            return False
+        used[position] = True
+        last = position
+    return not (extra_in_a and not all(used))
+
+def similarity(first: str, second: str) -> float:
+    a, b = shingles(first), shingles(second)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+class LSHIndex:
+    """MinHash LSH over the string entries of one list, mapping near-duplicates to their first entry."""
+
+    __slots__ = ("items", "size", "_buckets", "_positions", "threshold")
+
+    def __init__(self, items: List[Any], threshold: float = SIMILARITY_THRESHOLD):
+        self.items = items
+        self.threshold = threshold
+        self.size = 0
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+        self._positions: Dict[str, int] = {}
+        for _ in range(len(items)):
+            self._index_next()
+
+    def _bands(self, text: str):
+        sig = signature(text)
+        for band in range(BANDS):
+            yield band, sig[band * ROWS:(band + 1) * ROWS]
+
+    def _index_next(self) -> None:
+        item = self.items[self.size]
+        if isinstance(item, str):
+            self._positions.setdefault(item, self.size)
+            for key in self._bands(item):
+                self._buckets.setdefault(key, []).append(self.size)
+        self.size += 1
+
+    def sync(self) -> None:
+        """Index entries appended to the list since the last call."""
+        while self.size < len(self.items):
+            self._index_next()
+
+    def find(self, text: str) -> Optional[int]:
+        """Position of the most similar compatible entry at or above the threshold, if any."""
+        if text in self._positions:
+            return self._positions[text]
+        candidates = set()
+        for key in self._bands(text):
+            candidates.update(self._buckets.get(key, ()))
+        best, best_score = None, self.threshold
+        for position in candidates:
+            score = similarity(text, self.items[position])
+            if score >= best_score and compatible(text, self.items[position]):
+                best, best_score = position, score
+        return best
+
+# Indexes of recently merged lists, reused while the list has only been appended to
+_MAX_INDEXES = 512
+_indexes: 'OrderedDict[int, LSHIndex]' = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def _index_for(items: List[Any]) -> LSHIndex:
+    with _indexes_lock:
+        index = _indexes.get(id(items))
+        if index is not None and index.items is items and index.size <= len(items):
+            _indexes.move_to_end(id(items))
+            index.sync()
+            return index
+        index = LSHIndex(items)
+        _indexes[id(items)] = index
+        while len(_indexes) > _MAX_INDEXES:
+            _indexes.popitem(last=False)
+        return index
+
+def merge_list(parent: Dict, key: str, new_items: List[Any]) -> None:
+    """Merge new_items into parent[key], folding exact and near-duplicate strings into existing entries.
+
+    A folded entry's count is kept in parent['_counts'][key]; entries seen once have no count.
+    The time every string entry was last merged is kept in parent['_seen'][key].
+    """
+    items = parent.setdefault(key, [])
+    index = _index_for(items)
+    now = int(time.time())
+    for item in new_items:
+        if not isinstance(item, str):
+            if item not in items:
+                items.append(item)
+                index.sync()
+            continue
+        position = index.find(item)
+        if position is None:
+            items.append(item)
+            index.sync()
+            canonical = item
+        else:
+            canonical = items[position]
+            counts = parent.setdefault(COUNTS_KEY, {}).setdefault(key, {})
+            counts[canonical] = counts.get(canonical, 1) + 1
+        parent.setdefault(SEEN_KEY, {}).setdefault(key, {})[canonical] = now
+
+def drop_counts(parent: Dict, key: str, removed: List[Any]) -> None:
+    """Forget the counts and last-seen times of entries removed from parent[key]."""
+    for stats_key in (COUNTS_KEY, SEEN_KEY):
+        stats = parent.get(stats_key, {}).get(key)
+        if stats:
+            for item in removed:
+                if isinstance(item, str):
+                    stats.pop(item, None)
+
+def share_keys(data: Any) -> Any:
+    """Make the _counts and _seen keys of parsed data the same string objects as the entries they count.
+
+    A parsed file holds a separate copy of each key; shared, every entry's
+    text is held once, and marshal encodes the repeats as back-references.
+    Returns data, which is updated in place.
+    """
+    if isinstance(data, dict):
+        for stats_key in (COUNTS_KEY, SEEN_KEY):
+            for key, stats in data.get(stats_key, {}).items():
+                items = data.get(key)
+                if stats and isinstance(items, list):
+                    entries = {item: item for item in items if isinstance(item, str)}
+                    data[stats_key][key] = {entries.get(item, item): value for item, value in stats.items()}
+        for key, value in data.items():
+            if isinstance(value, (dict, list)) and key not in (COUNTS_KEY, SEEN_KEY):
+                share_keys(value)
+    elif data and isinstance(data[0], (dict, list)):
+        # Lists hold either entries or nested records, so the first item tells which
+        for item in data:
+            share_keys(item)
+    return data
+
+def entry_score(count: int, last_seen: Optional[float], now: float) -> float:
+    """Log of count halved once per half-life since last_seen; -inf for entries never timestamped."""
+    if last_seen is None:
+        return -math.inf
+    return math.log(count) - max(now - last_seen, 0) / HALF_LIFE_SECONDS * math.log(2)
+
+def top_entries(parent: Dict, key: str, k: int = PROMPT_LIST_ITEMS, now: Optional[float] = None) -> List[Any]:
+    """The k strongest entries of parent[key] by decayed frequency, strongest first.
+
+    Only entries with a last-seen time are scored; if there are fewer than k,
+    the rest are entries merged before times were kept, by count and then
+    newest first.
+    """
+    items = parent.get(key, [])
+    if not items:
+        return []
+    counts = parent.get(COUNTS_KEY, {}).get(key, {})
+    seen = parent.get(SEEN_KEY, {}).get(key, {})
+    now = time.time() if now is None else now
+
+    scored = heapq.nlargest(k, seen.items(), key=lambda entry: entry_score(counts.get(entry[0], 1), entry[1], now))
+    chosen = [item for item, _ in scored if item in items]
+    if len(chosen) < k:
+        unseen = heapq.nlargest(k, (item for item in counts if item not in seen), key=counts.get)
+        chosen += [item for item in unseen if item in items][:k - len(chosen)]
+    for item in reversed(items):
+        if len(chosen) >= k:
+            break
+        if item not in chosen:
+            chosen.append(item)
+    return chosen
+
+def prompt_view(data: Any, k: int = PROMPT_LIST_ITEMS, now: Optional[float] = None) -> Any:
+    """Like public_view, with every list cut to its k strongest entries (see top_entries)."""
+    if isinstance(data, dict):
+        now = time.time() if now is None else now
+        return {key: top_entries(data, key, k, now) if isinstance(value, list) else prompt_view(value, k, now)
+                for key, value in data.items() if not str(key).startswith("_")}
+    if isinstance(data, list):
+        return [prompt_view(item, k, now) for item in data]
+    return data
+
+def public_view(data: Any) -> Any:
+    """Data without bookkeeping keys (those starting with '_'), for prompts."""
+    if isinstance(data, dict):
+        return {key: public_view(value) for key, value in data.items() if not str(key).startswith("_")}
+    if isinstance(data, list):
+        return [public_view(item) for item in data]
+    return data
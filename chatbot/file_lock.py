@@ -0,0 +1,137 @@
+# chatbot/file_lock.py
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows: locking then only covers threads of one process
+    fcntl = None
+
+# In-process locks are striped by path hash so unrelated files rarely wait on
+# each other without keeping one lock object per file ever touched. RLocks let
+# a thread holding one file's lock take another that hashes to the same stripe.
+LOCK_STRIPES = 64
+_stripes = [threading.RLock() for _ in range(LOCK_STRIPES)]
+
+class LockStats:
+    """Counters describing how often writers had to wait or re-merge."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+        self.conflicts = 0
+
+    def record_acquire(self, contended: bool, waited: float) -> None:
+        with self._lock:
+            self.acquisitions += 1
+            if contended:
+                self.contended += 1
+                self.wait_seconds += waited
+
+    def record_conflict(self) -> None:
+        with self._lock:
+            self.conflicts += 1
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "acquisitions": self.acquisitions,
+                "contended": self.contended,
+                "contention_rate": round(self.contended / self.acquisitions, 4) if self.acquisitions else 0.0,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "version_conflicts": self.conflicts,
+            }
+
+lock_stats = LockStats()
+
+def _lock_path(path: str) -> str:
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f".{filename}.lock")
+
+@contextmanager
+def locked(path: str) -> Iterator[None]:
+    """Hold an exclusive advisory lock on path across threads and processes."""
+    stripe = _stripes[zlib.crc32(os.path.abspath(path).encode()) % LOCK_STRIPES]
+    start = time.perf_counter()
+    contended = not stripe.acquire(blocking=False)
+    if contended:
+        stripe.acquire()
+    try:
+        fd = os.open(_lock_path(path), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    contended = True
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+            lock_stats.record_acquire(contended, time.perf_counter() - start)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+    finally:
+        stripe.release()
+
+Version = Optional[Tuple[int, int, int]]
+
+def _version_of(stat_result: os.stat_result) -> Tuple[int, int, int]:
+    # Atomic replaces give the file a new inode, so this changes on every write
+    return (stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size)
+
+def file_version(path: str) -> Version:
+    """Return an opaque version for path, or None if it doesn't exist."""
+    try:
+        return _version_of(os.stat(path))
+    except FileNotFoundError:
+        return None
+
+def read_json_versioned(path: str) -> Tuple[Dict, Version]:
+    """Read a JSON file together with the version of exactly the bytes read."""
+    with open(path, 'r') as f:
+        version = _version_of(os.fstat(f.fileno()))
+        return json.load(f), version
+
+def write_json_atomic(path: str, data: Dict, compact: bool = False) -> Version:
+    """Write JSON via a temporary file and rename so readers never see a partial file."""
+    def dump(f):
+        if compact:
+            json.dump(data, f, separators=(",", ":"))
+        else:
+            json.dump(data, f, indent=2)
+    return _replace_atomic(path, 'w', dump)
+
+def write_bytes_atomic(path: str, payload: bytes) -> Version:
+    """Write bytes via a temporary file and rename, like write_json_atomic."""
+    return _replace_atomic(path, 'wb', lambda f: f.write(payload))
+
+def _replace_atomic(path: str, mode: str, write: Callable) -> Version:
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        # mkstemp creates the file private; keep the permissions of the file we replace
+        try:
+            file_mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            file_mode = 0o644
+        os.chmod(tmp_path, file_mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return file_version(path)
@@ -0,0 +1,255 @@
+# chatbot/group_chat.py
+import json
+import re
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+from .chatbot import ChatBot, DEGRADED_REPLY, ERROR_REPLY
+from .circuit_breaker import CircuitOpenError
+from .job_journal import Job, register_job
+from .novelty import novelty_gate, count_entries
+from .tracing import span
+from .token_ledger import token_ledger
+from .model_router import model_router
+from .profiling import profiler
+
+# Turns of shared transcript sent with each reply: at least TRANSCRIPT_WINDOW,
+# with the oldest dropped TRANSCRIPT_BLOCK at a time so the prefix only changes
+# once per block instead of on every turn
+TRANSCRIPT_WINDOW = 12
+TRANSCRIPT_BLOCK = 12
+
+class GroupChat:
+    """A conversation between any number of AI personalities over one shared transcript.
+
+    Every reply prompt starts with the same group system message and transcript,
+    so the prefix is identical for all participants and can be served from the
+    provider's prompt cache; the transcript is trimmed in blocks, so the prefix
+    only grows between trims. Only the speaker's own persona follows it. Every
+    analysis_window turns a single analyzer call updates the personality and
+    relationship data of all participants, as a journaled job on the first
+    participant's update thread.
+    """
+
+    def __init__(self, delay: Optional[float] = None, analysis_window: int = 10):
+        # Same pacing target as AutonomousChat: minimum seconds per turn, or None
+        self.delay = delay
+        self.analysis_window = analysis_window
+        self.transcript: List[Dict] = []
+        self._last_spoke: Dict[str, int] = {}
+        self._pending_analysis: Optional[Future] = None
+
+    # Turn taking
+
+    def next_speaker(self, bots: List[ChatBot]) -> ChatBot:
+        """Someone addressed in the last message, otherwise whoever has been quiet longest."""
+        last = self.transcript[-1] if self.transcript else None
+        candidates = [bot for bot in bots if last is None or bot.name != last["speaker"]]
+        if last is not None:
+            addressed = [bot for bot in candidates
+                         if re.search(rf"\b{re.escape(bot.name)}\b", last["message"], re.IGNORECASE)]
+            if addressed:
+                candidates = addressed
+        return min(candidates, key=lambda bot: self._last_spoke.get(bot.name, -1))
+
+    # Prompts
+
+    def _shared_prefix(self, bots: List[ChatBot]) -> List[Dict]:
+        names = ", ".join(bot.name for bot in bots)
+        system = f"""This is a group conversation between {names}.
+
+GROUP CONVERSATION GUIDELINES:
+1. Each message is prefixed with the name of the person who said it.
+2. Reply with only your own next message, without a name prefix, typically 1-3 sentences.
+3. Talk to the group or to specific people by name; respond to whoever addressed you.
+4. Bring in people who have been quiet and move on from topics that have run their course."""
+        messages = [{"role": "system", "content": system}]
+        start = max(len(self.transcript) - TRANSCRIPT_WINDOW, 0) // TRANSCRIPT_BLOCK * TRANSCRIPT_BLOCK
+        for entry in self.transcript[start:]:
+            messages.append({"role": "user", "content": f"{entry['speaker']}: {entry['message']}"})
+        return messages
+
+    def _persona(self, speaker: ChatBot, bots: List[ChatBot]) -> str:
+        parts = [speaker._create_system_message()]
+        if speaker.relationship_manager:
+            for other in bots:
+                if other is speaker:
+                    continue
+                context = speaker._create_relationship_context(speaker.relationship_manager.load_relationship(other.name))
+                if context:
+                    parts.append(f"Your relationship with {other.name}:\n{context}")
+        parts.append(f"It is now your turn to speak as {speaker.name}.")
+        return "\n\n".join(parts)
+
+    def take_turn(self, speaker: ChatBot, bots: List[ChatBot]) -> str:
+        model_router.wait_until_available("reply")
+        with span("prompt_build", speaker.name):
+            messages = self._shared_prefix(bots) + [{"role": "system", "content": self._persona(speaker, bots)}]
+        try:
+            with span("completion", speaker.name):
+                response = model_router.complete("reply", messages, speaker.name, "group")
+            message = response.choices[0].message.content.strip()
+        except CircuitOpenError as e:
+            print(f"Skipping completion: {e}")
+            message = DEGRADED_REPLY
+        except Exception as e:
+            print(f"Error in group reply: {e}")
+            message = ERROR_REPLY
+        # Models sometimes echo the transcript format
+        if message.startswith(f"{speaker.name}:"):
+            message = message[len(speaker.name) + 1:].strip()
+        self._last_spoke[speaker.name] = len(self.transcript)
+        self.transcript.append({"speaker": speaker.name, "message": message})
+        return message
+
+    # Batched analysis
+
+    @staticmethod
+    def analyze_window(bots: List[ChatBot], window: List[Dict]) -> Optional[Dict]:
+        """Ask one analyzer call for every participant's personality and relationship updates.
+
+        Returns the updates per participant name, or None when the analysis is
+        deferred because every participant is over budget. Errors are raised.
+        """
+        participants = [bot for bot in bots if token_ledger.allow("personality", bot.name, "group")]
+        if not participants:
+            print("Deferring group analysis: every participant is over today's token budget")
+            return None
+        names = [bot.name for bot in participants]
+        system_prompt = f"""You are a group conversation analyzer. Your task is to analyze this conversation and return ONLY a valid JSON object.
+
+IMPORTANT: Your entire response must be a valid JSON object, nothing else.
+
+For each of {", ".join(names)}, identify what the conversation reveals about their own personality and how their relationship with each other participant developed.
+
+Return format must be exactly:
+{{
+    "<participant name>": {{
+        "personality": {{
+            "interests-values.json": {{"interests": ["interest 1"], "values": ["value 1"]}},
+            "emotional-framework.json": {{"observed_responses": ["response 1"], "communication_style": ["style 1"]}}
+        }},
+        "relationships": {{
+            "<other participant name>": {{
+                "interactions": ["new interaction 1"],
+                "observed_traits": ["trait 1"],
+                "shared_experiences": ["experience 1"],
+                "emotional_dynamics": {{"trust_level": "neutral|low|medium|high"}},
+                "relationship_development": {{"current_status": "stranger|acquaintance|friend|close_friend"}}
+            }}
+        }}
+    }}
+}}
+
+Only include participants, files and fields that need updates. Ensure the response is valid JSON."""
+        conversation_text = "\n".join(f"{entry['speaker']}: {entry['message']}" for entry in window)
+        with span("group_analysis", "group"):
+            response = model_router.complete(
+                "personality",
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": f"Analyze this conversation:\n\n{conversation_text}"}
+                ],
+                pair="group",
+                max_tokens=min(600 * len(participants), 4000)
+            )
+        return json.loads(response.choices[0].message.content)
+
+    @staticmethod
+    def apply_analysis(bots: List[ChatBot], updates: Dict, job_key: Optional[str] = None) -> None:
+        """Merge analyze_window's updates into each participant's files, once per job_key."""
+        by_name = {bot.name: bot for bot in bots}
+        for name, participant_updates in updates.items():
+            bot = by_name.get(name)
+            if bot is None or not isinstance(participant_updates, dict):
+                continue
+            personality_updates = participant_updates.get("personality", {})
+            if isinstance(personality_updates, dict) and personality_updates:
+                added = bot.apply_personality_updates(personality_updates, job_key)
+                novelty_gate.record_yield("personality", name, added, count_entries(personality_updates))
+            if not bot.relationship_manager:
+                continue
+            for other_name, relationship_updates in participant_updates.get("relationships", {}).items():
+                if other_name not in by_name or other_name == name:
+                    continue
+                try:
+                    bot.relationship_manager.apply_relationship_update(other_name, relationship_updates, job_key)
+                except Exception as e:
+                    print(f"Error updating {name}'s relationship with {other_name}: {e}")
+
+    def _queue_analysis(self, bots: List[ChatBot]) -> None:
+        # One batch at a time; the next window's analysis waits for this one
+        window = list(self.transcript[-self.analysis_window:])
+        self._wait_for_analysis()
+        self._pending_analysis = bots[0].submit_job("group_analysis", participants=[bot.name for bot in bots],
+                                                    window=window)
+
+    def _wait_for_analysis(self) -> None:
+        if self._pending_analysis is not None:
+            with span("update_wait", "group"):
+                self._pending_analysis.result()
+            self._pending_analysis = None
+
+    # Main loop
+
+    def start_conversation(self, bots: List[ChatBot], num_turns: Optional[int] = None,
+                           opener: Optional[str] = None) -> List[Dict]:
+        """Run a group conversation and return its transcript."""
+        if len(bots) < 2:
+            raise ValueError("A group conversation needs at least two participants")
+        names = ", ".join(bot.name for bot in bots)
+        print(f"\nStarting group conversation between {names}...")
+        print("Press Ctrl+C to stop.")
+
+        if num_turns is None:
+            turns = input("\nHow many turns? (default: 20): ")
+            num_turns = int(turns) if turns.isdigit() else 20
+
+        first = bots[0]
+        opener = opener or f"Hi everyone! It's so nice to have {', '.join(bot.name for bot in bots[1:])} all here. How have you all been?"
+        self._last_spoke[first.name] = 0
+        self.transcript.append({"speaker": first.name, "message": opener})
+        print(f"\n{first.name}: {opener}")
+
+        profiler.watch("group.transcript", lambda: self.transcript)
+        try:
+            for turn in range(1, num_turns):
+                turn_started = time.perf_counter()
+                speaker = self.next_speaker(bots)
+                with span("turn", speaker.name):
+                    message = self.take_turn(speaker, bots)
+                print(f"\n{speaker.name}: {message}")
+
+                if turn % self.analysis_window == 0:
+                    self._queue_analysis(bots)
+
+                profiler.tick()
+                self._pace(turn_started)
+        except KeyboardInterrupt:
+            print("\n\nConversation ended by user.")
+        finally:
+            print("\nFinishing group analysis...")
+            try:
+                self._wait_for_analysis()
+            except Exception as e:
+                print(f"Error in group analysis: {e}")
+        return self.transcript
+
+    def _pace(self, turn_started: float) -> None:
+        if not self.delay:
+            return
+        remaining = self.delay - (time.perf_counter() - turn_started)
+        if remaining > 0:
+            time.sleep(remaining)
+
+def _participants(bot: ChatBot, names: List[str]) -> List[ChatBot]:
+    # A resumed job only has its owner; the others come from the personality pool
+    return [bot if name == bot.name else ChatBot(name) for name in names]
+
+def _analyze_group_job(bot: ChatBot, job: Job) -> Optional[Dict]:
+    return GroupChat.analyze_window(_participants(bot, job.args["participants"]), job.args["window"])
+
+def _apply_group_job(bot: ChatBot, job: Job, updates: Dict) -> None:
+    GroupChat.apply_analysis(_participants(bot, job.args["participants"]), updates, job.key)
+
+register_job("group_analysis", _analyze_group_job, _apply_group_job)
@@ -0,0 +1,250 @@
+# chatbot/job_journal.py
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .circuit_breaker import CircuitOpenError
+
+# Jobs stay claimed by a worker for LEASE_SECONDS; a job whose worker died or
+# whose lease ran out is picked up again on the next resume. Analysis that keeps
+# failing is given up after MAX_ATTEMPTS and kept as "failed" for inspection.
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 3
+
+# Key under which a file records the jobs already applied to it, so applying a
+# job twice (after a crash between the write and marking it done) changes nothing
+APPLIED_KEY = "_applied_jobs"
+MAX_APPLIED = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    args TEXT NOT NULL,
+    state TEXT NOT NULL,
+    result TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+"""
+
+class Job:
+    """One journaled unit of analysis work."""
+
+    __slots__ = ("key", "kind", "owner", "args", "state", "result", "attempts")
+
+    def __init__(self, key: str, kind: str, owner: str, args: Dict, state: str = "pending",
+                 result: Any = None, attempts: int = 0):
+        self.key = key
+        self.kind = kind
+        self.owner = owner
+        self.args = args
+        self.state = state
+        self.result = result
+        self.attempts = attempts
+
+def already_applied(data: Dict, key: str) -> bool:
+    return key in data.get(APPLIED_KEY, ())
+
+def mark_applied(data: Dict, key: str) -> Dict:
+    applied = data.setdefault(APPLIED_KEY, [])
+    applied.append(key)
+    del applied[:-MAX_APPLIED]
+    return data
+
+# Distinguishes this process from an earlier one on the same host with the same
+# PID, as when a container restarts and its worker is PID 1 again
+_BOOT_ID = uuid.uuid4().hex[:12]
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{_BOOT_ID}"
+
+def _worker_alive(worker: Optional[str]) -> bool:
+    """Whether the process that claimed a job is still running (assumed so on other hosts)."""
+    if not worker:
+        return False
+    host, _, rest = worker.partition(":")
+    pid, _, boot = rest.partition(":")
+    if host != socket.gethostname():
+        return True
+    if pid == str(os.getpid()):
+        # This PID is ours, so the worker is this process or an earlier one that reused it
+        return boot == _BOOT_ID
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class JobJournal:
+    """SQLite journal of pending analysis and summarization jobs.
+
+    A job is written before its work starts and moves through pending ->
+    running -> analyzed -> done. The analysis result is stored before it is
+    applied, so a job interrupted after its model call is resumed by applying
+    the stored result instead of calling the model again. Appliers record the
+    job key in the data they write (see mark_applied), which makes applying
+    idempotent. Finished jobs are deleted; the backlog is what is left.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.worker = _worker_id()
+        self._local = threading.local()
+
+    def _db(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _job(row: Tuple) -> Job:
+        key, kind, owner, args, state, result, attempts = row
+        return Job(key, kind, owner, json.loads(args), state,
+                   json.loads(result) if result is not None else None, attempts)
+
+    # Lifecycle
+
+    def enqueue(self, kind: str, owner: str, args: Dict, key: Optional[str] = None) -> Job:
+        """Record a job before any of its work starts."""
+        key = key or f"{kind}:{owner}:{uuid.uuid4().hex}"
+        now = time.time()
+        self._db().execute(
+            "INSERT OR IGNORE INTO jobs (key, kind, owner, args, state, created, updated) "
+            "VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+            (key, kind, owner, json.dumps(args), now, now))
+        return Job(key, kind, owner, args)
+
+    def claim(self, key: str) -> Optional[Job]:
+        """Take a job for this process, unless it is finished, failed or held by a live worker."""
+        db = self._db()
+        now = time.time()
+        row = db.execute("SELECT state, worker, lease_until FROM jobs WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] == "failed":
+            return None
+        state, worker, lease_until = row
+        if state == "running" and worker != self.worker and (lease_until or 0) > now and _worker_alive(worker):
+            return None
+        claimed = db.execute(
+            "UPDATE jobs SET state = CASE WHEN result IS NULL THEN 'running' ELSE 'analyzed' END, "
+            "worker = ?, lease_until = ?, updated = ? WHERE key = ? AND state = ? AND worker IS ?",
+            (self.worker, now + LEASE_SECONDS, now, key, state, worker)).rowcount
+        if not claimed:
+            return None
+        row = db.execute("SELECT key, kind, owner, args, state, result, attempts FROM jobs WHERE key = ?",
+                         (key,)).fetchone()
+        return self._job(row)
+
+    def save_result(self, key: str, result: Any) -> None:
+        self._db().execute("UPDATE jobs SET state = 'analyzed', result = ?, updated = ? WHERE key = ?",
+                           (json.dumps(result), time.time(), key))
+
+    def complete(self, key: str) -> None:
+        self._db().execute("DELETE FROM jobs WHERE key = ?", (key,))
+
+    def release(self, key: str) -> None:
+        """Put a job back for a later run without counting an attempt, e.g. when it is over budget."""
+        self._db().execute("UPDATE jobs SET state = 'pending', worker = NULL, lease_until = NULL, updated = ? "
+                           "WHERE key = ? AND result IS NULL", (time.time(), key))
+
+    def fail(self, key: str, error: str) -> None:
+        """Count a failed attempt; the job is retried on resume until it reaches MAX_ATTEMPTS."""
+        self._db().execute(
+            "UPDATE jobs SET attempts = attempts + 1, error = ?, worker = NULL, lease_until = NULL, updated = ?, "
+            "state = CASE WHEN attempts + 1 >= ? THEN 'failed' "
+            "WHEN result IS NULL THEN 'pending' ELSE 'analyzed' END WHERE key = ?",
+            (error[:500], time.time(), MAX_ATTEMPTS, key))
+
+    # Queries
+
+    def unfinished(self) -> List[Job]:
+        """Jobs to resume: pending, analyzed but not applied, or claimed by a worker that is gone."""
+        now = time.time()
+        rows = self._db().execute(
+            "SELECT key, kind, owner, args, state, result, attempts, worker, lease_until FROM jobs "
+            "WHERE state != 'failed' ORDER BY created").fetchall()
+        jobs = []
+        for row in rows:
+            worker, lease_until = row[7], row[8]
+            if row[4] == "running" and worker != self.worker and (lease_until or 0) > now and _worker_alive(worker):
+                continue
+            if worker == self.worker:
+                # Already queued or running in this process
+                continue
+            jobs.append(self._job(row[:7]))
+        return jobs
+
+    def backlog(self) -> Dict:
+        """Job counts by state and kind, and the age of the oldest unfinished job."""
+        db = self._db()
+        counts: Dict[str, Dict[str, int]] = {}
+        for state, kind, count in db.execute("SELECT state, kind, COUNT(*) FROM jobs GROUP BY state, kind"):
+            counts.setdefault(state, {})[kind] = count
+        oldest = db.execute("SELECT MIN(created) FROM jobs WHERE state != 'failed'").fetchone()[0]
+        return {
+            "unfinished": sum(sum(kinds.values()) for state, kinds in counts.items() if state != "failed"),
+            "by_state": counts,
+            "oldest_seconds": round(time.time() - oldest, 1) if oldest else 0.0,
+        }
+
+# Job kinds: analyze(bot, job) returns a JSON-serializable result, or None to
+# put the job off (over budget); apply(bot, job, result) writes it idempotently
+_handlers: Dict[str, Tuple[Callable, Callable]] = {}
+
+def register_job(kind: str, analyze: Callable, apply: Callable) -> None:
+    _handlers[kind] = (analyze, apply)
+
+def has_handler(kind: str) -> bool:
+    return kind in _handlers
+
+def job_handler(kind: str) -> Tuple[Callable, Callable]:
+    if kind not in _handlers:
+        raise ValueError(f"No handler registered for job kind: {kind}")
+    return _handlers[kind]
+
+def run_job(bot, key: str) -> None:
+    """Claim, analyze (unless a stored result exists) and apply one job, recording the outcome."""
+    job = job_journal.claim(key)
+    if job is None:
+        return
+    try:
+        analyze, apply = job_handler(job.kind)
+        result = job.result
+        if result is None:
+            result = analyze(bot, job)
+            if result is None:
+                job_journal.release(key)
+                return
+            job_journal.save_result(key, result)
+        apply(bot, job, result)
+    except CircuitOpenError as e:
+        # The upstream is down, which says nothing about the job: keep it for a later run
+        print(f"Postponing {job.kind} job for {job.owner}: {e}")
+        job_journal.release(key)
+        return
+    except Exception as e:
+        print(f"Error in {job.kind} job for {job.owner}: {e}")
+        job_journal.fail(key, str(e))
+        return
+    job_journal.complete(key)
+
+job_journal = JobJournal(os.getenv("CHATBOT_JOB_JOURNAL", os.path.join("my-personality", ".jobs.sqlite3")))
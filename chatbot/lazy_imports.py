@@ -0,0 +1,63 @@
+# chatbot/lazy_imports.py
+import importlib
+import threading
+from types import ModuleType
+from typing import Optional
+
+
+class LazyModule:
+    """Stand-in for a module that is only imported on first attribute access."""
+
+    __slots__ = ("_name", "_module", "_lock")
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module: Optional[ModuleType] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self) -> ModuleType:
+        """Import the real module (once) and return it."""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.is_loaded else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def lazy_import(name: str) -> LazyModule:
+    """Return a shared lazy proxy for the named module."""
+    with _registry_lock:
+        module = _registry.get(name)
+        if module is None:
+            module = _registry[name] = LazyModule(name)
+        return module
+
+
+def preload(*names: str) -> threading.Thread:
+    """Import the given modules on a daemon thread so later use doesn't block."""
+    def _load():
+        for name in names:
+            try:
+                lazy_import(name).load()
+            except Exception:
+                # The foreground import will surface the real error if it matters
+                pass
+
+    thread = threading.Thread(target=_load, name="preload-" + "-".join(names), daemon=True)
+    thread.start()
+    return thread
@@ -1,36 +1,321 @@
 # chatbot/memory_manager.py
-from typing import List, Dict
-from openai import OpenAI
+import json
+import os
+import threading
+import time
+from typing import Callable, List, Dict, Optional, Tuple
+from .file_lock import locked, file_version, read_json_versioned, write_json_atomic, Version
+from .token_ledger import token_ledger, pair_key
+from .model_router import model_router
+from .token_manager import estimate_tokens
+from .tracing import span
+from .job_journal import already_applied, mark_applied
+
+# Working memory is the current session's message list. Once it grows past
+# WORKING_MEMORY_LIMIT messages, everything but the last WORKING_MEMORY_KEEP is
+# summarized into an episode and dropped from it.
+WORKING_MEMORY_LIMIT = 40
+WORKING_MEMORY_KEEP = 10
+
+# Only the last RECENT_MESSAGES of working memory go into a reply prompt verbatim.
+# Messages that fall out of that window are folded into a running session summary
+# once FOLD_EVERY of them are waiting, so the prompt stays the same size however
+# long the session runs.
+RECENT_MESSAGES = 10
+FOLD_EVERY = 6
+SESSION_SUMMARY_TOKENS = 200
+
+# Episodic memory holds summarized sessions per relationship. Past MAX_EPISODES
+# the oldest are consolidated into facts in memory-growth.json (semantic memory),
+# keeping the newest KEEP_EPISODES.
+MAX_EPISODES = 10
+KEEP_EPISODES = 6
+MAX_FACTS = 50
+
+SEMANTIC_FILE = "memory-growth.json"
+FACTS_KEY = "consolidated_facts"
+
+# Default prompt budget for remembered context, split between the tiers
+MEMORY_PROMPT_TOKENS = 600
+SEMANTIC_SHARE = 0.4
+
+def _take_within_budget(items: List[str], budget: int) -> Tuple[List[str], int]:
+    """Take items in order while they fit in budget tokens; returns them and the tokens used."""
+    taken, used = [], 0
+    for item in items:
+        tokens = estimate_tokens(item)
+        if used + tokens > budget:
+            break
+        taken.append(item)
+        used += tokens
+    return taken, used
 
 class MemoryManager:
-    def __init__(self, client: OpenAI, personality_manager, name: str):
-        self.client = client
+    """Working, episodic and semantic memory for one personality.
+
+    Summarization and consolidation calls go through submit (the bot's update
+    thread), so promotion and eviction never hold up a reply. With submit_job,
+    promotions are journaled as "episode" jobs and survive a restart.
+    """
+
+    def __init__(self, personality_manager, name: str, submit: Optional[Callable] = None,
+                 submit_job: Optional[Callable] = None):
         self.personality_manager = personality_manager
         self.name = name
-        self.chat_history = []
-        self.chat_history_summary_count = 3
-    
+        self.submit = submit or (lambda fn, *args: fn(*args))
+        self.submit_job = submit_job
+        # Parsed episode files keyed by path, with the version they were read at
+        self._episode_cache: Dict[str, Tuple[Version, Dict]] = {}
+        self._cache_lock = threading.Lock()
+        # Running summary of the session's messages older than the recent window.
+        # Positions count from the start of the session: _dropped messages have
+        # been evicted from the head of the history and the first _folded have
+        # been handed to the summarizer. _session changes when a session ends so
+        # late folds of the old session are ignored.
+        self.session_summary = ""
+        self._dropped = 0
+        self._folded = 0
+        self._session = 0
+
     def summarize_chat_history(self, chat_history_string: str) -> str:
+        if not token_ledger.allow("summary", self.name):
+            return "Summary deferred: over today's token budget."
         try:
-            messages = [
-                {"role": "system", "content": f"Summarize this conversation in 30 words or less, focusing on key points and emotional tone. Always use {self.name}'s name and specific personality traits: {self.personality_manager.get_personality_traits()}. Never use generic terms like 'the assistant'."},
-                {"role": "user", "content": chat_history_string}
-            ]
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=100
-            )
-            memory_summary = response.choices[0].message.content
-            
-            if len(self.chat_history) % 10 == 0:
-                self.personality_manager.update_from_response(memory_summary, self.client)
-            
-            self.personality_manager.update_memory(memory_summary, self.name)
-            
-            return memory_summary
-            
+            return self._summarize(chat_history_string)
         except Exception as e:
             print(f"Error during summarization: {e}")
-            return "Error summarizing chat history."
\ No newline at end of file
+            return "Error summarizing chat history."
+
+    def _summarize(self, chat_history_string: str, pair: str = "") -> str:
+        messages = [
+            {"role": "system", "content": f"Summarize this conversation in 30 words or less, focusing on key points and emotional tone. Always use {self.name}'s name and specific personality traits: {self._personality_traits()}. Never use generic terms like 'the assistant'."},
+            {"role": "user", "content": chat_history_string}
+        ]
+
+        with span("memory_summary", self.name):
+            response = model_router.complete("summary", messages, self.name, pair, max_tokens=100)
+        return response.choices[0].message.content
+
+    def _personality_traits(self) -> List[str]:
+        core = self.personality_manager.current_personality.get("core-identity.json", {})
+        return core.get("traits", []) if isinstance(core, dict) else []
+
+    # Working memory
+
+    def recent_messages(self, history: List[Dict]) -> List[Dict]:
+        """The part of working memory that goes into a reply prompt verbatim."""
+        return history[-RECENT_MESSAGES:]
+
+    def fold_history(self, history: List[Dict], other_name: Optional[str], force: bool = False) -> None:
+        """Queue messages that have left the recent window for folding into the session summary.
+
+        Folding waits until FOLD_EVERY messages are pending, unless force is set.
+        """
+        window_start = self._dropped + max(len(history) - RECENT_MESSAGES, 0)
+        pending = window_start - self._folded
+        if pending <= 0 or (pending < FOLD_EVERY and not force):
+            return
+        if not token_ledger.allow("summary", self.name, pair_key(self.name, other_name)):
+            return
+        start = max(self._folded - self._dropped, 0)
+        messages = history[start:window_start - self._dropped]
+        self._folded = window_start
+        self.submit(self._fold, self._session, other_name, messages)
+
+    def _fold(self, session: int, other_name: Optional[str], messages: List[Dict]) -> None:
+        speakers = {"assistant": self.name, "user": other_name or "the user"}
+        text = "\n".join(f"{speakers.get(m.get('role'), m.get('role'))}: {m.get('content')}" for m in messages)
+        system_prompt = f"""You keep a running summary of {self.name}'s current conversation with {other_name or 'the user'}.
+
+Update the summary so it also covers the new messages. Keep what was discussed, what each person shared about themselves, questions still open and the emotional tone; drop small talk. Write in the third person, at most 120 words."""
+        try:
+            with span("session_summary", self.name):
+                response = model_router.complete(
+                    "summary",
+                    [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": f"Summary so far:\n{self.session_summary or 'Nothing yet.'}\n\nNew messages:\n{text}"}
+                    ],
+                    self.name,
+                    pair_key(self.name, other_name),
+                    max_tokens=SESSION_SUMMARY_TOKENS,
+                    temperature=0.3
+                )
+            summary = response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"Error updating session summary: {e}")
+            return
+        if session == self._session and summary:
+            self.session_summary = summary
+
+    def evict_working_memory(self, history: List[Dict], other_name: Optional[str]) -> None:
+        """Promote the older part of an overgrown session history to an episode, in place."""
+        if len(history) <= WORKING_MEMORY_LIMIT or not other_name:
+            return
+        # Whatever has not reached the session summary yet goes now, before it is dropped
+        self.fold_history(history, other_name, force=True)
+        evicted = history[:-WORKING_MEMORY_KEEP]
+        del history[:-WORKING_MEMORY_KEEP]
+        self._dropped += len(evicted)
+        self._queue_promotion(other_name, evicted)
+
+    def end_session(self, history: List[Dict], other_name: Optional[str]) -> None:
+        """Promote everything left in a finished session to an episode and start a new session summary."""
+        if history and other_name:
+            self._queue_promotion(other_name, list(history))
+            history.clear()
+        if history:
+            return
+        self.session_summary = ""
+        self._dropped = 0
+        self._folded = 0
+        self._session += 1
+
+    # Episodic memory
+
+    def _queue_promotion(self, other_name: str, messages: List[Dict]) -> None:
+        if self.submit_job is not None:
+            self.submit_job("episode", other_name=other_name, messages=messages)
+        else:
+            self.submit(self.promote, other_name, messages)
+
+    def _episodes_file(self, other_name: str) -> str:
+        return os.path.join(self.personality_manager.personality_dir, "episodes", f"{other_name}.json")
+
+    def load_episodes(self, other_name: str) -> List[Dict]:
+        path = self._episodes_file(other_name)
+        version = file_version(path)
+        if version is None:
+            return []
+        with self._cache_lock:
+            cached = self._episode_cache.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1].get("episodes", [])
+        try:
+            data, version = read_json_versioned(path)
+        except (OSError, ValueError) as e:
+            print(f"Error loading episodes for {other_name}: {e}")
+            return []
+        with self._cache_lock:
+            self._episode_cache[path] = (version, data)
+        return data.get("episodes", [])
+
+    def promote(self, other_name: str, messages: List[Dict]) -> None:
+        """Summarize session messages into an episode, consolidating old episodes if needed."""
+        try:
+            summary = self.summarize_episode(other_name, messages)
+        except Exception as e:
+            print(f"Error summarizing the session with {other_name}: {e}")
+            return
+        if summary is not None:
+            self.record_episode(other_name, summary, len(messages))
+
+    def summarize_episode(self, other_name: str, messages: List[Dict]) -> Optional[str]:
+        """The episode summary of session messages; None when over budget.
+
+        Errors are raised, CircuitOpenError included, so a journaled episode job
+        is put back while the upstream is down and counted as failed otherwise.
+        """
+        pair = pair_key(self.name, other_name)
+        if not token_ledger.allow("summary", self.name, pair):
+            return None
+        speakers = {"assistant": self.name, "user": other_name}
+        text = "\n".join(f"{speakers.get(m.get('role'), m.get('role'))}: {m.get('content')}" for m in messages)
+        return self._summarize(text, pair)
+
+    def record_episode(self, other_name: str, summary: str, message_count: int,
+                       job_key: Optional[str] = None) -> None:
+        """Append an episode, once per job_key, and consolidate old episodes if there are too many."""
+        episode = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "summary": summary,
+            "messages": message_count,
+        }
+
+        path = self._episodes_file(other_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with locked(path):
+            try:
+                data, _ = read_json_versioned(path)
+            except FileNotFoundError:
+                data = {"episodes": []}
+            if job_key and already_applied(data, job_key):
+                return
+            data["episodes"].append(episode)
+            if job_key:
+                mark_applied(data, job_key)
+            write_json_atomic(path, data)
+
+        if len(data["episodes"]) > MAX_EPISODES:
+            self.consolidate(other_name)
+
+    # Semantic memory
+
+    def consolidate(self, other_name: str) -> None:
+        """Distill the oldest episodes with other_name into lasting facts and drop them."""
+        episodes = self.load_episodes(other_name)
+        oldest = episodes[:len(episodes) - KEEP_EPISODES]
+        if not oldest or not token_ledger.allow("summary", self.name, pair_key(self.name, other_name)):
+            return
+
+        system_prompt = f"""You are a memory consolidator. Your task is to return ONLY a valid JSON object.
+
+From these summaries of {self.name}'s past conversations with {other_name}, extract the lasting facts {self.name} should remember: facts about {other_name}, about {self.name}, and about their relationship. Skip anything only relevant in the moment. Each fact is one short sentence naming who it is about.
+
+Return format must be exactly:
+{{"facts": ["fact 1", "fact 2"]}}"""
+        episode_text = "\n".join(f"[{episode['timestamp']}] {episode['summary']}" for episode in oldest)
+        try:
+            with span("memory_consolidation", self.name):
+                response = model_router.complete(
+                    "summary",
+                    [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": episode_text}
+                    ],
+                    self.name,
+                    pair_key(self.name, other_name),
+                    max_tokens=300,
+                    temperature=0.3
+                )
+            facts = json.loads(response.choices[0].message.content).get("facts", [])
+        except Exception as e:
+            print(f"Error consolidating memories with {other_name}: {e}")
+            return
+
+        def merge_facts(current: Dict, new: Dict) -> Dict:
+            existing = current.get(FACTS_KEY, [])
+            merged = [fact for fact in existing if fact not in new[FACTS_KEY]] + new[FACTS_KEY]
+            current[FACTS_KEY] = merged[-MAX_FACTS:]
+            return current
+
+        self.personality_manager.update_personality_file(SEMANTIC_FILE, {FACTS_KEY: facts}, merge_facts)
+
+        path = self._episodes_file(other_name)
+        with locked(path):
+            data, _ = read_json_versioned(path)
+            data["episodes"] = [episode for episode in data["episodes"] if episode not in oldest]
+            write_json_atomic(path, data)
+
+    def facts(self) -> List[str]:
+        semantic = self.personality_manager.current_personality.get(SEMANTIC_FILE, {})
+        return semantic.get(FACTS_KEY, []) if isinstance(semantic, dict) else []
+
+    # Prompt context
+
+    def context(self, other_name: Optional[str], budget: int = MEMORY_PROMPT_TOKENS) -> str:
+        """Remembered facts and past episodes with other_name, newest first, within budget tokens."""
+        facts, used = _take_within_budget(list(reversed(self.facts())), int(budget * SEMANTIC_SHARE))
+        episodes = []
+        if other_name:
+            summaries = [f"[{episode['timestamp']}] {episode['summary']}"
+                         for episode in reversed(self.load_episodes(other_name))]
+            # The episodic tier gets whatever the facts left over
+            episodes, _ = _take_within_budget(summaries, budget - used)
+
+        context = []
+        if facts:
+            context.append("Things you remember:\n" + "\n".join(f"- {fact}" for fact in facts))
+        if episodes:
+            context.append(f"Earlier conversations with {other_name}:\n" + "\n".join(f"- {e}" for e in episodes))
+        return "\n\n".join(context)
@@ -0,0 +1,404 @@
+# chatbot/model_router.py
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from .providers import Provider, default_provider_name, get_provider
+from .token_ledger import token_ledger
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+
+TASKS = ("reply", "relationship", "personality", "summary")
+
+# Routes used when no routing file is configured: every task on gpt-4o-mini
+# with the sizes the call sites used before routing existed. A task's deadline
+# covers all of its attempts; replies are hedged once they take longer than the
+# route's observed p95. Task settings missing from a routing file come from here.
+DEFAULT_ROUTES = {
+    "reply": {"routes": [{"model": "gpt-4o-mini", "max_tokens": 1000, "temperature": 0.7}],
+              "deadline": 30, "hedge_percentile": 95},
+    "relationship": {"routes": [{"model": "gpt-4o-mini", "max_tokens": 1000, "temperature": 0.7}],
+                     "deadline": 90},
+    "personality": {"routes": [{"model": "gpt-4o-mini", "max_tokens": 1000, "temperature": 0.7}],
+                    "deadline": 120},
+    "summary": {"routes": [{"model": "gpt-4o-mini", "max_tokens": 500, "temperature": 0.7}],
+                "deadline": 60},
+}
+DEFAULT_DEADLINE = 60
+
+# Latency samples kept per endpoint and model, and how many are needed before
+# the percentiles are trusted for latency-aware selection and hedging
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 5
+
+# Completion calls run here so the caller can stop waiting at the deadline and
+# race a hedged duplicate against a slow first attempt. When every worker is
+# busy, attempts queue; those still queued at the deadline are cancelled.
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-call")
+
+class DeadlineExceeded(TimeoutError):
+    """A task's completion did not finish within its deadline."""
+
+def _client_error(error: Exception) -> bool:
+    """Whether error is the upstream rejecting this request (a 4xx other than timeout or rate limit)."""
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 429)
+
+class Route:
+    """One model on one provider, with the request defaults for a task.
+
+    provider is "openai", "compatible" (a self-hosted OpenAI-compatible server
+    at base_url) or "stub"; left out, a base_url means "compatible" and
+    otherwise CHATBOT_PROVIDER decides, defaulting to "openai".
+    """
+
+    __slots__ = ("model", "max_tokens", "temperature", "base_url", "api_key_env", "provider")
+
+    def __init__(self, model: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                 base_url: Optional[str] = None, api_key_env: str = "OPENAI_API_KEY",
+                 provider: Optional[str] = None):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.base_url = base_url
+        self.api_key_env = api_key_env
+        self.provider = provider
+
+    @property
+    def key(self) -> str:
+        return f"{self.provider or ''}|{self.base_url or 'default'}|{self.model}"
+
+    def backend(self) -> Provider:
+        return get_provider(self.provider, self.base_url, self.api_key_env)
+
+    def describe(self) -> Dict:
+        described = {name: getattr(self, name) for name in self.__slots__}
+        described["provider"] = self.provider or ("compatible" if self.base_url else default_provider_name())
+        return described
+
+class TaskRoutes:
+    """The fallback chain for a task, how to order it, its deadline and when to hedge.
+
+    select is "ordered" (as listed) or "fastest" (by observed p95). With
+    hedge_percentile set, an attempt still running after that percentile of
+    its route's observed latency gets a duplicate on the next route (or the
+    same one), and the first answer wins.
+    """
+
+    __slots__ = ("routes", "select", "deadline", "hedge_percentile")
+
+    def __init__(self, routes: List[Route], select: str = "ordered", deadline: float = DEFAULT_DEADLINE,
+                 hedge_percentile: Optional[float] = None):
+        if not routes:
+            raise ValueError("A task needs at least one route")
+        if select not in ("ordered", "fastest"):
+            raise ValueError(f"Unknown route selection: {select}")
+        if deadline <= 0:
+            raise ValueError("A task deadline must be positive")
+        if hedge_percentile is not None and not 0 < hedge_percentile < 100:
+            raise ValueError("hedge_percentile must be between 0 and 100")
+        self.routes = routes
+        self.select = select
+        self.deadline = deadline
+        self.hedge_percentile = hedge_percentile
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'TaskRoutes':
+        return cls([Route(**route) for route in config["routes"]], config.get("select", "ordered"),
+                   config.get("deadline", DEFAULT_DEADLINE), config.get("hedge_percentile"))
+
+class ModelRouter:
+    """Picks model, max_tokens, temperature and endpoint per task, with fallback.
+
+    Routing is configured as JSON, per task:
+        {"relationship": {"select": "fastest", "deadline": 45,
+                          "routes": [{"model": "gpt-4o-mini"},
+                                     {"model": "llama3", "provider": "compatible",
+                                      "base_url": "http://gpu:8000/v1"}]},
+         "reply": {"hedge_percentile": 90, "routes": [{"model": "gpt-4o-mini"}]}}
+    Routes are tried in order until one succeeds or the task's deadline passes;
+    with "fastest" the order is by the p95 latency observed for each route,
+    routes without enough samples first. Each route has a circuit breaker:
+    after repeated failures it is skipped until a probe succeeds, and when
+    every route of a task is open calls fail fast with CircuitOpenError.
+    max_tokens and temperature given at a call site take precedence over the
+    route's. Tasks and settings missing from the file keep their defaults.
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        config = config or {}
+        self.tasks: Dict[str, TaskRoutes] = {}
+        for task in {**DEFAULT_ROUTES, **config}:
+            self.tasks[task] = TaskRoutes.from_config({**DEFAULT_ROUTES.get(task, {}), **config.get(task, {})})
+        self._latencies: Dict[str, deque] = {}
+        self._failures: Dict[str, int] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._hedges: Dict[str, int] = {}
+        self._deadline_misses: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ModelRouter':
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    def _task(self, task: str) -> TaskRoutes:
+        return self.tasks.get(task) or self.tasks["reply"]
+
+    # Health tracking
+
+    def observe(self, route: Route, seconds: float) -> None:
+        with self._lock:
+            window = self._latencies.get(route.key)
+            if window is None:
+                window = self._latencies[route.key] = deque(maxlen=LATENCY_WINDOW)
+            window.append(seconds)
+
+    def record_failure(self, route: Route) -> None:
+        with self._lock:
+            self._failures[route.key] = self._failures.get(route.key, 0) + 1
+        self.breaker(route).record_failure()
+
+    def _count(self, counter: Dict[str, int], task: str) -> None:
+        with self._lock:
+            counter[task] = counter.get(task, 0) + 1
+
+    def breaker(self, route: Route) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(route.key)
+            if breaker is None:
+                breaker = self._breakers[route.key] = CircuitBreaker()
+            return breaker
+
+    def percentile(self, route: Route, percent: float) -> Optional[float]:
+        with self._lock:
+            window = self._latencies.get(route.key)
+            if not window or len(window) < MIN_LATENCY_SAMPLES:
+                return None
+            samples = sorted(window)
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+    def p95(self, route: Route) -> Optional[float]:
+        return self.percentile(route, 95)
+
+    def available(self, task: str) -> bool:
+        """Whether any route of task would currently accept a request."""
+        return any(self.breaker(route).available() for route in self._task(task).routes)
+
+    def retry_in(self, task: str) -> float:
+        """Seconds until some route of task accepts requests again."""
+        return min(self.breaker(route).retry_in() for route in self._task(task).routes)
+
+    def wait_until_available(self, task: str) -> None:
+        """Sleep while every route of task is failing, for loops that would otherwise spin on errors."""
+        delay = self.retry_in(task) if not self.available(task) else 0.0
+        if delay > 0:
+            print(f"Upstream for {task} is failing, pausing {delay:.0f}s before retrying...")
+            time.sleep(delay)
+
+    # Selection
+
+    def routes_for(self, task: str) -> List[Route]:
+        """Routes to try for task, in order, leaving out those whose breaker is open."""
+        task_routes = self._task(task)
+        routes = [route for route in task_routes.routes if self.breaker(route).available()]
+        if not routes:
+            raise CircuitOpenError(f"Every route for {task} is failing", self.retry_in(task))
+        if task_routes.select == "ordered" or len(routes) == 1:
+            return routes
+
+        def latency_rank(item: Tuple[int, Route]):
+            position, route = item
+            p95 = self.p95(route)
+            # Unmeasured routes go first so every route gets measured
+            return (p95 is not None, p95 or 0.0, position)
+        return [route for _, route in sorted(enumerate(routes), key=latency_rank)]
+
+    def _request(self, task: str, route: Route, messages: List[Dict], personality: Optional[str],
+                 max_tokens: Optional[int], temperature: Optional[float], extra: Dict, deadline: float) -> Dict:
+        max_tokens = max_tokens or route.max_tokens or 1000
+        request = {
+            "model": route.model,
+            "messages": messages,
+            "max_tokens": token_ledger.max_tokens_for(task, personality, max_tokens),
+            # Lets the HTTP client give up on its own once nobody is waiting for the answer
+            "timeout": max(deadline - time.monotonic(), 0.1),
+            **extra,
+        }
+        temperature = temperature if temperature is not None else route.temperature
+        if temperature is not None:
+            request["temperature"] = temperature
+        return request
+
+    # Calls
+
+    def _call(self, route: Route, request: Dict, streaming: bool):
+        """One upstream call, run on the executor. Streams return (stream, first chunk, rest)."""
+        start = time.perf_counter()
+        try:
+            result = route.backend().chat(**request)
+            if streaming:
+                chunks = iter(result)
+                # Time to first chunk is what a streaming caller waits on
+                result = (result, next(chunks, None), chunks)
+        except Exception as e:
+            if _client_error(e):
+                # The upstream answered; the request was at fault, not the route
+                self.breaker(route).record_success()
+            else:
+                self.record_failure(route)
+            raise
+        self.observe(route, time.perf_counter() - start)
+        self.breaker(route).record_success()
+        return result
+
+    def _run(self, task: str, make_request: Callable[[Route, float], Dict], streaming: bool,
+             discard: Callable[[Future], None]):
+        """Try the task's routes until one answers, within the task's deadline."""
+        task_routes = self._task(task)
+        routes = self.routes_for(task)
+        deadline = time.monotonic() + task_routes.deadline
+        tried: Set[str] = set()
+        last_error = None
+        for position, route in enumerate(routes):
+            if time.monotonic() >= deadline:
+                break
+            # A route already raced as a hedge does not get a second turn
+            if route.key in tried or not self.breaker(route).allow():
+                continue
+            hedge_route = routes[position + 1] if position + 1 < len(routes) else route
+            try:
+                return self._attempt(task, task_routes, route, hedge_route, make_request, streaming,
+                                     deadline, tried, discard)
+            except Exception as e:
+                last_error = e
+        if last_error is None:
+            raise CircuitOpenError(f"Every route for {task} is failing", self.retry_in(task))
+        raise last_error
+
+    def _attempt(self, task: str, task_routes: TaskRoutes, route: Route, hedge_route: Route,
+                 make_request: Callable[[Route, float], Dict], streaming: bool, deadline: float,
+                 tried: Set[str], discard: Callable[[Future], None]):
+        """Call route, racing a duplicate on hedge_route if it is slower than the hedge percentile."""
+        in_flight: Dict[Future, Route] = {
+            _executor.submit(self._call, route, make_request(route, deadline), streaming): route}
+        tried.add(route.key)
+        hedge_after = None
+        if task_routes.hedge_percentile is not None:
+            hedge_after = self.percentile(route, task_routes.hedge_percentile)
+        started = time.monotonic()
+        last_error = None
+        while in_flight:
+            timeout = deadline - time.monotonic()
+            if hedge_after is not None:
+                timeout = min(timeout, started + hedge_after - time.monotonic())
+            done, _ = wait(in_flight, timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                del in_flight[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                # First answer wins; the other attempt is dropped when it finishes
+                for loser in in_flight:
+                    loser.add_done_callback(discard)
+                return result
+            if done:
+                continue
+            if hedge_after is not None:
+                hedge_after = None
+                if time.monotonic() < deadline and self.breaker(hedge_route).allow():
+                    self._count(self._hedges, task)
+                    tried.add(hedge_route.key)
+                    in_flight[_executor.submit(self._call, hedge_route, make_request(hedge_route, deadline),
+                                               streaming)] = hedge_route
+                continue
+            if time.monotonic() >= deadline:
+                self._count(self._deadline_misses, task)
+                for late, late_route in in_flight.items():
+                    # An attempt still queued never reached the route, so it says nothing about its health
+                    if late.cancel():
+                        continue
+                    self.breaker(late_route).record_failure()
+                    late.add_done_callback(discard)
+                raise DeadlineExceeded(f"{task} did not finish within {task_routes.deadline}s")
+        raise last_error
+
+    def complete(self, task: str, messages: List[Dict], personality: Optional[str] = None, pair: str = "",
+                 max_tokens: Optional[int] = None, temperature: Optional[float] = None, **extra):
+        """Run a chat completion for task on the first route that answers, and record its usage.
+
+        Raises DeadlineExceeded when the task's deadline passes and
+        CircuitOpenError when every route is failing.
+        """
+        def make_request(route: Route, deadline: float) -> Dict:
+            return self._request(task, route, messages, personality, max_tokens, temperature, extra, deadline)
+
+        def discard(future: Future) -> None:
+            # A losing attempt that still answered used tokens too
+            if not future.cancelled() and future.exception() is None:
+                token_ledger.record(future.result(), task, personality, pair)
+
+        response = self._run(task, make_request, False, discard)
+        token_ledger.record(response, task, personality, pair)
+        return response
+
+    def stream(self, task: str, messages: List[Dict], personality: Optional[str] = None, pair: str = "",
+               max_tokens: Optional[int] = None, temperature: Optional[float] = None, **extra) -> Iterator:
+        """Stream a chat completion, falling back to the next route if one fails before its first chunk.
+
+        The deadline and hedging apply to the first chunk. Usage reported on
+        the final chunk is recorded in the token ledger.
+        """
+        def make_request(route: Route, deadline: float) -> Dict:
+            request = self._request(task, route, messages, personality, max_tokens, temperature, extra, deadline)
+            request.update(stream=True, stream_options={"include_usage": True})
+            return request
+
+        def discard(future: Future) -> None:
+            if not future.cancelled() and future.exception() is None:
+                future.result()[0].close()
+
+        _, first, chunks = self._run(task, make_request, True, discard)
+        return self._relay(first, chunks, task, personality, pair)
+
+    @staticmethod
+    def _relay(first, chunks: Iterator, task: str, personality: Optional[str], pair: str) -> Iterator:
+        if first is None:
+            return
+        for chunk in itertools.chain((first,), chunks):
+            if getattr(chunk, "usage", None):
+                token_ledger.record(chunk, task, personality, pair)
+            yield chunk
+
+    def stats(self) -> Dict:
+        """Configured routes per task with observed latency, failures, breaker state, hedges and missed deadlines."""
+        result = {}
+        for task, task_routes in sorted(self.tasks.items()):
+            result[task] = {
+                "select": task_routes.select,
+                "deadline": task_routes.deadline,
+                "hedge_percentile": task_routes.hedge_percentile,
+                "hedges": self._hedges.get(task, 0),
+                "deadline_misses": self._deadline_misses.get(task, 0),
+                "routes": [{**route.describe(), "p95_seconds": self.p95(route),
+                            "failures": self._failures.get(route.key, 0),
+                            "breaker": self.breaker(route).describe()} for route in task_routes.routes],
+            }
+        return result
+
+def _load_router() -> ModelRouter:
+    path = os.getenv("CHATBOT_MODEL_ROUTES")
+    if path:
+        try:
+            return ModelRouter.from_file(path)
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            print(f"Error loading model routes from {path}, using defaults: {e}")
+    return ModelRouter()
+
+model_router = _load_router()
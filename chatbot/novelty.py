@@ -0,0 +1,166 @@
+# chatbot/novelty.py
+import os
+import re
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, FrozenSet, Optional, Tuple
+
+from .dedup import normalize
+from .token_ledger import token_ledger
+
+# A window is analyzed when at least this fraction of its keywords is new. The
+# bar moves from MIN_NOVELTY to MAX_NOVELTY as the yield of recent calls (the
+# share of returned entries that were actually new) drops from 1 to 0
+MIN_NOVELTY = 0.1
+MAX_NOVELTY = 0.4
+
+# However low the novelty, a call goes through after this many skips in a row
+# (fewer while recent calls still yield), so the analysis cadence stretches to
+# at most MAX_SKIPS + 1 times its normal period
+MAX_SKIPS = 6
+
+# Weight of the newest call in the running yield average
+YIELD_ALPHA = 0.3
+
+# Keywords of the last analyzed windows, which count as known for the next ones
+RECENT_WINDOWS = 4
+
+# Estimated cost of a skipped call before any call of its type is in the token ledger
+DEFAULT_CALL_TOKENS = 1200
+
+# Common conversational words, which say nothing new about a personality
+_COMMON_WORDS = frozenset("""
+about after again all also always and any anything are back because been before being but can
+could did does doing done don even ever every feel for from get going good got great had has have
+having hear here hey how i'm its just know let like little lot love make maybe more most much
+must need never new nice not now off one only other our out over pretty really right said same
+say see should some something sometime still such sure talk tell than thank thanks that the
+their them then there these thing think this those though time too very want was way well were
+what when where which while who why will with would yeah yes yet you your you're
+""".split())
+
+_WORD = re.compile(r"[a-z][a-z']+")
+
+@lru_cache(maxsize=65536)
+def keywords(text: str) -> FrozenSet[str]:
+    """Stemmed content words of text, as compared by the novelty gate."""
+    words = [word for word in _WORD.findall(text.lower()) if len(word) > 2 and word not in _COMMON_WORDS]
+    return frozenset(word for word in normalize(" ".join(words)).split() if len(word) > 2)
+
+def data_keywords(data: Any) -> FrozenSet[str]:
+    """Keywords of every string in a personality or relationship structure, keys included."""
+    found = set()
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            found |= keywords(value)
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                if not key.startswith("_"):
+                    found |= keywords(key.replace("_", " "))
+                    stack.append(item)
+        elif isinstance(value, list):
+            stack.extend(value)
+    return frozenset(found)
+
+def count_entries(data: Any) -> int:
+    """Number of list entries in a structure, nested lists included."""
+    if isinstance(data, dict):
+        return sum(count_entries(value) for key, value in data.items() if not key.startswith("_"))
+    if isinstance(data, list):
+        return len(data)
+    return 0
+
+class _GateState:
+    __slots__ = ("yield_average", "skipped_in_row")
+
+    def __init__(self):
+        self.yield_average = 1.0
+        self.skipped_in_row = 0
+
+class NoveltyGate:
+    """Decides whether a window of conversation is worth an analyzer call.
+
+    A window's novelty is the share of its keywords found neither in what the
+    owner already knows (personality and relationship contents) nor in the
+    last analyzed windows. Windows below the current bar are skipped; the bar
+    rises while recent calls return entries that were already known, and a
+    call is forced after a run of skips so the files still follow the
+    conversation.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._states: Dict[Tuple[str, str], _GateState] = {}
+        self._recent: Dict[Tuple[str, str, str], Deque[FrozenSet[str]]] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def threshold(self, kind: str, owner: str) -> float:
+        state = self._states.get((kind, owner))
+        yield_average = state.yield_average if state else 1.0
+        return MIN_NOVELTY + (MAX_NOVELTY - MIN_NOVELTY) * (1.0 - yield_average)
+
+    def should_analyze(self, kind: str, owner: str, other: Optional[str], text: str,
+                       known: FrozenSet[str]) -> bool:
+        """Whether to make the kind analyzer call for owner on text; skips are logged and counted."""
+        window = keywords(text) - keywords(other or "")
+        with self._lock:
+            stats = self._stats.setdefault(kind, {"checked": 0, "skipped": 0, "forced": 0, "tokens_saved": 0})
+            stats["checked"] += 1
+            if not self.enabled:
+                return True
+            state = self._states.setdefault((kind, owner), _GateState())
+            recent = self._recent.setdefault((kind, owner, other or ""), deque(maxlen=RECENT_WINDOWS))
+            new = window - known
+            for seen in recent:
+                new = new - seen
+            novelty = len(new) / len(window) if window else 0.0
+            threshold = self.threshold(kind, owner)
+            max_skips = 1 + round((1.0 - state.yield_average) * (MAX_SKIPS - 1))
+            if novelty >= threshold or state.skipped_in_row >= max_skips:
+                if novelty < threshold:
+                    stats["forced"] += 1
+                state.skipped_in_row = 0
+                recent.append(window)
+                return True
+            state.skipped_in_row += 1
+            saved = self.estimated_tokens(owner)
+            stats["skipped"] += 1
+            stats["tokens_saved"] += saved
+        label = kind.replace("_", " ") if kind.endswith("analysis") else f"{kind} analysis"
+        print(f"Skipping {label} for {owner}: novelty {novelty:.2f} below {threshold:.2f} "
+              f"(~{saved} tokens saved)")
+        return False
+
+    def record_yield(self, kind: str, owner: str, added: int, offered: int) -> None:
+        """Fold the outcome of an analyzer call (new entries out of those it returned) into the yield.
+
+        A call that returned nothing to add yields 0.
+        """
+        sample = min(added / offered, 1.0) if offered > 0 else 0.0
+        with self._lock:
+            state = self._states.setdefault((kind, owner), _GateState())
+            state.yield_average += YIELD_ALPHA * (sample - state.yield_average)
+
+    @staticmethod
+    def estimated_tokens(owner: str) -> int:
+        """Average tokens of the owner's personality analyzer calls so far, falling back to all personalities."""
+        for personality in (owner, None):
+            totals = token_ledger.totals(call_type="personality", personality=personality)
+            if totals["calls"]:
+                return totals["total_tokens"] // totals["calls"]
+        return DEFAULT_CALL_TOKENS
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "by_kind": {kind: dict(counts) for kind, counts in self._stats.items()},
+                "yield": {f"{kind}:{owner}": round(state.yield_average, 3)
+                          for (kind, owner), state in self._states.items()},
+            }
+
+novelty_gate = NoveltyGate(enabled=os.getenv("CHATBOT_NOVELTY_GATE", "1").lower() not in ("0", "false", "no"))
@@ -0,0 +1,25 @@
+# chatbot/openai_client.py
+import threading
+from typing import Dict, Optional, Tuple
+from .lazy_imports import lazy_import
+
+openai = lazy_import("openai")
+
+_clients: Dict[Tuple[str, Optional[str]], object] = {}
+_clients_lock = threading.Lock()
+
+def get_openai_client(api_key: str, base_url: Optional[str] = None):
+    """Return a process-wide OpenAI client for the key and endpoint.
+
+    The client and its connection pool are thread-safe, so every bot and
+    manager can share one instead of opening its own connections. base_url
+    None uses the SDK default (OPENAI_BASE_URL or the OpenAI API).
+    """
+    key = (api_key, base_url)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = openai.OpenAI(api_key=api_key, base_url=base_url)
+    return client
\ No newline at end of file
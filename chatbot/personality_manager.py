@@ -1,14 +1,31 @@
 # chatbot/personality_manager.py
+import copy
 import os
 import json
 import shutil
-from typing import Dict, Optional
+import time
+from typing import Callable, Dict, FrozenSet, Optional
+from .tracing import span
+from .file_lock import locked, lock_stats, file_version, read_json_versioned, write_json_atomic
+from .snapshot import PersonalitySnapshot
+from .dedup import prompt_view, share_keys
+from .novelty import data_keywords
+
+# Sections rendered into the system prompt, in order
+PROMPT_SECTIONS = ("core-identity.json", "interests-values.json", "emotional-framework.json")
 
 class PersonalityManager:
     def __init__(self, base_dir: str = "my-personality"):
         self.base_dir = base_dir
         self.personality_dir = None
         self.current_personality = {}
+        # On-disk version of each loaded file, used to detect writes by other processes
+        self._file_versions = {}
+        self.snapshot: Optional[PersonalitySnapshot] = None
+        # Rendered prompt fragment and the section versions it was rendered from
+        self._fragment = None
+        # Keywords of the loaded personality and the file versions they were taken from
+        self._keywords = None
         
         # Create users directory if it doesn't exist
         self.users_dir = os.path.join(base_dir, "users")
@@ -77,22 +94,81 @@ class PersonalityManager:
                 return False
 
         self.personality_dir = target_dir
+        self.snapshot = PersonalitySnapshot.load(target_dir)
         self._load_personality_files()
+        self.snapshot.save()
         return True
 
     def _load_personality_files(self) -> None:
-        """Load all personality files from the current personality directory."""
-        self.current_personality = {}
+        """Load all personality files from the current personality directory.
+
+        Files unchanged since the snapshot was built are taken from it instead of parsed.
+        """
+        personality, versions = {}, {}
         json_files = [f for f in os.listdir(self.personality_dir) if f.endswith('.json')]
         
         for filename in json_files:
             file_path = os.path.join(self.personality_dir, filename)
+            version = file_version(file_path)
+            data = self.snapshot.section(filename, version) if self.snapshot else None
+            if data is not None:
+                personality[filename], versions[filename] = data, version
+                continue
             try:
-                with open(file_path, 'r') as f:
-                    self.current_personality[filename] = json.load(f)
+                data, versions[filename] = read_json_versioned(file_path)
+                personality[filename] = share_keys(data)
             except json.JSONDecodeError as e:
                 print(f"Error loading {filename}: {e}")
-                self.current_personality[filename] = {}
+                personality[filename] = {}
+                continue
+            if self.snapshot:
+                self.snapshot.put_section(filename, versions[filename], personality[filename])
+        if self.snapshot:
+            self.snapshot.keep_sections(json_files)
+        # Swapped in whole, like the sections written later (see _remember)
+        self.current_personality = personality
+        self._file_versions = versions
+        self._fragment = None
+
+    def prompt_fragment(self) -> str:
+        """The personality sections used in system prompts, rendered once per version of their files.
+
+        Lists are cut to their strongest entries by decayed frequency, which is
+        re-ranked once a day as entries age.
+        """
+        day = int(time.time() // 86400)
+        key = tuple(self._file_versions.get(filename) for filename in PROMPT_SECTIONS) + (day,)
+        cached = self._fragment
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        text = self.snapshot.fragment("personality", key) if self.snapshot else None
+        if text is None:
+            sections = [self.current_personality[filename] for filename in PROMPT_SECTIONS
+                        if filename in self.current_personality]
+            text = json.dumps(prompt_view(sections), indent=2)
+            if self.snapshot:
+                self.snapshot.put_fragment("personality", key, text)
+        self._fragment = (key, text)
+        return text
+
+    def keywords(self) -> FrozenSet[str]:
+        """Keywords of everything in the loaded personality, recomputed when its files change."""
+        key = tuple(sorted(self._file_versions.items()))
+        cached = self._keywords
+        if cached is None or cached[0] != key:
+            cached = self._keywords = (key, data_keywords(self.current_personality))
+        return cached[1]
+
+    def _remember(self, filename: str, version, data: Dict) -> None:
+        # Pooled personalities are read by other sessions' threads, so loaded
+        # sections are never changed in place: a write swaps in a new mapping.
+        # Data goes first, so a reader keying a cache on the versions never
+        # files old data under the new version
+        self.current_personality = {**self.current_personality, filename: data}
+        self._file_versions = {**self._file_versions, filename: version}
+        # Written sections go into the snapshot too, so the next start doesn't re-parse them
+        if self.snapshot:
+            self.snapshot.put_section(filename, version, data)
 
     def save_personality_file(self, filename: str, data: Dict) -> None:
         """Save updates to a personality file."""
@@ -100,8 +176,39 @@ class PersonalityManager:
             raise ValueError("No personality loaded")
             
         file_path = os.path.join(self.personality_dir, filename)
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2)
+        with span("disk_write", os.path.basename(self.personality_dir)), locked(file_path):
+            version = write_json_atomic(file_path, data)
         
         # Update current personality
-        self.current_personality[filename] = data
\ No newline at end of file
+        self._remember(filename, version, data)
+
+    def update_personality_file(self, filename: str, new_data: Dict,
+                                merge: Callable[[Dict, Dict], Dict]) -> Dict:
+        """Merge new_data into a personality file and save it, safe against concurrent writers.
+
+        The merge is applied to a copy of the loaded section if the file is
+        unchanged since it was loaded; if another process wrote it in the
+        meantime, the file is re-read and the merge is applied on top of that
+        instead. Either way the loaded section is replaced, not changed, so
+        concurrent readers never see a half-merged dict.
+        """
+        if self.personality_dir is None:
+            raise ValueError("No personality loaded")
+        
+        file_path = os.path.join(self.personality_dir, filename)
+        name = os.path.basename(self.personality_dir)
+        with locked(file_path):
+            current_version = file_version(file_path)
+            if current_version is not None and current_version != self._file_versions.get(filename):
+                lock_stats.record_conflict()
+                data, current_version = read_json_versioned(file_path)
+                base = share_keys(data)
+            else:
+                base = copy.deepcopy(self.current_personality.get(filename, {}))
+            
+            with span("merge", name):
+                merged_data = merge(base, new_data)
+            with span("disk_write", name):
+                version = write_json_atomic(file_path, merged_data)
+            self._remember(filename, version, merged_data)
+        return merged_data
\ No newline at end of file
@@ -0,0 +1,159 @@
+# chatbot/personality_pool.py
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+
+from .personality_manager import PersonalityManager
+from .relationship_manager import RelationshipManager
+
+def estimate_size(obj) -> int:
+    """Approximate resident size in bytes of nested dict/list/str data."""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set)):
+            stack.extend(item)
+    return total
+
+class LoadedPersonality:
+    """A personality loaded into memory, shared by every bot that uses it."""
+
+    __slots__ = ("name", "is_user", "personality_manager", "relationship_manager", "size_bytes")
+
+    def __init__(self, name: str, is_user: bool, personality_manager: PersonalityManager,
+                 relationship_manager: Optional[RelationshipManager]):
+        self.name = name
+        self.is_user = is_user
+        self.personality_manager = personality_manager
+        self.relationship_manager = relationship_manager
+        self.size_bytes = estimate_size(personality_manager.current_personality)
+        if personality_manager.snapshot is not None:
+            # The encoded sections and relationships it holds
+            self.size_bytes += personality_manager.snapshot.resident_bytes()
+
+class PersonalityPool:
+    """Bounded LRU pool of loaded personalities keyed by kind (ai/user) and name.
+
+    Concurrent requests for a personality that is not yet resident share a
+    single in-flight load. Entries are evicted least-recently-used first once
+    either max_entries or max_bytes is exceeded; bots that still hold an
+    evicted entry keep working with it.
+    """
+
+    def __init__(self, base_dir: str = "my-personality", max_entries: int = 64,
+                 max_bytes: int = 64 * 1024 * 1024):
+        self.base_dir = base_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], LoadedPersonality]" = OrderedDict()
+        self._loading: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(name: str, is_user: bool) -> Tuple[str, str]:
+        return ("user" if is_user else "ai", name)
+
+    def get(self, name: str, is_user: bool = False) -> LoadedPersonality:
+        """Return the loaded personality, loading it at most once however many callers ask."""
+        key = self._key(name, is_user)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            pending = self._loading.get(key)
+            if pending is None:
+                pending = self._loading[key] = Future()
+                self.misses += 1
+                owner = True
+            else:
+                self.coalesced += 1
+                owner = False
+
+        if not owner:
+            return pending.result()
+
+        try:
+            entry = self._load(name, is_user)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            pending.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._loading[key]
+            self._entries[key] = entry
+            self.resident_bytes += entry.size_bytes
+            self._evict()
+        pending.set_result(entry)
+        return entry
+
+    def _load(self, name: str, is_user: bool) -> LoadedPersonality:
+        personality_manager = PersonalityManager(self.base_dir)
+        if not personality_manager.load_personality(name, is_user):
+            raise ValueError(f"Failed to load personality: {name}")
+        relationship_manager = None
+        if not is_user:
+            relationship_manager = RelationshipManager(personality_manager.personality_dir,
+                                                       snapshot=personality_manager.snapshot)
+        return LoadedPersonality(name, is_user, personality_manager, relationship_manager)
+
+    def _evict(self) -> None:
+        # Always keep the most recent entry, even if it alone exceeds max_bytes
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries
+                                          or self.resident_bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self.resident_bytes -= entry.size_bytes
+            self.evictions += 1
+
+    def invalidate(self, name: str, is_user: bool = False) -> None:
+        """Drop a personality so the next request reloads it from disk."""
+        with self._lock:
+            entry = self._entries.pop(self._key(name, is_user), None)
+            if entry is not None:
+                self.resident_bytes -= entry.size_bytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.resident_bytes = 0
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / requests if requests else 0.0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "resident_bytes": self.resident_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hit_rate, 4),
+            }
+
+# Shared by every ChatBot in the process unless one is passed explicitly
+default_pool = PersonalityPool()
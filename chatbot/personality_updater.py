@@ -2,12 +2,13 @@
 import json
 import os
 from typing import Dict, Any, List
-from openai import OpenAI
+from .file_lock import locked, write_json_atomic
+from .token_ledger import token_ledger
+from .model_router import model_router
 
 class PersonalityUpdater:
     def __init__(self, personality_manager):
         self.personality_manager = personality_manager
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
     
     def update_personality_from_conversation(self, chat_history: list) -> None:
         """
@@ -16,6 +17,11 @@ class PersonalityUpdater:
         """
         print("\nAnalyzing conversation for personality updates...")
         
+        name = os.path.basename(self.personality_manager.personality_dir or "")
+        if not token_ledger.allow("personality", name):
+            print(f"Deferring personality analysis: {name} is over today's token budget")
+            return
+        
         try:
             system_prompt = """
             Analyze the conversation history and extract new information, carefully distinguishing between the AI assistant's preferences and the user's preferences.
@@ -61,11 +67,7 @@ class PersonalityUpdater:
                 {"role": "user", "content": f"Analyze this conversation and extract new information:\n\n{formatted_history}"}
             ]
             
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=1000
-            )
+            response = model_router.complete("personality", messages, name)
             
             response_content = response.choices[0].message.content
             print("\nGPT Analysis:", response_content)
@@ -128,18 +130,19 @@ class PersonalityUpdater:
             print(f"\nUpdating {filename}...")
             
             try:
-                # Read existing file
-                with open(file_path, 'r') as f:
-                    current_data = json.load(f)
-                print(f"Current data in {filename}:", json.dumps(current_data, indent=2))
-                
-                # Update the data
-                updated_data = self._merge_data(current_data, new_data)
-                print(f"Updated data for {filename}:", json.dumps(updated_data, indent=2))
-                
-                # Write back to file
-                with open(file_path, 'w') as f:
-                    json.dump(updated_data, f, indent=2)
+                # Hold the file lock across the read-modify-write
+                with locked(file_path):
+                    # Read existing file
+                    with open(file_path, 'r') as f:
+                        current_data = json.load(f)
+                    print(f"Current data in {filename}:", json.dumps(current_data, indent=2))
+                    
+                    # Update the data
+                    updated_data = self._merge_data(current_data, new_data)
+                    print(f"Updated data for {filename}:", json.dumps(updated_data, indent=2))
+                    
+                    # Write back to file
+                    write_json_atomic(file_path, updated_data)
                 print(f"Successfully updated {filename}")
                     
             except Exception as e:
@@ -0,0 +1,177 @@
+# chatbot/profiling.py
+import cProfile
+import io
+import linecache
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from .personality_pool import estimate_size
+
+# Frames from the profilers themselves and the import system are noise in allocation diffs
+_IGNORED_FRAMES = (
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, pstats.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+class Profiler:
+    """Opt-in CPU and memory profiling of long runs, written out at checkpoints.
+
+    Every `every` turns (and on stop) it writes, under output_dir:
+      cpu-NNN.prof    raw cProfile stats for the turns since the last checkpoint
+      cpu-NNN.txt     top functions by cumulative and own time
+      memory-NNN.txt  tracemalloc diff against the previous checkpoint, plus the
+                      length and approximate size of every watched object
+
+    cProfile only sees the thread that called start(); tracemalloc sees all threads.
+    When disabled, tick() and watch() do nothing.
+    """
+
+    def __init__(self, output_dir: Optional[str] = None, every: int = 50, top: int = 25, frames: int = 10):
+        self.output_dir = output_dir
+        self.every = every
+        self.top = top
+        self.frames = frames
+        self.enabled = False
+        self.turns = 0
+        self.checkpoints = 0
+        self._profile: Optional[cProfile.Profile] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._started_tracemalloc = False
+        self._watched: Dict[str, Callable[[], object]] = {}
+        self._history: Dict[str, List[int]] = {}
+        self._checkpoint_started = 0.0
+        self._lock = threading.Lock()
+
+    def start(self, output_dir: Optional[str] = None, every: Optional[int] = None) -> None:
+        if output_dir:
+            self.output_dir = output_dir
+        if every:
+            self.every = every
+        if self.enabled:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracemalloc = True
+        self._snapshot = self._take_snapshot()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self._checkpoint_started = time.perf_counter()
+        self.enabled = True
+        print(f"Profiling enabled: checkpoints every {self.every} turns in {self.output_dir}")
+
+    def stop(self) -> None:
+        if not self.enabled:
+            return
+        self.checkpoint("final")
+        self._profile.disable()
+        self.enabled = False
+        self._profile = None
+        self._snapshot = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def watch(self, label: str, getter: Callable[[], object]) -> None:
+        """Report len() and approximate size of getter() at every checkpoint."""
+        if self.enabled:
+            self._watched[label] = getter
+
+    def tick(self, turns: int = 1) -> None:
+        """Count finished turns and write a checkpoint every `every` of them."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.turns += turns
+            due = self.turns % self.every < turns
+        if due:
+            self.checkpoint()
+
+    def checkpoint(self, label: Optional[str] = None) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.checkpoints += 1
+            name = f"{self.checkpoints:03d}"
+            elapsed = time.perf_counter() - self._checkpoint_started
+            self._profile.disable()
+            try:
+                self._write_cpu(name, label, elapsed)
+                self._write_memory(name, label)
+            finally:
+                self._profile = cProfile.Profile()
+                self._checkpoint_started = time.perf_counter()
+                self._profile.enable()
+        print(f"Profile checkpoint {name} written to {self.output_dir}")
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED_FRAMES)
+
+    def _header(self, name: str, label: Optional[str]) -> str:
+        return f"Checkpoint {name}{f' ({label})' if label else ''} after {self.turns} turns\n"
+
+    def _write_cpu(self, name: str, label: Optional[str], elapsed: float) -> None:
+        stats = pstats.Stats(self._profile)
+        stats.dump_stats(os.path.join(self.output_dir, f"cpu-{name}.prof"))
+        out = io.StringIO()
+        out.write(self._header(name, label))
+        out.write(f"Wall time since previous checkpoint: {elapsed:.3f}s\n\n")
+        for sort_key, title in (("cumulative", "cumulative time"), ("tottime", "own time")):
+            out.write(f"Top {self.top} functions by {title}\n")
+            pstats.Stats(self._profile, stream=out).sort_stats(sort_key).print_stats(self.top)
+        with open(os.path.join(self.output_dir, f"cpu-{name}.txt"), 'w') as f:
+            f.write(out.getvalue())
+
+    def _write_memory(self, name: str, label: Optional[str]) -> None:
+        snapshot = self._take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [self._header(name, label)]
+        lines.append(f"Traced memory: current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n")
+
+        lines.append(f"\nTop {self.top} allocation sites by growth since previous checkpoint")
+        for stat in snapshot.compare_to(self._snapshot, "lineno")[:self.top]:
+            lines.append(str(stat))
+
+        lines.append(f"\nTop {self.top} allocation sites by size")
+        for stat in snapshot.statistics("lineno")[:self.top]:
+            lines.append(str(stat))
+
+        if snapshot.traceback_limit > 1:
+            lines.append("\nLargest growth by traceback")
+            for stat in snapshot.compare_to(self._snapshot, "traceback")[:3]:
+                lines.append(f"{stat.size_diff / 1024:+.1f} KiB in {stat.count_diff:+d} blocks")
+                lines.extend(f"    {line}" for line in stat.traceback.format())
+
+        if self._watched:
+            lines.append("\nWatched objects (length, approximate size, size growth since first checkpoint)")
+            for watch_label, getter in sorted(self._watched.items()):
+                try:
+                    obj = getter()
+                    size = estimate_size(obj)
+                    length = len(obj) if hasattr(obj, "__len__") else "-"
+                except Exception as e:
+                    lines.append(f"{watch_label}: unavailable ({e})")
+                    continue
+                history = self._history.setdefault(watch_label, [])
+                history.append(size)
+                lines.append(f"{watch_label}: len={length} size={size / 1024:.1f} KiB "
+                             f"growth={(size - history[0]) / 1024:+.1f} KiB")
+
+        self._snapshot = snapshot
+        with open(os.path.join(self.output_dir, f"memory-{name}.txt"), 'w') as f:
+            f.write("\n".join(lines) + "\n")
+
+profiler = Profiler(
+    output_dir=os.getenv("CHATBOT_PROFILE_DIR"),
+    every=int(os.getenv("CHATBOT_PROFILE_EVERY", "50")),
+)
@@ -0,0 +1,152 @@
+# chatbot/providers.py
+import os
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .lazy_imports import lazy_import
+from .openai_client import get_openai_client
+
+dotenv = lazy_import("dotenv")
+
+# Provider used by routes that don't name one (also set with --provider)
+PROVIDER_ENV = "CHATBOT_PROVIDER"
+
+class Provider:
+    """A chat completions backend.
+
+    chat() takes OpenAI-style request arguments (model, messages, max_tokens,
+    temperature, timeout, stream, ...) and returns an object shaped like an
+    OpenAI ChatCompletion, or an iterator of chunks when stream=True, so the
+    router, token ledger and callers treat every backend the same way.
+    """
+
+    name = "provider"
+
+    def chat(self, **request):
+        raise NotImplementedError
+
+    def describe(self) -> Dict:
+        return {"provider": self.name}
+
+class OpenAIProvider(Provider):
+    """The OpenAI API, keyed by the API key in api_key_env."""
+
+    name = "openai"
+
+    def __init__(self, api_key_env: str = "OPENAI_API_KEY", base_url: Optional[str] = None):
+        self.api_key_env = api_key_env
+        self.base_url = base_url
+
+    def _api_key(self) -> str:
+        dotenv.load_dotenv()
+        api_key = os.getenv(self.api_key_env)
+        if not api_key:
+            raise ValueError(f"API key not found in {self.api_key_env} (environment or .env file)")
+        return api_key
+
+    def chat(self, **request):
+        # The key is only needed once a call is made, so bots can be created without one
+        return get_openai_client(self._api_key(), self.base_url).chat.completions.create(**request)
+
+    def describe(self) -> Dict:
+        return {"provider": self.name, "base_url": self.base_url, "api_key_env": self.api_key_env}
+
+class CompatibleProvider(OpenAIProvider):
+    """A self-hosted server speaking the OpenAI chat completions API (vLLM, llama.cpp, Ollama, ...).
+
+    Such servers usually don't check keys, so the key is optional. Without a
+    base_url, OPENAI_BASE_URL is used.
+    """
+
+    name = "compatible"
+
+    def __init__(self, base_url: Optional[str] = None, api_key_env: str = "OPENAI_API_KEY"):
+        base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        if not base_url:
+            raise ValueError("An OpenAI-compatible provider needs a base_url or OPENAI_BASE_URL")
+        super().__init__(api_key_env, base_url)
+
+    def _api_key(self) -> str:
+        dotenv.load_dotenv()
+        return os.getenv(self.api_key_env) or "not-needed"
+
+class StubProvider(Provider):
+    """In-process deterministic backend for tests and offline runs.
+
+    Replies echo the last message; analyzer prompts (those asking for a JSON
+    object) get "{}" so no personality or relationship data changes. Usage is
+    estimated at four characters per token.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    @staticmethod
+    def text_for(messages: List[Dict]) -> str:
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        if "valid JSON object" in system:
+            return "{}"
+        last = messages[-1].get("content", "") if messages else ""
+        return f"That's interesting! You said: {last[:80]} What else is on your mind?"
+
+    def chat(self, model: str = "stub", messages: Optional[List[Dict]] = None, stream: bool = False, **request):
+        messages = messages or []
+        if self.latency:
+            time.sleep(self.latency)
+        text = self.text_for(messages)
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(text) // 4,
+                                total_tokens=prompt_tokens + len(text) // 4, prompt_tokens_details=None)
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+        if stream:
+            return self._chunks(completion_id, model, text, usage)
+        message = SimpleNamespace(role="assistant", content=text)
+        return SimpleNamespace(id=completion_id, model=model, usage=usage,
+                               choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")])
+
+    @staticmethod
+    def _chunks(completion_id: str, model: str, text: str, usage) -> Iterator:
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            delta = SimpleNamespace(role="assistant", content=word + (" " if i < len(words) - 1 else ""))
+            yield SimpleNamespace(id=completion_id, model=model, usage=None,
+                                  choices=[SimpleNamespace(index=0, delta=delta, finish_reason=None)])
+        # Like the OpenAI API with include_usage: a final chunk with usage and no choices
+        yield SimpleNamespace(id=completion_id, model=model, usage=usage, choices=[])
+
+    def describe(self) -> Dict:
+        return {"provider": self.name, "latency": self.latency}
+
+PROVIDERS = {"openai": OpenAIProvider, "compatible": CompatibleProvider, "stub": StubProvider}
+
+_providers: Dict[Tuple, Provider] = {}
+_providers_lock = threading.Lock()
+
+def default_provider_name() -> str:
+    return os.getenv(PROVIDER_ENV) or "openai"
+
+def get_provider(name: Optional[str] = None, base_url: Optional[str] = None,
+                 api_key_env: str = "OPENAI_API_KEY") -> Provider:
+    """The shared provider for a backend. Without a name, a base_url means an OpenAI-compatible
+    server and otherwise CHATBOT_PROVIDER (default "openai") applies."""
+    if name is None:
+        name = "compatible" if base_url else default_provider_name()
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown provider: {name} (expected one of {', '.join(PROVIDERS)})")
+    key = (name, base_url, api_key_env)
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            if name == "stub":
+                provider = StubProvider()
+            elif name == "compatible":
+                provider = CompatibleProvider(base_url, api_key_env)
+            else:
+                provider = OpenAIProvider(api_key_env, base_url)
+            _providers[key] = provider
+        return provider
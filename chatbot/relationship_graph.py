@@ -0,0 +1,235 @@
+# chatbot/relationship_graph.py
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .file_lock import locked, file_version, read_json_versioned, write_json_atomic, Version
+
+INDEX_FILENAME = ".relationship-index.json"
+
+def edge_summary(data: Dict, size_bytes: int = 0) -> Dict:
+    """The fields of a relationship file that the index keeps for one directed pair."""
+    interactions = data.get("interactions", [])
+    return {
+        "status": data.get("relationship_development", {}).get("current_status", "acquaintance"),
+        "trust_level": data.get("emotional_dynamics", {}).get("trust_level", "neutral"),
+        "interactions": len(interactions),
+        "last_interaction": interactions[-1] if interactions else None,
+        "summaries": len(data.get("summaries", [])),
+        "raw_tokens": data.get("raw_tokens", 0),
+        "bytes": size_bytes,
+        "updated": time.time(),
+    }
+
+class RelationshipGraph:
+    """Index of every relationship file under a personality base directory.
+
+    Edges are keyed by (owner, other), where owner is the AI whose
+    relationships/ directory holds the file. The index is updated whenever a
+    relationship is saved and kept in memory with per-person and per-trust and
+    per-status sets, so queries cost O(result) rather than a scan of every file.
+    It is persisted next to the personalities; edges changed by other processes
+    are picked up when the file on disk changes.
+    """
+
+    def __init__(self, base_dir: str, autosave_every: int = 10):
+        self.base_dir = base_dir
+        self.path = os.path.join(base_dir, INDEX_FILENAME)
+        self.autosave_every = autosave_every
+        self._edges: Dict[Tuple[str, str], Dict] = {}
+        self._outgoing: Dict[str, Set[str]] = {}
+        self._incoming: Dict[str, Set[str]] = {}
+        self._by_trust: Dict[str, Set[Tuple[str, str]]] = {}
+        self._by_status: Dict[str, Set[Tuple[str, str]]] = {}
+        self._dirty: Set[Tuple[str, str]] = set()
+        self._version: Version = None
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    # Maintenance
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded and file_version(self.path) == self._version:
+            return
+        with self._lock:
+            version = file_version(self.path)
+            if self._loaded and version == self._version:
+                return
+            if version is None:
+                if not self._loaded:
+                    self.rebuild()
+                return
+            try:
+                data, self._version = read_json_versioned(self.path)
+            except (OSError, ValueError) as e:
+                print(f"Error loading relationship index, rebuilding: {e}")
+                self.rebuild()
+                return
+            for key, edge in data.get("edges", {}).items():
+                owner, other = key.split("->", 1)
+                # Edges changed here but not saved yet are newer than the file
+                if (owner, other) not in self._dirty:
+                    self._set_edge(owner, other, edge)
+            self._loaded = True
+
+    def rebuild(self) -> None:
+        """Build the index from scratch by reading every relationship file."""
+        with self._lock:
+            self._edges.clear()
+            self._outgoing.clear()
+            self._incoming.clear()
+            self._by_trust.clear()
+            self._by_status.clear()
+            ai_dir = os.path.join(self.base_dir, "ai")
+            for owner in sorted(os.listdir(ai_dir)) if os.path.isdir(ai_dir) else []:
+                relationships_dir = os.path.join(ai_dir, owner, "relationships")
+                if not os.path.isdir(relationships_dir):
+                    continue
+                for filename in os.listdir(relationships_dir):
+                    if not filename.endswith(".json"):
+                        continue
+                    path = os.path.join(relationships_dir, filename)
+                    try:
+                        with open(path, 'r') as f:
+                            data = json.load(f)
+                    except (OSError, ValueError):
+                        continue
+                    self._set_edge(owner, filename[:-len(".json")], edge_summary(data, os.path.getsize(path)))
+            self._dirty = set(self._edges)
+            self._loaded = True
+        self.save()
+
+    def update(self, owner: str, other: str, data: Dict, size_bytes: int = 0) -> None:
+        """Record the current state of owner's relationship with other."""
+        self._ensure_loaded()
+        with self._lock:
+            self._set_edge(owner, other, edge_summary(data, size_bytes))
+            self._dirty.add((owner, other))
+            should_save = len(self._dirty) >= self.autosave_every
+        if should_save:
+            self.save()
+
+    def _set_edge(self, owner: str, other: str, edge: Dict) -> None:
+        key = (owner, other)
+        previous = self._edges.get(key)
+        if previous is not None:
+            self._by_trust.get(previous["trust_level"], set()).discard(key)
+            self._by_status.get(previous["status"], set()).discard(key)
+        self._edges[key] = edge
+        self._outgoing.setdefault(owner, set()).add(other)
+        self._incoming.setdefault(other, set()).add(owner)
+        self._by_trust.setdefault(edge["trust_level"], set()).add(key)
+        self._by_status.setdefault(edge["status"], set()).add(key)
+
+    def save(self) -> None:
+        """Write unsaved edges to the index file, keeping newer edges written by other processes."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            edges = {key: self._edges[key] for key in dirty}
+        if not edges or not os.path.isdir(self.base_dir):
+            return
+        with locked(self.path):
+            try:
+                data, _ = read_json_versioned(self.path)
+            except (OSError, ValueError):
+                data = {"edges": {}}
+            for (owner, other), edge in edges.items():
+                key = f"{owner}->{other}"
+                on_disk = data["edges"].get(key)
+                if on_disk is None or on_disk.get("updated", 0) <= edge["updated"]:
+                    data["edges"][key] = edge
+            version = write_json_atomic(self.path, data, compact=True)
+        with self._lock:
+            # Pick up edges other processes saved, keeping anything changed meanwhile
+            for key, edge in data["edges"].items():
+                owner, other = key.split("->", 1)
+                if (owner, other) not in self._dirty:
+                    self._set_edge(owner, other, edge)
+            self._version = version
+
+    # Queries
+
+    def edge(self, owner: str, other: str) -> Optional[Dict]:
+        self._ensure_loaded()
+        return self._edges.get((owner, other))
+
+    def has_edge(self, owner: str, other: str) -> bool:
+        return self.edge(owner, other) is not None
+
+    def known_by(self, owner: str) -> List[str]:
+        """Everyone owner has a relationship file for."""
+        self._ensure_loaded()
+        return sorted(self._outgoing.get(owner, ()))
+
+    def known_to(self, other: str) -> List[str]:
+        """Every AI that has a relationship file for other."""
+        self._ensure_loaded()
+        return sorted(self._incoming.get(other, ()))
+
+    def trusted_by(self, owner: str, level: str = "high") -> List[str]:
+        """Who owner trusts at the given level, e.g. trusted_by('lucy', 'high')."""
+        self._ensure_loaded()
+        return sorted(other for other in self._outgoing.get(owner, ())
+                      if (owner, other) in self._by_trust.get(level, ()))
+
+    def with_trust(self, level: str) -> List[Tuple[str, str]]:
+        self._ensure_loaded()
+        return sorted(self._by_trust.get(level, ()))
+
+    def with_status(self, status: str) -> List[Tuple[str, str]]:
+        self._ensure_loaded()
+        return sorted(self._by_status.get(status, ()))
+
+    def never_talked_to(self, owner: str, candidates: Iterable[str]) -> List[str]:
+        """Candidates owner has no recorded interaction with, e.g. every user jack has not met."""
+        self._ensure_loaded()
+        result = []
+        for other in candidates:
+            edge = self._edges.get((owner, other))
+            if other != owner and (edge is None or edge["interactions"] == 0):
+                result.append(other)
+        return result
+
+    def stalest_pairs(self, names: Iterable[str], limit: int = 1) -> List[Tuple[str, str]]:
+        """Pairs among names whose relationship was updated least recently, for picking who talks next."""
+        self._ensure_loaded()
+        names = sorted(set(names))
+        pairs = []
+        for i, first in enumerate(names):
+            for second in names[i + 1:]:
+                updated = max(self._edges.get((first, second), {}).get("updated", 0),
+                              self._edges.get((second, first), {}).get("updated", 0))
+                pairs.append((updated, first, second))
+        pairs.sort()
+        return [(first, second) for _, first, second in pairs[:limit]]
+
+    def describe(self, name: str) -> Dict:
+        """Outgoing and incoming edges of one person."""
+        self._ensure_loaded()
+        with self._lock:
+            return {
+                "name": name,
+                "outgoing": {other: self._edges[(name, other)] for other in sorted(self._outgoing.get(name, ()))},
+                "incoming": {owner: self._edges[(owner, name)] for owner in sorted(self._incoming.get(name, ()))},
+            }
+
+_graphs: Dict[str, RelationshipGraph] = {}
+_graphs_lock = threading.Lock()
+
+def graph_for(base_dir: str) -> RelationshipGraph:
+    """The shared index for a personality base directory."""
+    key = os.path.abspath(base_dir)
+    with _graphs_lock:
+        graph = _graphs.get(key)
+        if graph is None:
+            graph = _graphs[key] = RelationshipGraph(base_dir)
+        return graph
+
+def _save_all() -> None:
+    for graph in list(_graphs.values()):
+        graph.save()
+
+atexit.register(_save_all)
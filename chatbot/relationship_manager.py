@@ -1,12 +1,99 @@
 import os
 import json
+import threading
 import time
-from typing import Dict, List, Optional
-from openai import OpenAI
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from .tracing import span
+from .token_ledger import token_ledger, pair_key
+from .model_router import model_router
+from .file_lock import locked, lock_stats, file_version, read_json_versioned, write_json_atomic, Version
+from .token_manager import estimate_tokens
+from .relationship_graph import RelationshipGraph, graph_for
+from .dedup import merge_list, drop_counts, share_keys
+from .snapshot import PersonalitySnapshot
+from .job_journal import already_applied, mark_applied
+
+# Relationship files keep three tiers: the most recent raw items, mid-term
+# summaries of items rolled out of the raw fields, and a long-term digest that
+# older summaries are folded into. Rolling is triggered by the estimated token
+# size of the raw fields, so the prompts built from them stay bounded.
+RAW_TOKEN_LIMIT = 2000
+KEEP_RECENT_ITEMS = 5
+MAX_SUMMARIES = 5
+KEEP_SUMMARIES = 2
+
+# Keys holding summary tiers and bookkeeping rather than raw relationship items
+SUMMARY_KEYS = ("summaries", "digest", "raw_tokens")
+
+def _raw_fields(data: Dict) -> Dict:
+    # Keys starting with '_' hold merge bookkeeping such as duplicate counts
+    return {key: value for key, value in data.items() if key not in SUMMARY_KEYS and not key.startswith("_")}
+
+def _raw_tokens(data: Dict) -> int:
+    return estimate_tokens(json.dumps(_raw_fields(data), separators=(",", ":")))
+
+def _split_recent(data: Dict, keep: int) -> Tuple[Dict, Dict]:
+    """Split the raw lists into the last keep items and the older ones, keeping the nesting."""
+    recent, rolled = {}, {}
+    for key, value in _raw_fields(data).items():
+        if isinstance(value, dict):
+            recent[key], nested = _split_recent(value, keep)
+            if nested:
+                rolled[key] = nested
+        elif isinstance(value, list) and len(value) > keep:
+            recent[key], rolled[key] = value[-keep:], value[:-keep]
+        else:
+            recent[key] = value
+    return recent, rolled
+
+def _needs_compaction(data: Dict) -> bool:
+    """Whether the raw fields are over the limit and compaction would roll anything out of them.
+
+    Lists of KEEP_RECENT_ITEMS or fewer are never rolled, so a relationship
+    whose size comes from a few long entries is left alone rather than queued
+    again on every update.
+    """
+    return (data.get("raw_tokens", 0) > RAW_TOKEN_LIMIT
+            and (bool(_split_recent(data, KEEP_RECENT_ITEMS)[1]) or len(data.get("summaries", [])) > MAX_SUMMARIES))
+
+def _count_items(data: Dict) -> int:
+    return sum(_count_items(value) if isinstance(value, dict) else len(value) for value in data.values())
+
+def _remove_items(data: Dict, rolled: Dict) -> None:
+    """Remove the rolled items from data in place; anything added since stays."""
+    for key, value in rolled.items():
+        current = data.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            _remove_items(current, value)
+        elif isinstance(value, list) and isinstance(current, list):
+            data[key] = [item for item in current if item not in value]
+            drop_counts(data, key, value)
+
+def relationship_context(data: Dict) -> str:
+    """The long-term digest and latest summary of a relationship, for use in prompts."""
+    context = []
+    digest = data.get("digest", {}).get("summary")
+    if digest:
+        context.append(f"Long-term: {digest}")
+    summaries = data.get("summaries", [])
+    if summaries:
+        context.append(f"Recently: {summaries[-1]['summary']}")
+    return "\n".join(context)
+
+_compaction_lock = threading.Lock()
+_compactions_queued = set()
+_executor = None
+
+def _compaction_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _compaction_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="relationship-summary")
+        return _executor
 
 class RelationshipManager:
-    def __init__(self, personality_dir: str):
+    def __init__(self, personality_dir: str, snapshot: Optional[PersonalitySnapshot] = None):
         # personality_dir should be the full path to the AI personality's directory
         self.personality_dir = personality_dir
         self.relationships_dir = os.path.join(self.personality_dir, "relationships")
@@ -17,12 +104,18 @@ class RelationshipManager:
         # Get the AI's name from the directory name
         self.name = os.path.basename(self.personality_dir)
         
-        # Initialize OpenAI client
-        load_dotenv()
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OpenAI API key not found in environment variables or .env file")
-        self.client = OpenAI(api_key=api_key)
+        # AI personalities live in <base>/ai/<name>; their relationships are indexed per base
+        parent = os.path.dirname(os.path.abspath(self.personality_dir))
+        self.graph: Optional[RelationshipGraph] = (
+            graph_for(os.path.dirname(parent)) if os.path.basename(parent) == "ai" else None
+        )
+        
+        # Relationships unchanged since the personality's snapshot was built are
+        # read from it instead of parsed; files added or removed since are synced now
+        self.snapshot = snapshot
+        if snapshot is not None and snapshot.relationships_stale():
+            snapshot.sync_relationships()
+            snapshot.save()
 
     def get_relationship_file(self, other_name: str) -> str:
         """Get the path to a relationship file for a specific person."""
@@ -30,11 +123,24 @@ class RelationshipManager:
 
     def load_relationship(self, other_name: str) -> Dict:
         """Load relationship data for a specific person."""
+        return self._load_relationship_versioned(other_name)[0]
+
+    def _load_relationship_versioned(self, other_name: str) -> Tuple[Dict, Version]:
+        """Load relationship data along with the on-disk version it was read from."""
         file_path = self.get_relationship_file(other_name)
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                return json.load(f)
-        return self._create_blank_relationship(other_name)
+        if self.snapshot is not None:
+            version = file_version(file_path)
+            data = self.snapshot.relationship(other_name, version)
+            if data is not None:
+                return data, version
+        try:
+            data, version = read_json_versioned(file_path)
+        except FileNotFoundError:
+            return self._create_blank_relationship(other_name), None
+        share_keys(data)
+        if self.snapshot is not None:
+            self.snapshot.put_relationship(other_name, version, data)
+        return data, version
 
     def _create_blank_relationship(self, other_name: str) -> Dict:
         """Create a blank relationship template."""
@@ -70,15 +176,52 @@ class RelationshipManager:
             }
         }
 
-    def save_relationship(self, other_name: str, data: Dict) -> None:
+    def save_relationship(self, other_name: str, data: Dict) -> Version:
         """Save relationship data for a specific person."""
         file_path = self.get_relationship_file(other_name)
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2)
+        with span("disk_write", self.name), locked(file_path):
+            version = write_json_atomic(file_path, data)
+        self._index(other_name, data, version)
+        return version
 
-    def _summarize_relationship(self, data: Dict) -> str:
-        """Create a comprehensive summary of the relationship."""
-        system_prompt = f"""You are a relationship summarizer. Create a detailed summary of the relationship between {self.name} and the user.
+    def _index(self, other_name: str, data: Dict, version: Version) -> None:
+        if self.snapshot is not None:
+            self.snapshot.put_relationship(other_name, version, data)
+        if self.graph is not None:
+            self.graph.update(self.name, other_name, data, version[2] if version else 0)
+
+    def _commit_relationship_update(self, other_name: str, base_data: Dict,
+                                    base_version: Version, updates: Dict, job_key: Optional[str] = None) -> Dict:
+        """Merge analysis updates and save, re-merging onto the latest file if it changed.
+
+        The analysis call runs without holding the lock; if another process saved
+        the relationship in the meantime, its data is re-read and the updates are
+        merged on top of it instead of overwriting it. With a job_key the file
+        records the job, and updates of a job it already records are skipped.
+        """
+        file_path = self.get_relationship_file(other_name)
+        with locked(file_path):
+            current_version = file_version(file_path)
+            if current_version != base_version:
+                lock_stats.record_conflict()
+                base_data, _ = self._load_relationship_versioned(other_name)
+            if job_key and already_applied(base_data, job_key):
+                return base_data
+            with span("merge", self.name):
+                merged_data = self._merge_relationship_data(base_data, updates)
+                if job_key:
+                    mark_applied(merged_data, job_key)
+                merged_data["raw_tokens"] = _raw_tokens(merged_data)
+            with span("disk_write", self.name):
+                version = write_json_atomic(file_path, merged_data)
+        self._index(other_name, merged_data, version)
+        if _needs_compaction(merged_data):
+            self.schedule_compaction(other_name)
+        return merged_data
+
+    def _summarize_relationship(self, data: Dict, other_name: Optional[str] = None) -> str:
+        """Summarize relationship items that are about to be rolled out of the raw fields."""
+        system_prompt = f"""You are a relationship summarizer. Create a detailed summary of the relationship between {self.name} and {other_name or 'the user'}.
 
 The summary should include:
 1. Key shared experiences and memories
@@ -93,103 +236,137 @@ Format the summary as a natural narrative that captures the essence of the relat
 
 Make the summary detailed enough to preserve important memories and context, but concise enough to be useful for future interactions."""
         
-        # Format the data for summarization
-        summary_data = {
-            "interactions": data.get("interactions", []),
-            "shared_experiences": data.get("shared_experiences", []),
-            "emotional_dynamics": data.get("emotional_dynamics", {}),
-            "communication_patterns": data.get("communication_patterns", {}),
-            "relationship_development": data.get("relationship_development", {}),
-            "interaction_history": data.get("interaction_history", {})
-        }
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Summarize this relationship data:\n\n{json.dumps(data, indent=2)}"}
+        ]
         
+        with span("relationship_summary", self.name):
+            response = model_router.complete("summary", messages, self.name, pair_key(self.name, other_name))
+        
+        return response.choices[0].message.content.strip()
+
+    def _digest_summaries(self, digest: str, summaries: List[Dict], other_name: str) -> str:
+        """Fold older summaries into the long-term digest of the relationship."""
+        system_prompt = f"""You maintain the long-term memory of the relationship between {self.name} and {other_name}.
+
+Rewrite the existing digest so it also covers the newer summaries, oldest first. Keep the defining moments, how trust and closeness developed, lasting preferences and unresolved issues; drop small talk.
+
+Write a single narrative of at most 250 words."""
+        
+        summary_text = "\n\n".join(f"[{item.get('timestamp', '')}] {item['summary']}" for item in summaries)
         messages = [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Summarize this relationship data:\n\n{json.dumps(summary_data, indent=2)}"}
+            {"role": "user", "content": f"Existing digest:\n{digest or 'None yet.'}\n\nNewer summaries:\n{summary_text}"}
         ]
         
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            max_tokens=500,  # Increased token limit for more detailed summaries
-            temperature=0.7
-        )
+        with span("relationship_digest", self.name):
+            response = model_router.complete("summary", messages, self.name, pair_key(self.name, other_name),
+                                             max_tokens=400, temperature=0.5)
         
         return response.choices[0].message.content.strip()
 
-    def update_relationship(self, other_name: str, conversation: List[Dict]) -> None:
-        """Update relationship data based on conversation."""
+    def schedule_compaction(self, other_name: str) -> None:
+        """Queue a rolling summary of the relationship with other_name, unless one is already queued."""
+        file_path = self.get_relationship_file(other_name)
+        with _compaction_lock:
+            if file_path in _compactions_queued:
+                return
+            _compactions_queued.add(file_path)
+        _compaction_executor().submit(self._compact_relationship, other_name, file_path)
+
+    def _compact_relationship(self, other_name: str, file_path: str) -> None:
+        """Roll the oldest raw items into a summary and old summaries into the digest.
+
+        The summarization calls run without the file lock. On commit the rolled
+        items are removed from whatever the file holds by then, so items added by
+        concurrent updates in the meantime are kept.
+        """
         try:
-            # Load current relationship data
-            relationship_data = self.load_relationship(other_name)
+            data, _ = self._load_relationship_versioned(other_name)
+            if not _needs_compaction(data):
+                return
+            if not token_ledger.allow("summary", self.name, pair_key(self.name, other_name)):
+                return
             
-            # Check if we need to summarize by checking the actual file size
-            file_path = self.get_relationship_file(other_name)
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    lines = f.readlines()
-                    if len(lines) > 200:  # Check actual number of lines
-                        # Create a summary
-                        summary = self._summarize_relationship(relationship_data)
-                        
-                        # Add summary to the top of the file
-                        if "summaries" not in relationship_data:
-                            relationship_data["summaries"] = []
-                        relationship_data["summaries"].append({
-                            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                            "summary": summary
-                        })
-                        
-                        # Keep only the last 5 summaries
-                        if len(relationship_data["summaries"]) > 5:
-                            relationship_data["summaries"] = relationship_data["summaries"][-5:]
-                        
-                        # Reset all other fields to empty values
-                        relationship_data = {
-                            "summaries": relationship_data["summaries"],
-                            "interactions": [],
-                            "observed_traits": [],
-                            "shared_experiences": [],
-                            "emotional_dynamics": {
-                                "positive_moments": [],
-                                "challenges": [],
-                                "trust_level": "neutral"
-                            },
-                            "communication_patterns": {
-                                "topics": [],
-                                "style": [],
-                                "frequency": "occasional"
-                            },
-                            "relationship_development": {
-                                "milestones": [],
-                                "current_status": "stranger",
-                                "growth_areas": []
-                            },
-                            "social_preferences": {
-                                "preferred_topics": [],
-                                "interaction_style": [],
-                                "boundaries": []
-                            },
-                            "interaction_history": {
-                                "recent_interactions": [],
-                                "key_moments": [],
-                                "conflicts": [],
-                                "resolutions": []
-                            }
-                        }
-                        
-                        # Save the reset data
-                        self.save_relationship(other_name, relationship_data)
+            rolled = _split_recent(data, KEEP_RECENT_ITEMS)[1]
+            summary = None
+            if rolled:
+                summary = {
+                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "summary": self._summarize_relationship(rolled, other_name),
+                    "items": _count_items(rolled),
+                }
             
-            # Create system prompt for relationship analysis
-            system_prompt = f"""You are a relationship analyzer. Your task is to analyze this conversation and return ONLY a valid JSON object.
+            summaries = data.get("summaries", []) + ([summary] if summary else [])
+            folded, digest = [], None
+            if len(summaries) > MAX_SUMMARIES:
+                folded = summaries[:len(summaries) - KEEP_SUMMARIES]
+                digest = {
+                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "summary": self._digest_summaries(data.get("digest", {}).get("summary", ""), folded, other_name),
+                    "summaries_folded": data.get("digest", {}).get("summaries_folded", 0) + len(folded),
+                }
+            if not summary and not digest:
+                return
+            
+            with locked(file_path):
+                current, _ = self._load_relationship_versioned(other_name)
+                _remove_items(current, rolled)
+                if summary:
+                    current.setdefault("summaries", []).append(summary)
+                if digest:
+                    current["summaries"] = [item for item in current.get("summaries", []) if item not in folded]
+                    current["digest"] = digest
+                current["raw_tokens"] = _raw_tokens(current)
+                with span("disk_write", self.name):
+                    version = write_json_atomic(file_path, current)
+            self._index(other_name, current, version)
+        except Exception as e:
+            print(f"❌ Error summarizing relationship with {other_name}: {e}")
+        finally:
+            with _compaction_lock:
+                _compactions_queued.discard(file_path)
+
+    def update_relationship(self, other_name: str, conversation: List[Dict]) -> None:
+        """Update relationship data based on conversation."""
+        try:
+            updates = self.analyze_relationship(other_name, conversation)
+            if updates is not None:
+                self.apply_relationship_update(other_name, updates)
+        except json.JSONDecodeError as e:
+            print(f"❌ Error parsing GPT response as JSON: {e}")
+        except Exception as e:
+            print(f"❌ Error in relationship update process: {e}")
+
+    def apply_relationship_update(self, other_name: str, updates: Dict, job_key: Optional[str] = None) -> Dict:
+        """Merge the updates from analyze_relationship into the saved relationship."""
+        relationship_data, version = self._load_relationship_versioned(other_name)
+        return self._commit_relationship_update(other_name, relationship_data, version, updates, job_key)
+
+    def analyze_relationship(self, other_name: str, conversation: List[Dict]) -> Optional[Dict]:
+        """Ask the analyzer how conversation changes the relationship with other_name.
+
+        Returns the updates to merge, or None when the analysis is deferred because
+        the personality is over its token budget. Errors are raised to the caller.
+        """
+        pair = pair_key(self.name, other_name)
+        if not token_ledger.allow("relationship", self.name, pair):
+            print(f"Deferring relationship update with {other_name}: {self.name} is over today's token budget")
+            return None
+        
+        # Load current relationship data
+        relationship_data = self.load_relationship(other_name)
+        
+        # Create system prompt for relationship analysis
+        system_prompt = f"""You are a relationship analyzer. Your task is to analyze this conversation and return ONLY a valid JSON object.
 
 IMPORTANT: Your entire response must be a valid JSON object, nothing else.
 
 Analyze the conversation between {self.name} and {other_name} and update their relationship data.
 
 Consider the following relationship context:
-{relationship_data.get('summaries', [{}])[-1].get('summary', 'No previous summary available')}
+{relationship_context(relationship_data) or 'No previous summary available'}
 
 Return format must be exactly:
 {{
@@ -225,44 +402,24 @@ Return format must be exactly:
 }}
 
 Only include fields that need updates. Ensure the response is valid JSON."""
-            
-            # Format the conversation for analysis
-            conversation_text = "\n".join([
-                f"{msg['speaker']}: {msg['message']}" 
-                for msg in conversation
-            ])
-            
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Analyze this conversation:\n\n{conversation_text}"}
-            ]
-            
-            # Get analysis from GPT
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=1000,
-                temperature=0.7
-            )
-            
-            response_content = response.choices[0].message.content
-            
-            try:
-                # Try to parse the JSON response
-                updates = json.loads(response_content)
-                
-                # Merge updates with current data
-                merged_data = self._merge_relationship_data(relationship_data, updates)
-                
-                # Save the updated data
-                self.save_relationship(other_name, merged_data)
-                
-            except json.JSONDecodeError as e:
-                print(f"❌ Error parsing GPT response as JSON: {e}")
-                print("Raw response was:", response_content)
         
-        except Exception as e:
-            print(f"❌ Error in relationship update process: {e}")
+        # Format the conversation for analysis
+        conversation_text = "\n".join([
+            f"{msg['speaker']}: {msg['message']}" 
+            for msg in conversation
+        ])
+        
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Analyze this conversation:\n\n{conversation_text}"}
+        ]
+        
+        # Get analysis from GPT
+        with span("relationship_analysis", self.name):
+            response = model_router.complete("relationship", messages, self.name, pair)
+        
+        response_content = response.choices[0].message.content
+        return json.loads(response_content)
 
     def _merge_relationship_data(self, current_data: Dict, new_data: Dict) -> Dict:
         """Merge new relationship data with current data."""
@@ -272,9 +429,8 @@ Only include fields that need updates. Ensure the response is valid JSON."""
                     current_data[key] = {}
                 current_data[key] = self._merge_relationship_data(current_data[key], value)
             elif isinstance(value, list):
-                if key not in current_data:
-                    current_data[key] = []
-                current_data[key].extend(item for item in value if item not in current_data[key])
+                # Near-duplicates of existing entries are counted instead of appended
+                merge_list(current_data, key, value)
             else:
                 current_data[key] = value
         return current_data 
\ No newline at end of file
@@ -0,0 +1,672 @@
+# chatbot/server.py
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from .chatbot import ChatBot
+from .chat_utils import is_valid_name
+from .personality_pool import PersonalityPool, default_pool
+from .file_lock import lock_stats
+from .tracing import tracer
+from .token_ledger import token_ledger
+from .relationship_graph import graph_for
+from .model_router import model_router
+from .job_journal import job_journal
+from .novelty import novelty_gate
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+# Sessions nobody has used for this long are ended as if the client had deleted
+# them, and at most this many are open at once; beyond that new ones get 503
+SESSION_IDLE_SECONDS = 30 * 60
+MAX_SESSIONS = 1000
+
+REASONS = {
+    200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request",
+    404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+    426: "Upgrade Required", 431: "Request Header Fields Too Large",
+    500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable",
+}
+
+class Overloaded(Exception):
+    """Raised when the upstream is saturated and the wait queue is full."""
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class AdmissionController:
+    """Caps concurrent upstream calls and rejects new work once the wait queue is full."""
+
+    def __init__(self, max_inflight: int = 8, max_queue: int = 32):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.inflight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_inflight)
+
+    def slot(self, reject: bool = True) -> '_Slot':
+        """Context manager holding one upstream slot; raises Overloaded if reject and the queue is full."""
+        return _Slot(self, reject)
+
+    def stats(self) -> Dict:
+        return {
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+        }
+
+class _Slot:
+    def __init__(self, controller: AdmissionController, reject: bool):
+        self._controller = controller
+        self._reject = reject
+
+    async def __aenter__(self):
+        controller = self._controller
+        if (self._reject and controller.inflight >= controller.max_inflight
+                and controller.waiting >= controller.max_queue):
+            controller.rejected += 1
+            raise Overloaded()
+        controller.waiting += 1
+        try:
+            await controller._semaphore.acquire()
+        finally:
+            controller.waiting -= 1
+        controller.inflight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._controller.inflight -= 1
+        self._controller._semaphore.release()
+        return False
+
+class ChatSession:
+    def __init__(self, user_name: str, ai_name: str, bot: ChatBot):
+        self.id = uuid.uuid4().hex
+        self.user_name = user_name
+        self.ai_name = ai_name
+        self.bot = bot
+        self.created = time.time()
+        self.last_active = time.monotonic()
+        self.turns = 0
+        # One turn at a time per session so the conversation history stays ordered
+        self.lock = asyncio.Lock()
+        # Post-response updates of the previous turn, awaited before the next one
+        self.pending_update: Optional[asyncio.Future] = None
+
+    def describe(self) -> Dict:
+        return {
+            "session_id": self.id,
+            "user": self.user_name,
+            "ai": self.ai_name,
+            "turns": self.turns,
+            "created": self.created,
+        }
+
+class Request:
+    def __init__(self, method: str, target: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.target = target
+        parts = urlsplit(target)
+        self.path = parts.path
+        self.query = parse_qs(parts.query)
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get("connection", "").lower() != "close"
+
+    @property
+    def is_websocket(self) -> bool:
+        return self.headers.get("upgrade", "").lower() == "websocket"
+
+    def json(self) -> Dict:
+        if not self.body:
+            return {}
+        try:
+            payload = json.loads(self.body)
+        except (ValueError, UnicodeDecodeError):
+            raise HTTPError(400, "Request body must be valid JSON")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return payload
+
+class WebSocket:
+    """Minimal RFC 6455 server-side connection: text frames, ping/pong and close."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self.closed = False
+
+    async def receive(self) -> Optional[str]:
+        """Return the next text message, or None once the connection is closed."""
+        fragments = []
+        size = 0
+        try:
+            while True:
+                first, second = await self._reader.readexactly(2)
+                fin = first & 0x80
+                opcode = first & 0x0F
+                length = second & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", await self._reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", await self._reader.readexactly(8))[0]
+                size += length
+                if size > MAX_BODY_BYTES:
+                    await self.close(1009)
+                    return None
+                mask = await self._reader.readexactly(4) if second & 0x80 else b""
+                payload = await self._reader.readexactly(length)
+                if mask:
+                    payload = _unmask(payload, mask)
+
+                if opcode == 0x8:
+                    await self.close()
+                    return None
+                if opcode == 0x9:
+                    await self._send_frame(0xA, payload)
+                    continue
+                if opcode == 0xA:
+                    continue
+                fragments.append(payload)
+                if fin:
+                    return b"".join(fragments).decode("utf-8", errors="replace")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.closed = True
+            return None
+
+    async def send_json(self, payload: Dict) -> None:
+        await self._send_frame(0x1, json.dumps(payload).encode())
+
+    async def close(self, code: int = 1000) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self._send_frame(0x8, struct.pack("!H", code))
+        except ConnectionError:
+            pass
+
+    async def _send_frame(self, opcode: int, payload: bytes) -> None:
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        self._writer.write(header + payload)
+        await self._writer.drain()
+
+def _unmask(payload: bytes, mask: bytes) -> bytes:
+    key = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(len(payload), "big")
+
+def _require_name(payload: Dict, field: str) -> str:
+    value = payload.get(field)
+    if not is_valid_name(value):
+        raise HTTPError(400, f"'{field}' must be 1-64 letters, digits, '-' or '_'")
+    return value
+
+def _require_message(payload: Dict) -> str:
+    message = payload.get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise HTTPError(400, "'message' must be a non-empty string")
+    return message.strip()
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    """Read one HTTP request, or None if the connection closed before it started."""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, "Request headers too large")
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target, headers, body)
+
+def write_head(writer: asyncio.StreamWriter, status: int, headers: list, keep_alive: bool) -> None:
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"] + headers
+    lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+
+async def send_json(writer: asyncio.StreamWriter, status: int, payload: Dict,
+                    keep_alive: bool = True, headers: Optional[list] = None) -> None:
+    body = json.dumps(payload).encode()
+    write_head(writer, status, [
+        "Content-Type: application/json",
+        f"Content-Length: {len(body)}",
+    ] + (headers or []), keep_alive)
+    writer.write(body)
+    await writer.drain()
+
+async def send_internal_error(writer: asyncio.StreamWriter, error: Exception, upgraded: bool = False) -> None:
+    """Log an unexpected error and answer 500, unless the connection no longer speaks HTTP."""
+    print(f"Error handling request: {error!r}")
+    if upgraded:
+        return
+    try:
+        await send_json(writer, 500, {"error": "Internal server error"}, keep_alive=False)
+    except (ConnectionError, RuntimeError):
+        pass
+
+class ChatServer:
+    """HTTP + WebSocket chat server hosting many concurrent sessions in one process.
+
+    Each AI personality is loaded once through the personality pool and shared
+    by every session talking to it; sessions only own their conversation
+    history. Completion calls run on
+    a thread pool so the event loop never blocks, and an admission controller
+    bounds how many of them are in flight.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8080, max_inflight: int = 8,
+                 max_queue: int = 32, pool: Optional[PersonalityPool] = None,
+                 max_sessions: int = MAX_SESSIONS, session_idle: float = SESSION_IDLE_SECONDS):
+        self.host = host
+        self.port = port
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.max_sessions = max_sessions
+        self.session_idle = session_idle
+        self.sessions: Dict[str, ChatSession] = {}
+        self.pool = pool or default_pool
+        self._executor = ThreadPoolExecutor(max_workers=max_inflight + 4, thread_name_prefix="chat-upstream")
+        self.admission: Optional[AdmissionController] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Bind the listening socket; the actual port is available on self.port afterwards."""
+        self.admission = AdmissionController(self.max_inflight, self.max_queue)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  limit=MAX_HEADER_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._reaper = asyncio.ensure_future(self._reap_idle_sessions())
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        print(f"Chat server listening on http://{self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=False)
+
+    # Sessions
+
+    async def create_session(self, user_name: str, ai_name: str) -> ChatSession:
+        # Cheap once the personality is resident; concurrent first loads share one read
+        loop = asyncio.get_running_loop()
+        try:
+            bot = await loop.run_in_executor(self._executor, ChatBot, ai_name, False, self.pool)
+        except ValueError as e:
+            raise HTTPError(404, str(e))
+        if len(self.sessions) >= self.max_sessions:
+            raise HTTPError(503, "Too many open sessions, please retry later")
+        session = ChatSession(user_name, ai_name, bot)
+        self.sessions[session.id] = session
+        return session
+
+    async def end_session(self, session: ChatSession) -> None:
+        """Move a finished session into the bot's episodic memory once its last turn is recorded, then close the bot."""
+        async with session.lock:
+            await self._settle_update(session)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, session.bot.end_session, session.user_name)
+            try:
+                await loop.run_in_executor(self._executor, session.bot.close)
+            except Exception as e:
+                print(f"Error in {session.ai_name}'s updates for {session.user_name}: {e}")
+
+    async def expire_idle_sessions(self) -> None:
+        """End the sessions idle for longer than session_idle; one mid-turn is never idle."""
+        now = time.monotonic()
+        idle = [session for session in self.sessions.values()
+                if not session.lock.locked() and now - session.last_active >= self.session_idle]
+        for session in idle:
+            self.sessions.pop(session.id, None)
+            try:
+                await self.end_session(session)
+            except Exception as e:
+                print(f"Error ending idle session {session.id}: {e}")
+
+    async def _reap_idle_sessions(self) -> None:
+        while True:
+            await asyncio.sleep(min(self.session_idle / 4, 60))
+            await self.expire_idle_sessions()
+
+    @staticmethod
+    async def _settle_update(session: ChatSession) -> None:
+        """Wait for the previous turn's updates; a failed update is logged and doesn't block the session."""
+        if session.pending_update is None:
+            return
+        try:
+            await session.pending_update
+        except Exception as e:
+            print(f"Error recording {session.ai_name}'s exchange with {session.user_name}: {e}")
+        finally:
+            session.pending_update = None
+
+    def _get_session(self, session_id: str) -> ChatSession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPError(404, f"Unknown session: {session_id}")
+        return session
+
+    async def run_turn(self, session: ChatSession, message: str,
+                       on_chunk: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        """Generate one reply, streaming chunks to on_chunk if given.
+
+        The reply is returned as soon as it is complete; history, relationship
+        and personality updates run afterwards and finish before the session's
+        next turn starts.
+        """
+        loop = asyncio.get_running_loop()
+        async with session.lock:
+            await self._settle_update(session)
+
+            async with self.admission.slot():
+                if on_chunk is None:
+                    reply = await loop.run_in_executor(
+                        self._executor, session.bot.get_response, message, session.user_name, False
+                    )
+                else:
+                    parts = []
+                    async for chunk in self._stream_reply(session, message):
+                        parts.append(chunk)
+                        await on_chunk(chunk)
+                    reply = "".join(parts)
+
+            session.turns += 1
+            session.last_active = time.monotonic()
+            session.pending_update = asyncio.ensure_future(self._record_exchange(session, message, reply))
+        return reply
+
+    async def _stream_reply(self, session: ChatSession, message: str):
+        """Relay chunks produced by the bot's streaming call on a worker thread."""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def produce():
+            try:
+                for chunk in session.bot.stream_response(message, session.user_name, record=False):
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        producer = loop.run_in_executor(self._executor, produce)
+        while True:
+            chunk = await queue.get()
+            if chunk is done:
+                break
+            yield chunk
+        await producer
+
+    async def _record_exchange(self, session: ChatSession, message: str, reply: str) -> None:
+        # Analysis calls use the upstream too, but are queued rather than rejected
+        loop = asyncio.get_running_loop()
+        async with self.admission.slot(reject=False):
+            await loop.run_in_executor(
+                self._executor, session.bot.record_exchange, message, reply, session.user_name
+            )
+
+    # HTTP
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = None
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    if request.is_websocket:
+                        await self._handle_websocket(request, reader, writer)
+                        break
+                    await self._dispatch(request, writer)
+                except HTTPError as e:
+                    await self._send_json(writer, e.status, {"error": e.message}, keep_alive=False)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    await send_internal_error(writer, e, upgraded=request is not None and request.is_websocket)
+                    break
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        return await read_request(reader)
+
+    async def _dispatch(self, request: Request, writer: asyncio.StreamWriter) -> None:
+        parts = [part for part in request.path.split("/") if part]
+        keep_alive = request.keep_alive
+
+        if parts == ["health"] and request.method == "GET":
+            await self._send_json(writer, 200, {
+                "status": "ok",
+                "sessions": len(self.sessions),
+                "personality_pool": self.pool.stats(),
+                "file_locks": lock_stats.as_dict(),
+                "admission": self.admission.stats(),
+                "jobs": job_journal.backlog(),
+                "novelty_gate": novelty_gate.stats(),
+            }, keep_alive)
+        elif parts == ["metrics"] and request.method == "GET":
+            if request.query.get("format") == ["json"]:
+                await self._send_json(writer, 200, {"enabled": tracer.enabled, "stages": tracer.snapshot()}, keep_alive)
+            else:
+                await self._send_text(writer, 200, tracer.export_prometheus(), keep_alive)
+        elif parts == ["usage"] and request.method == "GET":
+            day = request.query.get("day", [None])[0]
+            await self._send_json(writer, 200, {
+                "totals": token_ledger.totals(day=day),
+                "by_call_type": token_ledger.breakdown("call_type", day),
+                "by_personality": token_ledger.breakdown("personality", day),
+                "budgets": {name: {"tokens_per_day": budget, "status": token_ledger.budget_status(name)}
+                            for name, budget in token_ledger.budgets.items() if name != "*"},
+            }, keep_alive)
+        elif parts == ["routes"] and request.method == "GET":
+            await self._send_json(writer, 200, model_router.stats(), keep_alive)
+        elif len(parts) == 2 and parts[0] == "relationships" and request.method == "GET":
+            graph = graph_for(self.pool.base_dir)
+            name = _require_name({"name": parts[1]}, "name")
+            trust = request.query.get("trust", [None])[0]
+            if trust:
+                await self._send_json(writer, 200, {"name": name, "trust_level": trust,
+                                                    "trusts": graph.trusted_by(name, trust)}, keep_alive)
+            else:
+                await self._send_json(writer, 200, graph.describe(name), keep_alive)
+        elif parts == ["sessions"] and request.method == "POST":
+            payload = request.json()
+            session = await self.create_session(_require_name(payload, "user"), _require_name(payload, "ai"))
+            await self._send_json(writer, 201, session.describe(), keep_alive)
+        elif len(parts) == 2 and parts[0] == "sessions":
+            session = self._get_session(parts[1])
+            if request.method == "GET":
+                await self._send_json(writer, 200, session.describe(), keep_alive)
+            elif request.method == "DELETE":
+                del self.sessions[session.id]
+                await self.end_session(session)
+                await self._send_empty(writer, 204, keep_alive)
+            else:
+                raise HTTPError(405, "Use GET or DELETE")
+        elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages":
+            if request.method != "POST":
+                raise HTTPError(405, "Use POST")
+            session = self._get_session(parts[1])
+            payload = request.json()
+            message = _require_message(payload)
+            if payload.get("stream"):
+                await self._stream_http(session, message, writer, keep_alive)
+            else:
+                try:
+                    reply = await self.run_turn(session, message)
+                except Overloaded:
+                    await self._send_overloaded(writer, keep_alive)
+                    return
+                await self._send_json(writer, 200, {"session_id": session.id, "reply": reply}, keep_alive)
+        elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "ws":
+            raise HTTPError(426, "WebSocket upgrade required")
+        else:
+            raise HTTPError(404, f"No route for {request.method} {request.path}")
+
+    async def _stream_http(self, session: ChatSession, message: str,
+                           writer: asyncio.StreamWriter, keep_alive: bool) -> None:
+        """Stream a reply as chunked newline-delimited JSON events."""
+        started = False
+
+        async def write_event(event: Dict) -> None:
+            data = (json.dumps(event) + "\n").encode()
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+
+        async def on_chunk(chunk: str) -> None:
+            nonlocal started
+            if not started:
+                started = True
+                self._write_head(writer, 200, [
+                    "Content-Type: application/x-ndjson",
+                    "Transfer-Encoding: chunked",
+                ], keep_alive)
+            await write_event({"type": "delta", "text": chunk})
+
+        try:
+            reply = await self.run_turn(session, message, on_chunk=on_chunk)
+        except Overloaded:
+            await self._send_overloaded(writer, keep_alive)
+            return
+        if not started:
+            await on_chunk("")
+        await write_event({"type": "done", "reply": reply})
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _handle_websocket(self, request: Request, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter) -> None:
+        parts = [part for part in request.path.split("/") if part]
+        if not (len(parts) == 3 and parts[0] == "sessions" and parts[2] == "ws"):
+            raise HTTPError(404, f"No WebSocket endpoint at {request.path}")
+        session = self._get_session(parts[1])
+        key = request.headers.get("sec-websocket-key")
+        if not key:
+            raise HTTPError(400, "Missing Sec-WebSocket-Key")
+
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode())
+        await writer.drain()
+
+        ws = WebSocket(reader, writer)
+
+        async def send_delta(chunk: str) -> None:
+            await ws.send_json({"type": "delta", "text": chunk})
+
+        while True:
+            text = await ws.receive()
+            if text is None:
+                break
+            # Accept either {"message": "..."} or the raw message text
+            try:
+                payload = json.loads(text)
+                message = _require_message(payload) if isinstance(payload, dict) else text.strip()
+            except ValueError:
+                message = text.strip()
+            except HTTPError as e:
+                await ws.send_json({"type": "error", "error": e.message})
+                continue
+            if not message:
+                await ws.send_json({"type": "error", "error": "'message' must be a non-empty string"})
+                continue
+
+            try:
+                reply = await self.run_turn(session, message, on_chunk=send_delta)
+            except Overloaded:
+                await ws.send_json({"type": "error", "error": "overloaded", "retry_after": 1})
+                continue
+            await ws.send_json({"type": "done", "reply": reply})
+        await ws.close()
+
+    def _write_head(self, writer: asyncio.StreamWriter, status: int, headers: list, keep_alive: bool) -> None:
+        write_head(writer, status, headers, keep_alive)
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: Dict,
+                         keep_alive: bool = True, headers: Optional[list] = None) -> None:
+        await send_json(writer, status, payload, keep_alive, headers)
+
+    async def _send_text(self, writer: asyncio.StreamWriter, status: int, text: str, keep_alive: bool = True) -> None:
+        body = text.encode()
+        self._write_head(writer, status, [
+            "Content-Type: text/plain; version=0.0.4",
+            f"Content-Length: {len(body)}",
+        ], keep_alive)
+        writer.write(body)
+        await writer.drain()
+
+    async def _send_empty(self, writer: asyncio.StreamWriter, status: int, keep_alive: bool) -> None:
+        self._write_head(writer, status, ["Content-Length: 0"], keep_alive)
+        await writer.drain()
+
+    async def _send_overloaded(self, writer: asyncio.StreamWriter, keep_alive: bool) -> None:
+        await self._send_json(writer, 503, {"error": "Upstream is saturated, please retry"},
+                              keep_alive, headers=["Retry-After: 1"])
+
+def run_server(host: str = "127.0.0.1", port: int = 8080, max_inflight: int = 8, max_queue: int = 32,
+               pool: Optional[PersonalityPool] = None) -> None:
+    """Run the chat server until interrupted."""
+    server = ChatServer(host, port, max_inflight=max_inflight, max_queue=max_queue, pool=pool)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
@@ -0,0 +1,216 @@
+# chatbot/snapshot.py
+import atexit
+import marshal
+import os
+import sys
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from .dedup import share_keys
+from .file_lock import file_version, read_json_versioned, write_bytes_atomic, Version
+
+SNAPSHOT_FILENAME = ".snapshot.bin"
+
+# marshal's format is tied to the interpreter version, so the header names it and
+# a snapshot written by another Python is rebuilt rather than read
+_MAGIC = b"CBSNAP\x02"
+_HEADER = _MAGIC + sys.implementation.cache_tag.encode() + b"\n"
+
+# Relationships whose plain encoding is kept for fast reads; the rest stay compressed.
+# zlib level 1 gets most of the size reduction of the higher levels in a fraction of the time
+HOT_RELATIONSHIPS = 8
+PACK_LEVEL = 1
+
+class PersonalitySnapshot:
+    """Compiled copy of one personality's section files, relationships and prompt fragments.
+
+    The snapshot is a single marshal-encoded file in the personality directory.
+    Every entry records the version (inode, mtime, size) of the source file it
+    was built from and is only used while the source still has that version,
+    so a stale entry costs one stat and a re-parse of that file alone. Entries
+    are stored as separately encoded blobs: loading the snapshot decodes only
+    its index, and each returned section or relationship is a fresh object.
+    Relationship blobs are also compressed, as a personality can have many
+    more of them than it reads; the last few read keep their plain encoding.
+    """
+
+    def __init__(self, personality_dir: str):
+        self.personality_dir = personality_dir
+        self.path = os.path.join(personality_dir, SNAPSHOT_FILENAME)
+        self.relationships_dir = os.path.join(personality_dir, "relationships")
+        self.sections: Dict[str, Tuple[Version, bytes]] = {}
+        # zlib-compressed encodings
+        self.relationships: Dict[str, Tuple[Version, bytes]] = {}
+        self._hot: "OrderedDict[str, Tuple[Version, bytes]]" = OrderedDict()
+        self.fragments: Dict[str, Tuple[Any, str]] = {}
+        # Version of the relationships directory when relationships were last synced;
+        # it changes when relationship files are added or removed
+        self.relationships_dir_version: Version = None
+        self.dirty = False
+        self._lock = threading.Lock()
+        _snapshots.add(self)
+
+    @classmethod
+    def load(cls, personality_dir: str) -> 'PersonalitySnapshot':
+        """The snapshot of personality_dir, or an empty one if it is missing or unreadable."""
+        snapshot = cls(personality_dir)
+        try:
+            with open(snapshot.path, 'rb') as f:
+                payload = f.read()
+        except FileNotFoundError:
+            return snapshot
+        if not payload.startswith(_HEADER):
+            return snapshot
+        try:
+            data = marshal.loads(memoryview(payload)[len(_HEADER):])
+            snapshot.sections = data["sections"]
+            snapshot.relationships = data["relationships"]
+            snapshot.fragments = data["fragments"]
+            snapshot.relationships_dir_version = data["relationships_dir"]
+        except (EOFError, ValueError, TypeError, KeyError) as e:
+            print(f"Ignoring unreadable snapshot {snapshot.path}: {e}")
+        return snapshot
+
+    def save(self) -> None:
+        """Write the snapshot if anything changed since it was loaded or saved."""
+        with self._lock:
+            if not self.dirty:
+                return
+            payload = _HEADER + marshal.dumps({
+                "sections": self.sections,
+                "relationships": self.relationships,
+                "fragments": self.fragments,
+                "relationships_dir": self.relationships_dir_version,
+            })
+            self.dirty = False
+        if not os.path.isdir(self.personality_dir):
+            return
+        try:
+            write_bytes_atomic(self.path, payload)
+        except OSError as e:
+            print(f"Error saving snapshot {self.path}: {e}")
+
+    # Entries
+
+    @staticmethod
+    def _get(entries: Dict[str, Tuple[Version, bytes]], key: str, version: Version) -> Optional[Dict]:
+        entry = entries.get(key)
+        if version is None or entry is None or entry[0] != version:
+            return None
+        return marshal.loads(entry[1])
+
+    def _put(self, entries: Dict[str, Tuple[Version, bytes]], key: str, version: Version, data: Dict) -> None:
+        if version is None:
+            return
+        blob = marshal.dumps(data)
+        with self._lock:
+            entries[key] = (version, blob)
+            self.dirty = True
+
+    def section(self, filename: str, version: Version) -> Optional[Dict]:
+        return self._get(self.sections, filename, version)
+
+    def put_section(self, filename: str, version: Version, data: Dict) -> None:
+        self._put(self.sections, filename, version, data)
+
+    def keep_sections(self, filenames: Iterable[str]) -> None:
+        """Drop sections whose files no longer exist."""
+        keep = set(filenames)
+        with self._lock:
+            for filename in [f for f in self.sections if f not in keep]:
+                del self.sections[filename]
+                self.dirty = True
+
+    def relationship(self, other_name: str, version: Version) -> Optional[Dict]:
+        if version is None:
+            return None
+        with self._lock:
+            hot = self._hot.get(other_name)
+            if hot is not None and hot[0] == version:
+                self._hot.move_to_end(other_name)
+                return marshal.loads(hot[1])
+            entry = self.relationships.get(other_name)
+        if entry is None or entry[0] != version:
+            return None
+        blob = zlib.decompress(entry[1])
+        self._keep_hot(other_name, version, blob)
+        return marshal.loads(blob)
+
+    def put_relationship(self, other_name: str, version: Version, data: Dict, hot: bool = True) -> None:
+        if version is None:
+            return
+        blob = marshal.dumps(data)
+        packed = zlib.compress(blob, PACK_LEVEL)
+        with self._lock:
+            self.relationships[other_name] = (version, packed)
+            self.dirty = True
+        if hot:
+            self._keep_hot(other_name, version, blob)
+
+    def _keep_hot(self, other_name: str, version: Version, blob: bytes) -> None:
+        with self._lock:
+            self._hot[other_name] = (version, blob)
+            self._hot.move_to_end(other_name)
+            while len(self._hot) > HOT_RELATIONSHIPS:
+                self._hot.popitem(last=False)
+
+    def resident_bytes(self) -> int:
+        """Bytes held by the encoded entries."""
+        with self._lock:
+            return (sum(len(blob) for _, blob in self.sections.values())
+                    + sum(len(blob) for _, blob in self.relationships.values())
+                    + sum(len(blob) for _, blob in self._hot.values())
+                    + sum(sys.getsizeof(text) for _, text in self.fragments.values()))
+
+    def fragment(self, name: str, key: Any) -> Optional[str]:
+        """A pre-rendered prompt fragment, if it was rendered from sources with this key."""
+        entry = self.fragments.get(name)
+        return entry[1] if entry is not None and entry[0] == key else None
+
+    def put_fragment(self, name: str, key: Any, text: str) -> None:
+        with self._lock:
+            self.fragments[name] = (key, text)
+            self.dirty = True
+
+    # Relationships
+
+    def relationships_stale(self) -> bool:
+        return file_version(self.relationships_dir) != self.relationships_dir_version
+
+    def sync_relationships(self) -> None:
+        """Bring every relationship entry up to date, parsing only files whose version changed."""
+        dir_version = file_version(self.relationships_dir)
+        names = set()
+        if dir_version is not None:
+            for filename in os.listdir(self.relationships_dir):
+                if not filename.endswith(".json"):
+                    continue
+                other_name = filename[:-len(".json")]
+                names.add(other_name)
+                path = os.path.join(self.relationships_dir, filename)
+                entry = self.relationships.get(other_name)
+                if entry is not None and entry[0] == file_version(path):
+                    continue
+                try:
+                    data, version = read_json_versioned(path)
+                except (OSError, ValueError):
+                    continue
+                self.put_relationship(other_name, version, share_keys(data), hot=False)
+        with self._lock:
+            for other_name in [name for name in self.relationships if name not in names]:
+                del self.relationships[other_name]
+                self._hot.pop(other_name, None)
+            self.relationships_dir_version = dir_version
+            self.dirty = True
+
+# Snapshots updated at runtime are written on exit so the next start finds them fresh
+_snapshots: 'weakref.WeakSet[PersonalitySnapshot]' = weakref.WeakSet()
+
+def _save_all() -> None:
+    for snapshot in list(_snapshots):
+        snapshot.save()
+
+atexit.register(_save_all)
@@ -0,0 +1,229 @@
+# chatbot/token_ledger.py
+import atexit
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from .file_lock import locked, write_json_atomic
+
+CALL_TYPES = ("reply", "relationship", "personality", "summary")
+
+# Analysis work that can be trimmed or put off when a personality is over budget;
+# replies to the person actually chatting are never held back
+BACKGROUND_CALL_TYPES = ("relationship", "personality", "summary")
+
+# Columns of a ledger row after its key (day, call type, personality, pair)
+_CALLS, _PROMPT, _COMPLETION, _CACHED, _DEFERRED = range(5)
+
+def pair_key(name: Optional[str], other_name: Optional[str]) -> str:
+    """Key for the directed relationship a call is about, e.g. 'jack->rob'."""
+    if not name or not other_name:
+        return ""
+    return f"{name}->{other_name}"
+
+def _today() -> str:
+    return time.strftime("%Y-%m-%d")
+
+def _usage_counts(usage) -> Tuple[int, int, int]:
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+    return prompt, completion, cached
+
+def parse_budgets(spec: str) -> Dict[str, int]:
+    """Parse 'jack=200000,lucy=50000,*=100000' into daily token budgets."""
+    budgets = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        try:
+            budgets[name.strip()] = int(value)
+        except ValueError:
+            print(f"Ignoring invalid token budget: {item}")
+    return budgets
+
+class TokenLedger:
+    """Token usage reported by the API, tagged by call type, personality and pair.
+
+    Usage is aggregated per day, so per-personality budgets are daily budgets.
+    Past soft_limit of its budget a personality's background analysis gets a
+    smaller max_tokens; past the budget it is deferred until the next day.
+    The ledger is persisted as compact rows, merging with other processes
+    writing to the same file; every autosave_every records it is saved in the
+    background, off the reply path.
+    """
+
+    def __init__(self, path: Optional[str] = None, budgets: Optional[Dict[str, int]] = None,
+                 soft_limit: float = 0.8, autosave_every: int = 20):
+        self.path = path
+        self.budgets = dict(budgets or {})
+        self.soft_limit = soft_limit
+        self.autosave_every = autosave_every
+        self._rows: Dict[Tuple[str, str, str, str], list] = {}
+        self._unsaved: Dict[Tuple[str, str, str, str], list] = {}
+        self._unsaved_records = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._autosave: Optional[Future] = None
+        # Tokens per (day, personality), kept alongside the rows so budget checks are O(1)
+        self._daily_tokens: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._set_rows(self._read_rows(path))
+
+    def _set_rows(self, rows: Dict[Tuple[str, str, str, str], list]) -> None:
+        self._rows = rows
+        self._daily_tokens = {}
+        for (day, _, personality, _), row in rows.items():
+            key = (day, personality)
+            self._daily_tokens[key] = self._daily_tokens.get(key, 0) + row[_PROMPT] + row[_COMPLETION]
+
+    # Recording
+
+    def record(self, response, call_type: str, personality: Optional[str], pair: str = "") -> None:
+        """Record the usage block of a completion response (no-op if it has none)."""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        prompt, completion, cached = _usage_counts(usage)
+        self._add((_today(), call_type, personality or "", pair), (1, prompt, completion, cached, 0))
+
+    def record_deferred(self, call_type: str, personality: Optional[str], pair: str = "") -> None:
+        self._add((_today(), call_type, personality or "", pair), (0, 0, 0, 0, 1))
+
+    def _add(self, key: Tuple[str, str, str, str], values: Tuple[int, ...]) -> None:
+        with self._lock:
+            for rows in (self._rows, self._unsaved):
+                row = rows.setdefault(key, [0] * 5)
+                for i, value in enumerate(values):
+                    row[i] += value
+            daily_key = (key[0], key[2])
+            self._daily_tokens[daily_key] = self._daily_tokens.get(daily_key, 0) + values[_PROMPT] + values[_COMPLETION]
+            self._unsaved_records += 1
+            if (self.path and self._unsaved_records >= self.autosave_every
+                    and (self._autosave is None or self._autosave.done())):
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token-ledger")
+                self._autosave = self._executor.submit(self.save)
+
+    # Queries
+
+    def totals(self, call_type: Optional[str] = None, personality: Optional[str] = None,
+               pair: Optional[str] = None, day: Optional[str] = None) -> Dict[str, int]:
+        """Sum usage over all rows matching the given filters."""
+        totals = [0] * 5
+        with self._lock:
+            for (row_day, row_type, row_personality, row_pair), row in self._rows.items():
+                if ((day is None or row_day == day) and (call_type is None or row_type == call_type)
+                        and (personality is None or row_personality == personality)
+                        and (pair is None or row_pair == pair)):
+                    for i, value in enumerate(row):
+                        totals[i] += value
+        return {
+            "calls": totals[_CALLS],
+            "prompt_tokens": totals[_PROMPT],
+            "completion_tokens": totals[_COMPLETION],
+            "cached_tokens": totals[_CACHED],
+            "total_tokens": totals[_PROMPT] + totals[_COMPLETION],
+            "deferred": totals[_DEFERRED],
+        }
+
+    def breakdown(self, by: str = "call_type", day: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """Totals grouped by 'call_type', 'personality', 'pair' or 'day'."""
+        position = {"day": 0, "call_type": 1, "personality": 2, "pair": 3}[by]
+        with self._lock:
+            groups = sorted({key[position] for key in self._rows if day is None or key[0] == day})
+        filters = {"day": day}
+        return {group: self.totals(**{**filters, by: group}) for group in groups}
+
+    # Budgets
+
+    def set_budget(self, personality: str, max_tokens_per_day: int) -> None:
+        self.budgets[personality] = max_tokens_per_day
+
+    def budget_status(self, personality: Optional[str]) -> str:
+        """'ok', 'degraded' (past the soft limit) or 'exceeded' for today's usage."""
+        budget = self.budgets.get(personality or "", self.budgets.get("*"))
+        if not budget:
+            return "ok"
+        used = self._daily_tokens.get((_today(), personality or ""), 0)
+        if used >= budget:
+            return "exceeded"
+        if used >= budget * self.soft_limit:
+            return "degraded"
+        return "ok"
+
+    def allow(self, call_type: str, personality: Optional[str], pair: str = "") -> bool:
+        """Whether a call may run now; over-budget background calls are deferred and counted."""
+        if call_type not in BACKGROUND_CALL_TYPES or self.budget_status(personality) != "exceeded":
+            return True
+        self.record_deferred(call_type, personality, pair)
+        return False
+
+    def max_tokens_for(self, call_type: str, personality: Optional[str], default: int) -> int:
+        """max_tokens to request, halved for background calls once past the soft limit."""
+        if call_type in BACKGROUND_CALL_TYPES and self.budget_status(personality) != "ok":
+            return max(1, default // 2)
+        return default
+
+    # Persistence
+
+    @staticmethod
+    def _read_rows(path: str) -> Dict[Tuple[str, str, str, str], list]:
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading token ledger {path}: {e}")
+            return {}
+        return {tuple(row[:4]): list(row[4:9]) for row in data.get("rows", [])}
+
+    def save(self, path: Optional[str] = None) -> None:
+        """Add this process's unsaved usage to the ledger file."""
+        path = path or self.path
+        if not path or not os.path.isdir(os.path.dirname(path) or "."):
+            return
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, {}
+            records, self._unsaved_records = self._unsaved_records, 0
+        if not unsaved:
+            return
+        try:
+            with locked(path):
+                rows = self._read_rows(path) if os.path.exists(path) else {}
+                for key, values in unsaved.items():
+                    row = rows.setdefault(key, [0] * 5)
+                    for i, value in enumerate(values):
+                        row[i] += value
+                write_json_atomic(path, {
+                    "columns": ["day", "call_type", "personality", "pair",
+                                "calls", "prompt_tokens", "completion_tokens", "cached_tokens", "deferred"],
+                    "rows": [list(key) + row for key, row in sorted(rows.items())],
+                }, compact=True)
+        except Exception as e:
+            print(f"Error saving token ledger {path}: {e}")
+            with self._lock:
+                # Keep the usage for the next save
+                for key, values in unsaved.items():
+                    row = self._unsaved.setdefault(key, [0] * 5)
+                    for i, value in enumerate(values):
+                        row[i] += value
+                self._unsaved_records += records
+            return
+        with self._lock:
+            # Pick up what other processes recorded, keeping anything added meanwhile
+            for key, values in self._unsaved.items():
+                row = rows.setdefault(key, [0] * 5)
+                for i, value in enumerate(values):
+                    row[i] += value
+            self._set_rows(rows)
+
+token_ledger = TokenLedger(
+    path=os.getenv("CHATBOT_TOKEN_LEDGER", os.path.join("my-personality", ".token-ledger.json")),
+    budgets=parse_budgets(os.getenv("CHATBOT_TOKEN_BUDGETS", "")),
+)
+atexit.register(token_ledger.save)
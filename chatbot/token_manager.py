@@ -1,6 +1,46 @@
 # chatbot/token_manager.py
-import tiktoken
+import threading
 from typing import List, Dict
+from .lazy_imports import lazy_import
+
+tiktoken = lazy_import("tiktoken")
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+def get_encoding(model: str = "gpt-4o-mini"):
+    """Return the (cached) tiktoken encoding for a model."""
+    encoding = _encodings.get(model)
+    if encoding is None:
+        with _encodings_lock:
+            encoding = _encodings.get(model)
+            if encoding is None:
+                encoding = tiktoken.encoding_for_model(model)
+                _encodings[model] = encoding
+    return encoding
+
+def estimate_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Count tokens with the encoding if it is already loaded, otherwise estimate ~4 characters per token.
+
+    Never blocks on loading the encoding, so it is safe on hot paths.
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+def warm_up_tokenizer(model: str = "gpt-4o-mini") -> threading.Thread:
+    """Load the encoding for a model on a daemon thread so the first count is instant."""
+    def _load():
+        try:
+            get_encoding(model)
+        except Exception:
+            # count_tokens reports the error if the encoding is ever needed
+            pass
+
+    thread = threading.Thread(target=_load, name=f"tokenizer-warmup-{model}", daemon=True)
+    thread.start()
+    return thread
 
 class TokenManager:
     def __init__(self):
@@ -8,7 +48,7 @@ class TokenManager:
     
     def count_tokens(self, messages: List[Dict], model: str = "gpt-4o-mini") -> int:
         try:
-            encoding = tiktoken.encoding_for_model(model)
+            encoding = get_encoding(model)
             num_tokens = 0
             for message in messages:
                 num_tokens += 4
@@ -24,7 +64,7 @@ class TokenManager:
     
     def print_token_usage(self, model: str, messages: List[Dict], response: str) -> None:
         input_tokens = self.count_tokens(messages, model)
-        output_tokens = len(tiktoken.encoding_for_model(model).encode(response))
+        output_tokens = len(get_encoding(model).encode(response))
         total_tokens = input_tokens + output_tokens
         self.total_tokens += total_tokens
         
@@ -0,0 +1,145 @@
+# chatbot/tracing.py
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+# Histogram bucket upper bounds in seconds, from disk writes up to slow completions
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        index = 0
+        for bound in BUCKETS:
+            if seconds <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(BUCKETS, self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+class _Span:
+    __slots__ = ("_tracer", "_stage", "_personality", "_start")
+
+    def __init__(self, tracer: 'Tracer', stage: str, personality: str):
+        self._tracer = tracer
+        self._stage = stage
+        self._personality = personality
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._tracer.observe(self._stage, self._personality, time.perf_counter() - self._start)
+        return False
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+class Tracer:
+    """Per-stage latency histograms, keyed by stage and personality.
+
+    When disabled, span() hands back a shared no-op context manager, so the
+    instrumented code pays one attribute check per stage.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def span(self, stage: str, personality: Optional[str] = None):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, stage, personality or "")
+
+    def observe(self, stage: str, personality: Optional[str], seconds: float) -> None:
+        key = (stage, personality or "")
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict:
+        """Summaries per stage and personality: count, total, mean and p50/p95/p99 estimates."""
+        with self._lock:
+            items = sorted(self._histograms.items())
+            result = {}
+            for (stage, personality), histogram in items:
+                result.setdefault(stage, {})[personality or "_all"] = {
+                    "count": histogram.count,
+                    "total_seconds": round(histogram.total, 6),
+                    "mean_seconds": round(histogram.total / histogram.count, 6),
+                    "p50_seconds": histogram.quantile(0.50),
+                    "p95_seconds": histogram.quantile(0.95),
+                    "p99_seconds": histogram.quantile(0.99),
+                }
+            return result
+
+    def export_json(self) -> str:
+        return json.dumps({"buckets": list(BUCKETS), "stages": self.snapshot()}, indent=2)
+
+    def export_prometheus(self) -> str:
+        """Render all histograms in the Prometheus text exposition format."""
+        name = "chatbot_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Time spent in each stage of a conversation turn.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for (stage, personality), histogram in sorted(self._histograms.items()):
+                labels = f'stage="{stage}",personality="{personality}"'
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.total:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Write the metrics to path, as JSON if it ends in .json and Prometheus text otherwise."""
+        content = self.export_json() if path.endswith(".json") else self.export_prometheus()
+        with open(path, 'w') as f:
+            f.write(content)
+
+tracer = Tracer(enabled=os.getenv("CHATBOT_TRACING", "").lower() in ("1", "true", "yes"))
+
+def span(stage: str, personality: Optional[str] = None):
+    """Time a block as one observation of stage for personality on the global tracer."""
+    return tracer.span(stage, personality)
@@ -1,12 +1,23 @@
 # main.py
-from dotenv import load_dotenv
 import os
-from chatbot.chatbot import ChatBot
+import sys
+import argparse
+import contextlib
+from chatbot.chatbot import ChatBot, resume_jobs
 from chatbot.personality_manager import PersonalityManager
 from chatbot.relationship_manager import RelationshipManager
 import json
 import shutil
 from chatbot.autonomous_chat import AutonomousChat
+from chatbot.group_chat import GroupChat
+from chatbot.lazy_imports import lazy_import, preload
+from chatbot.token_manager import warm_up_tokenizer
+from chatbot.tracing import tracer
+from chatbot.profiling import profiler
+from chatbot.providers import PROVIDERS, PROVIDER_ENV
+from chatbot.job_journal import job_journal
+
+dotenv = lazy_import("dotenv")
 
 def remove_user_relationship_dynamics():
     """Remove relationship dynamics and core identity from all user personalities."""
@@ -87,24 +98,21 @@ def cleanup_workspace():
             # Initialize relationship with all other AIs and users
             relationship_manager = RelationshipManager(ai_path)
             
-            # Create relationships with other AIs
-            for other_ai in os.listdir(ai_dir):
-                if other_ai != ai_name:
-                    relationship_file = relationship_manager.get_relationship_file(other_ai)
-                    if not os.path.exists(relationship_file):
-                        relationship_manager.save_relationship(other_ai, relationship_manager._create_blank_relationship(other_ai))
-            
-            # Create relationships with all users
+            # Create relationships with other AIs and all users; the relationship
+            # index answers for known pairs, so only unindexed ones are stat-ed
+            graph = relationship_manager.graph
             users_dir = os.path.join(base_dir, "users")
-            for user_name in os.listdir(users_dir):
-                relationship_file = relationship_manager.get_relationship_file(user_name)
-                if not os.path.exists(relationship_file):
-                    relationship_manager.save_relationship(user_name, relationship_manager._create_blank_relationship(user_name))
+            others = [other_ai for other_ai in os.listdir(ai_dir) if other_ai != ai_name] + os.listdir(users_dir)
+            for other_name in others:
+                if graph.has_edge(ai_name, other_name):
+                    continue
+                if not os.path.exists(relationship_manager.get_relationship_file(other_name)):
+                    relationship_manager.save_relationship(other_name, relationship_manager._create_blank_relationship(other_name))
 
 def setup_api_key():
     """Ensure OpenAI API key is set up."""
     # Load environment variables from .env file
-    load_dotenv()
+    dotenv.load_dotenv()
     
     api_key = os.getenv('OPENAI_API_KEY')
     if not api_key:
@@ -225,10 +233,40 @@ def select_personality(personalities, prompt):
         except ValueError:
             print("Please enter a valid number.")
 
-def main():
+def select_personalities(personalities, prompt):
+    """Let user select several personalities, e.g. '1,3,4'."""
+    print(f"\n{prompt}")
+    for i, name in enumerate(personalities, 1):
+        print(f"{i}. {name}")
+    
+    choices = input("\nEnter your choices (comma-separated numbers): ")
+    selected = []
+    for choice in choices.split(","):
+        choice = choice.strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(personalities):
+            name = personalities[int(choice) - 1]
+            if name not in selected:
+                selected.append(name)
+    return selected
+
+def resume_unfinished_jobs():
+    """Restart analysis jobs that an earlier run journaled but didn't finish."""
+    bots = resume_jobs()
+    if bots:
+        backlog = job_journal.backlog()
+        print(f"Resuming {backlog['unfinished']} unfinished analysis jobs for "
+              f"{', '.join(bot.name for bot in bots)} in the background")
+
+def main(pace=None):
     try:
+        # Load the OpenAI client library and tokenizer in the background while
+        # the user is still picking a mode and personality
+        preload("dotenv", "openai")
+        warm_up_tokenizer()
+        
         # Clean up workspace first
         cleanup_workspace()
+        resume_unfinished_jobs()
         
         # Get available personalities
         personalities = get_available_personalities()
@@ -246,8 +284,9 @@ def main():
         print("\nWelcome to the AI Chat System!")
         print("\n1. Chat with an AI personality")
         print("2. Watch autonomous conversation")
+        print("3. Watch group conversation")
         
-        choice = input("\nEnter your choice (1 or 2): ")
+        choice = input("\nEnter your choice (1, 2 or 3): ")
         
         if choice == "1":
             # Interactive chat mode
@@ -267,6 +306,9 @@ def main():
             # Create AI bot
             ai_bot = ChatBot(ai_personality)
             
+            profiler.watch(f"{ai_personality}.conversation_history", lambda: ai_bot.conversation_history)
+            profiler.watch(f"{ai_personality}.personality", lambda: ai_bot.personality_manager.current_personality)
+            
             # Start chat
             print(f"\nStarting chat between {user_name} and {ai_personality}...")
             print("Type 'quit' to end the conversation.")
@@ -275,18 +317,15 @@ def main():
                 # User's turn
                 user_message = input(f"\n{user_name}: ").strip()
                 if user_message.lower() == 'quit':
+                    # Save the session to memory before exiting
+                    ai_bot.end_session(user_name)
+                    ai_bot.wait_for_updates()
                     break
                     
-                # Get AI's response
+                # Get AI's response; recording it journals the relationship update
                 ai_response = ai_bot.get_response(user_message, user_name)
                 print(f"\n{ai_personality}: {ai_response}")
-                
-                # Update relationship
-                ai_bot.relationship_manager.update_relationship(
-                    user_name,
-                    [{"speaker": user_name, "message": user_message},
-                     {"speaker": ai_personality, "message": ai_response}]
-                )
+                profiler.tick()
         
         elif choice == "2":
             # Autonomous conversation mode
@@ -303,16 +342,110 @@ def main():
             bot2 = ChatBot(personality2)
             
             # Start autonomous chat
-            autonomous_chat = AutonomousChat()
+            autonomous_chat = AutonomousChat(delay=pace)
             autonomous_chat.start_conversation(bot1, bot2)
             
+        elif choice == "3":
+            # Group conversation mode
+            members = select_personalities(personalities, "Select the participants:")
+            if len(members) < 2:
+                print("Please select at least two different personalities.")
+                return
+            
+            bots = [ChatBot(name) for name in members]
+            GroupChat(delay=pace).start_conversation(bots)
+            
         else:
-            print("Invalid choice. Please enter 1 or 2.")
+            print("Invalid choice. Please enter 1, 2 or 3.")
             
     except Exception as e:
         print(f"An error occurred: {e}")
         import traceback
         traceback.print_exc()
 
+def serve(args):
+    """Run the multi-session HTTP/WebSocket chat server."""
+    cleanup_workspace()
+    if args.workers > 1:
+        # Each worker resumes the jobs of the personalities it owns
+        from chatbot.cluster import run_cluster
+        run_cluster(args.host, args.port, workers=args.workers, max_inflight=args.max_inflight,
+                    max_queue=args.max_queue)
+        return
+    resume_unfinished_jobs()
+    
+    # Imported here so the interactive CLI doesn't pay for asyncio
+    from chatbot.server import run_server
+    run_server(args.host, args.port, max_inflight=args.max_inflight, max_queue=args.max_queue)
+
+def batch(args):
+    """Answer conversation requests read as JSONL, without prompting for anything."""
+    from chatbot.batch import run_batch
+    source = sys.stdin if args.batch == "-" else open(args.batch)
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        # Progress messages go to stderr so the output carries only results
+        with contextlib.redirect_stdout(sys.stderr):
+            cleanup_workspace()
+            resume_unfinished_jobs()
+            summary = run_batch(source, output, concurrency=args.concurrency)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    print(f"Batch finished: {json.dumps(summary)}", file=sys.stderr)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI Chat System")
+    parser.add_argument("--serve", action="store_true",
+                        help="run the HTTP/WebSocket chat server instead of the interactive CLI")
+    parser.add_argument("--host", default="127.0.0.1", help="server bind address")
+    parser.add_argument("--port", type=int, default=8080, help="server port")
+    parser.add_argument("--max-inflight", type=int, default=8,
+                        help="maximum concurrent completion calls in server mode")
+    parser.add_argument("--max-queue", type=int, default=32,
+                        help="turns allowed to wait for an upstream slot before new ones are rejected")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="server worker processes; personalities are partitioned across them by name")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="answer JSONL requests ({\"user\", \"ai\", \"message\"} per line) from FILE, or - for "
+                             "stdin, instead of the interactive CLI; results are written as JSONL")
+    parser.add_argument("--output", metavar="FILE", help="batch mode: write results here instead of stdout")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="batch mode: conversations answered at the same time")
+    parser.add_argument("--pace", type=float, metavar="SECONDS",
+                        help="minimum seconds per turn in autonomous conversations, including generation time")
+    parser.add_argument("--trace", action="store_true",
+                        help="record per-stage latency histograms (also enabled by CHATBOT_TRACING=1)")
+    parser.add_argument("--metrics-file",
+                        help="write stage latency metrics here on exit (.json for JSON, otherwise Prometheus text)")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="write cProfile and tracemalloc checkpoints to DIR (also CHATBOT_PROFILE_DIR)")
+    parser.add_argument("--profile-every", type=int, metavar="N",
+                        help="turns between profiling checkpoints (default 50, or CHATBOT_PROFILE_EVERY)")
+    parser.add_argument("--provider", choices=sorted(PROVIDERS),
+                        help="backend for routes that don't name one: openai (default), compatible or stub "
+                             "(in-process canned replies, no network); also CHATBOT_PROVIDER")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.provider:
+        os.environ[PROVIDER_ENV] = args.provider
+    if args.trace or args.metrics_file:
+        tracer.enabled = True
+    if args.profile or profiler.output_dir:
+        profiler.start(args.profile, args.profile_every)
+    try:
+        if args.serve:
+            serve(args)
+        elif args.batch:
+            batch(args)
+        else:
+            main(pace=args.pace)
+    finally:
+        if args.metrics_file:
+            tracer.write(args.metrics_file)
+            print(f"Stage metrics written to {args.metrics_file}")
+        profiler.stop()
\ No newline at end of file
@@ -0,0 +1,25 @@
+# tests/conftest.py
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Offline backend and throwaway ledger/journal; these are read when the chatbot
+# modules are first imported, so they are set before any test imports them
+_state_dir = tempfile.mkdtemp(prefix="chatbot-tests-")
+os.environ["CHATBOT_PROVIDER"] = "stub"
+os.environ["CHATBOT_TOKEN_LEDGER"] = os.path.join(_state_dir, "token-ledger.json")
+os.environ["CHATBOT_JOB_JOURNAL"] = os.path.join(_state_dir, "jobs.sqlite3")
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """A copy of the bundled personalities as ./my-personality in a temporary working directory."""
+    shutil.copytree(os.path.join(ROOT, "my-personality"), tmp_path / "my-personality",
+                    ignore=shutil.ignore_patterns(".*"))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / "my-personality"
@@ -0,0 +1,36 @@
+# tests/test_batch.py
+import io
+import json
+
+from chatbot.batch import run_batch
+from chatbot.personality_pool import PersonalityPool
+
+def _run(lines):
+    output = io.StringIO()
+    summary = run_batch(io.StringIO("\n".join(json.dumps(line) for line in lines) + "\n"), output,
+                        concurrency=2, pool=PersonalityPool())
+    return summary, [json.loads(line) for line in output.getvalue().splitlines()]
+
+def test_rejects_names_outside_the_name_pattern(data_dir):
+    summary, results = _run([
+        {"user": "../../etc", "ai": "jack", "message": "hi"},
+        {"user": "rob", "ai": "../jack", "message": "hi"},
+        {"user": "rob/x", "ai": "jack", "message": "hi"},
+        {"user": "rob", "ai": "jack", "message": "hi"},
+    ])
+    by_index = {result["index"]: result for result in results}
+    for index in (0, 1, 2):
+        assert by_index[index]["status"] == "error"
+        assert "Invalid request" in by_index[index]["error"]
+    assert by_index[3]["status"] == "ok"
+    assert summary["error"] == 3 and summary["ok"] == 1
+    assert not (data_dir / "ai" / "etc.json").exists()
+    assert not (data_dir.parent / "etc").exists()
+    assert sorted(path.name for path in (data_dir / "ai").iterdir()) == ["jack", "lucy"]
+
+def test_turns_of_a_conversation_keep_input_order(data_dir):
+    lines = [{"id": n, "user": "rob", "ai": "jack", "message": f"message {n}"} for n in range(5)]
+    summary, results = _run(lines)
+    assert summary["ok"] == 5 and summary["conversations"] == 1
+    assert [result["id"] for result in results] == list(range(5))
+    assert all("message %d" % result["id"] in result["reply"] for result in results)
@@ -0,0 +1,47 @@
+# tests/test_chatbot.py
+import sqlite3
+
+from chatbot import chatbot as chatbot_module
+from chatbot.chatbot import ChatBot
+from chatbot.job_journal import job_journal
+from chatbot.personality_pool import PersonalityPool
+
+def test_relationship_job_carries_both_turns(data_dir, monkeypatch):
+    job_journal._db().execute("DELETE FROM jobs")
+    monkeypatch.setattr(chatbot_module, "run_job", lambda bot, key: None)
+    bot = ChatBot("jack", pool=PersonalityPool())
+
+    reply = bot.get_response("I finally fixed my old sailboat", "rob")
+
+    jobs = [job for job in job_journal.unfinished() if job.kind == "relationship"]
+    assert len(jobs) == 1
+    assert jobs[0].args["conversation"] == [
+        {"speaker": "rob", "message": "I finally fixed my old sailboat"},
+        {"speaker": "jack", "message": reply},
+    ]
+    job_journal._db().execute("DELETE FROM jobs")
+
+def test_failed_post_reply_updates_keep_the_reply(data_dir, monkeypatch, capsys):
+    bot = ChatBot("jack", pool=PersonalityPool())
+
+    def locked(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(job_journal, "enqueue", locked)
+    reply = bot.get_response("Are you there?", "rob")
+
+    assert "Are you there?" in reply
+    assert bot.conversation_history[-1] == {"role": "assistant", "content": reply}
+    assert "Error in post-response updates: database is locked" in capsys.readouterr().out
+
+def test_close_finishes_updates_and_stops_the_update_thread(data_dir):
+    bot = ChatBot("jack", pool=PersonalityPool())
+    done = []
+    bot.submit_update(done.append, "episode")
+    executor = bot._update_executor
+
+    bot.close()
+
+    assert done == ["episode"]
+    assert executor._shutdown
+    assert bot._update_executor is None
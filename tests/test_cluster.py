@@ -0,0 +1,25 @@
+# tests/test_cluster.py
+from chatbot.cluster import HashRing
+
+NAMES = [f"personality-{n}" for n in range(2000)]
+
+def test_adding_a_worker_only_moves_names_to_it():
+    ring = HashRing(("worker-1", "worker-2", "worker-3"))
+    before = {name: ring.owner(name) for name in NAMES}
+    ring.add("worker-4")
+    after = {name: ring.owner(name) for name in NAMES}
+
+    moved = [name for name in NAMES if before[name] != after[name]]
+    assert all(after[name] == "worker-4" for name in moved)
+    # About a quarter of the names should move to the new worker
+    assert 0.15 < len(moved) / len(NAMES) < 0.35
+
+    ring.remove("worker-4")
+    assert {name: ring.owner(name) for name in NAMES} == before
+
+def test_partitions_cover_every_name_once():
+    ring = HashRing(("worker-1", "worker-2"))
+    owned = ring.partitions(NAMES)
+    assert sorted(owned) == ["worker-1", "worker-2"]
+    assert sorted(name for names in owned.values() for name in names) == sorted(NAMES)
+    assert all(owned.values())
@@ -0,0 +1,27 @@
+# tests/test_dedup.py
+import pytest
+
+from chatbot.dedup import COUNTS_KEY, merge_list
+
+@pytest.mark.parametrize("first, second", [
+    ("is not trustworthy", "is trustworthy"),
+    ("Lucy asked about Rob's day", "Rob asked about Lucy's day"),
+    ("Discussed favorite snakes", "Discussed favorite cakes"),
+])
+def test_keeps_entries_that_differ_in_meaning(first, second):
+    parent = {}
+    merge_list(parent, "notes", [first])
+    merge_list(parent, "notes", [second])
+    assert parent["notes"] == [first, second]
+    assert not parent.get(COUNTS_KEY, {}).get("notes")
+
+@pytest.mark.parametrize("first, second", [
+    ("Shows curiosity about science", "Curious about science"),
+    ("Enjoys hiking in the mountains", "Enjoys hiking in mountains"),
+    ("Asked about Rob's weekend plans", "Asked Rob about weekend plans"),
+])
+def test_folds_near_duplicates(first, second):
+    parent = {}
+    merge_list(parent, "notes", [first, second])
+    assert parent["notes"] == [first]
+    assert parent[COUNTS_KEY]["notes"] == {first: 2}
@@ -0,0 +1,52 @@
+# tests/test_group_chat.py
+import json
+
+from chatbot import chatbot as chatbot_module
+from chatbot.chatbot import ChatBot
+from chatbot.group_chat import GroupChat, TRANSCRIPT_BLOCK, TRANSCRIPT_WINDOW
+from chatbot.job_journal import job_journal
+from chatbot.personality_pool import PersonalityPool
+
+def test_shared_prefix_only_grows_between_trims():
+    chat = GroupChat()
+    previous = None
+    trims = 0
+    for turn in range(60):
+        chat.transcript.append({"speaker": "jack" if turn % 2 else "lucy", "message": f"message {turn}"})
+        prefix = chat._shared_prefix([])
+        assert len(prefix) - 1 >= min(len(chat.transcript), TRANSCRIPT_WINDOW)
+        if previous is not None and prefix[:len(previous)] != previous:
+            trims += 1
+        previous = prefix
+    # One trim per block once the window is full, instead of a new prefix every turn
+    assert trims == (60 - TRANSCRIPT_WINDOW) // TRANSCRIPT_BLOCK
+
+def test_group_analysis_runs_as_a_journaled_job(data_dir, monkeypatch):
+    job_journal._db().execute("DELETE FROM jobs")
+    # Resumed jobs load the other participants from the default pool
+    monkeypatch.setattr(chatbot_module, "default_pool", PersonalityPool())
+    updates = {
+        "jack": {"personality": {"interests-values.json": {"interests": ["restoring sailboats"]}}},
+        "lucy": {"relationships": {"jack": {"observed_traits": ["patient with old boats"]}}},
+    }
+    windows = []
+
+    def analyze(bots, window):
+        windows.append(([bot.name for bot in bots], window))
+        return updates
+
+    monkeypatch.setattr(GroupChat, "analyze_window", staticmethod(analyze))
+    jack = ChatBot("jack")
+    chat = GroupChat(analysis_window=2)
+    chat.transcript = [{"speaker": "jack", "message": "I fixed the sailboat"},
+                       {"speaker": "lucy", "message": "Patience pays off"}]
+
+    chat._queue_analysis([jack, ChatBot("lucy")])
+    chat._wait_for_analysis()
+
+    assert windows == [(["jack", "lucy"], chat.transcript)]
+    assert job_journal.unfinished() == []
+    with open(data_dir / "ai" / "jack" / "interests-values.json") as f:
+        assert "restoring sailboats" in json.dumps(json.load(f))
+    lucy = ChatBot("lucy")
+    assert "patient with old boats" in json.dumps(lucy.relationship_manager.load_relationship("jack"))
@@ -0,0 +1,79 @@
+# tests/test_job_journal.py
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from chatbot.chatbot import resume_jobs
+from chatbot.job_journal import job_journal, register_job, run_job
+from chatbot.personality_pool import PersonalityPool
+
+analyzed, applied = [], []
+
+def _analyze(bot, job):
+    analyzed.append(job.args["n"])
+    return {"note": f"fresh {job.args['n']}"}
+
+def _apply(bot, job, result):
+    applied.append((bot.name, job.args["n"], result["note"]))
+
+register_job("test_note", _analyze, _apply)
+
+def _dead_worker() -> str:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return f"{socket.gethostname()}:{process.pid}"
+
+def test_resume_applies_stored_results_and_reanalyzes_the_rest(data_dir):
+    job_journal._db().execute("DELETE FROM jobs")
+    analyzed.clear()
+    applied.clear()
+
+    # One job crashed after its analysis was stored, one before it started
+    interrupted = job_journal.enqueue("test_note", "jack", {"n": 1, "is_user": False})
+    job_journal._db().execute(
+        "UPDATE jobs SET state = 'running', result = ?, worker = ?, lease_until = ? WHERE key = ?",
+        (json.dumps({"note": "stored 1"}), _dead_worker(), time.time() + 600, interrupted.key))
+    pending = job_journal.enqueue("test_note", "jack", {"n": 2, "is_user": False})
+    assert {job.key for job in job_journal.unfinished()} == {interrupted.key, pending.key}
+
+    bots = resume_jobs(pool=PersonalityPool())
+    for bot in bots:
+        bot.wait_for_updates()
+
+    assert [bot.name for bot in bots] == ["jack"]
+    assert analyzed == [2]
+    assert sorted(applied) == [("jack", 1, "stored 1"), ("jack", 2, "fresh 2")]
+    assert job_journal.unfinished() == []
+
+    # Finished jobs are gone from the journal, so running one again does nothing
+    run_job(bots[0], interrupted.key)
+    assert len(applied) == 2
+
+def test_jobs_held_by_a_live_worker_are_not_resumed(data_dir):
+    job_journal._db().execute("DELETE FROM jobs")
+    held = job_journal.enqueue("test_note", "jack", {"n": 3, "is_user": False})
+    job_journal._db().execute("UPDATE jobs SET state = 'running', worker = ?, lease_until = ? WHERE key = ?",
+                              (f"{socket.gethostname()}:1", time.time() + 600, held.key))
+    assert job_journal.unfinished() == []
+    job_journal._db().execute("DELETE FROM jobs")
+
+def test_jobs_of_an_earlier_process_with_the_same_pid_are_resumed(data_dir):
+    # A restarted container runs its worker under the same hostname and PID as before
+    job_journal._db().execute("DELETE FROM jobs")
+    analyzed.clear()
+    applied.clear()
+    job = job_journal.enqueue("test_note", "jack", {"n": 4, "is_user": False})
+    earlier = f"{socket.gethostname()}:{os.getpid()}:0123456789ab"
+    job_journal._db().execute(
+        "UPDATE jobs SET state = 'running', result = ?, worker = ?, lease_until = ? WHERE key = ?",
+        (json.dumps({"note": "stored 4"}), earlier, time.time() + 600, job.key))
+    assert earlier != job_journal.worker
+    assert [resumable.key for resumable in job_journal.unfinished()] == [job.key]
+
+    for bot in resume_jobs(pool=PersonalityPool()):
+        bot.wait_for_updates()
+    assert applied == [("jack", 4, "stored 4")] and analyzed == []
+    assert job_journal.unfinished() == []
@@ -0,0 +1,39 @@
+# tests/test_memory_manager.py
+from chatbot import memory_manager
+from chatbot.chatbot import ChatBot
+from chatbot.circuit_breaker import CircuitOpenError
+from chatbot.job_journal import job_journal, run_job
+from chatbot.personality_pool import PersonalityPool
+
+MESSAGES = [{"role": "user", "content": "How was the trip?"},
+            {"role": "assistant", "content": "Wonderful, the mountains were stunning."}]
+
+def _episode_job(bot):
+    job_journal._db().execute("DELETE FROM jobs")
+    job = job_journal.enqueue("episode", bot.name, {"other_name": "rob", "messages": MESSAGES, "is_user": False})
+    run_job(bot, job.key)
+    return job_journal._db().execute("SELECT state, attempts FROM jobs WHERE key = ?", (job.key,)).fetchone()
+
+def test_episode_job_is_put_back_while_the_upstream_is_down(data_dir, monkeypatch):
+    bot = ChatBot("jack", pool=PersonalityPool())
+
+    def circuit_open(*args, **kwargs):
+        raise CircuitOpenError("Every route for summary is failing", 30.0)
+
+    monkeypatch.setattr(memory_manager.model_router, "complete", circuit_open)
+    assert _episode_job(bot) == ("pending", 0)
+
+def test_episode_job_counts_real_errors_as_failed_attempts(data_dir, monkeypatch):
+    bot = ChatBot("jack", pool=PersonalityPool())
+
+    def broken(*args, **kwargs):
+        raise ValueError("bad response")
+
+    monkeypatch.setattr(memory_manager.model_router, "complete", broken)
+    assert _episode_job(bot) == ("pending", 1)
+
+def test_episode_job_records_the_summary(data_dir):
+    bot = ChatBot("jack", pool=PersonalityPool())
+    assert _episode_job(bot) is None
+    episodes = bot.memory.load_episodes("rob")
+    assert len(episodes) == 1 and episodes[0]["messages"] == 2
@@ -0,0 +1,44 @@
+# tests/test_model_router.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from chatbot import model_router as router_module
+from chatbot.model_router import DeadlineExceeded, ModelRouter, Route
+from chatbot.providers import Provider
+
+class Rejecting(Provider):
+    def chat(self, **request):
+        error = RuntimeError("Invalid 'max_tokens'")
+        error.status_code = 400
+        raise error
+
+def _router(deadline: float = 5) -> ModelRouter:
+    return ModelRouter({"summary": {"deadline": deadline, "routes": [{"model": "m", "provider": "stub"}]}})
+
+def test_bad_request_does_not_count_against_the_route(monkeypatch):
+    monkeypatch.setattr(Route, "backend", lambda route: Rejecting())
+    router = _router()
+    for _ in range(6):
+        with pytest.raises(RuntimeError):
+            router.complete("summary", [{"role": "user", "content": "hi"}], "jack")
+    route = router.tasks["summary"].routes[0]
+    assert router.stats()["summary"]["routes"][0]["failures"] == 0
+    assert router.breaker(route).state == "closed"
+
+def test_attempt_still_queued_at_the_deadline_is_cancelled(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(router_module, "_executor", executor)
+    release = threading.Event()
+    busy = executor.submit(release.wait)
+    router = _router(deadline=0.2)
+    route = router.tasks["summary"].routes[0]
+    try:
+        with pytest.raises(DeadlineExceeded):
+            router.complete("summary", [{"role": "user", "content": "hi"}], "jack")
+        assert router.breaker(route).describe()["consecutive_failures"] == 0
+    finally:
+        release.set()
+        busy.result()
+        executor.shutdown()
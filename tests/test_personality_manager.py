@@ -0,0 +1,27 @@
+# tests/test_personality_manager.py
+import json
+
+from chatbot.personality_manager import PersonalityManager
+
+def _add_interests(current, new):
+    current.setdefault("interests", []).extend(new["interests"])
+    return current
+
+def test_updates_replace_sections_instead_of_changing_them(data_dir):
+    manager = PersonalityManager(str(data_dir))
+    assert manager.load_personality("jack")
+    before = manager.current_personality
+    section = before["interests-values.json"]
+    snapshot = json.dumps(section, sort_keys=True)
+
+    merged = manager.update_personality_file("interests-values.json", {"interests": ["Tide pools"]},
+                                             _add_interests)
+
+    # Readers holding the old mappings see them exactly as they were
+    assert json.dumps(section, sort_keys=True) == snapshot
+    assert before["interests-values.json"] is section
+    assert manager.current_personality is not before
+    assert manager.current_personality["interests-values.json"] is merged
+    assert "Tide pools" in merged["interests"]
+    with open(data_dir / "ai" / "jack" / "interests-values.json") as f:
+        assert "Tide pools" in json.load(f)["interests"]
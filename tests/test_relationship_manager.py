@@ -0,0 +1,30 @@
+# tests/test_relationship_manager.py
+import random
+import string
+
+from chatbot.relationship_manager import KEEP_RECENT_ITEMS, RAW_TOKEN_LIMIT, RelationshipManager
+
+def _text(words: int, seed: int) -> str:
+    rng = random.Random(seed)
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=6)) for _ in range(words))
+
+def _manager(data_dir, monkeypatch):
+    manager = RelationshipManager(str(data_dir / "ai" / "jack"))
+    scheduled = []
+    monkeypatch.setattr(manager, "schedule_compaction", scheduled.append)
+    return manager, scheduled
+
+def test_no_compaction_when_nothing_can_be_rolled(data_dir, monkeypatch):
+    manager, scheduled = _manager(data_dir, monkeypatch)
+    # A few long entries: over the token limit, but every list is within KEEP_RECENT_ITEMS
+    entries = [_text(800, seed) for seed in range(KEEP_RECENT_ITEMS)]
+    data = manager.apply_relationship_update("zed", {"interactions": entries})
+    assert data["raw_tokens"] > RAW_TOKEN_LIMIT
+    assert scheduled == []
+
+def test_compaction_when_old_items_can_be_rolled(data_dir, monkeypatch):
+    manager, scheduled = _manager(data_dir, monkeypatch)
+    entries = [_text(200, seed) for seed in range(KEEP_RECENT_ITEMS + 10)]
+    data = manager.apply_relationship_update("zed", {"interactions": entries})
+    assert data["raw_tokens"] > RAW_TOKEN_LIMIT
+    assert scheduled == ["zed"]
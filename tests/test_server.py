@@ -0,0 +1,111 @@
+# tests/test_server.py
+import asyncio
+import json
+
+from chatbot.personality_pool import PersonalityPool
+from chatbot.server import ChatServer
+
+async def _request(port: int, method: str, path: str, payload=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body) if body else None
+
+def test_failed_update_does_not_poison_the_session(data_dir, capsys):
+    async def scenario():
+        server = ChatServer(pool=PersonalityPool())
+        await server.start()
+        try:
+            session = await server.create_session("rob", "jack")
+            record_exchange = session.bot.record_exchange
+            failures = []
+
+            def fail_once(*args, **kwargs):
+                if not failures:
+                    failures.append(args)
+                    raise RuntimeError("disk full")
+                return record_exchange(*args, **kwargs)
+
+            session.bot.record_exchange = fail_once
+            first = await server.run_turn(session, "hello there")
+            second = await server.run_turn(session, "still there?")
+            await server.end_session(session)
+            return first, second, failures
+        finally:
+            await server.stop()
+
+    first, second, failures = asyncio.run(scenario())
+    assert "hello there" in first and "still there?" in second
+    assert len(failures) == 1
+    assert "disk full" in capsys.readouterr().out
+
+def test_unexpected_errors_answer_500(data_dir):
+    async def scenario():
+        server = ChatServer(pool=PersonalityPool())
+        await server.start()
+
+        async def broken_dispatch(request, writer):
+            raise KeyError("episodes")
+
+        server._dispatch = broken_dispatch
+        try:
+            return await _request(server.port, "GET", "/health")
+        finally:
+            await server.stop()
+
+    status, body = asyncio.run(scenario())
+    assert status == 500
+    assert body == {"error": "Internal server error"}
+
+def test_idle_sessions_are_ended(data_dir):
+    async def scenario():
+        server = ChatServer(pool=PersonalityPool(), session_idle=60)
+        await server.start()
+        try:
+            idle = await server.create_session("rob", "jack")
+            active = await server.create_session("lucy", "jack")
+            ended = []
+            idle.bot.end_session = ended.append
+            idle.last_active -= 61
+            await server.expire_idle_sessions()
+            return ended, set(server.sessions), active.id
+        finally:
+            await server.stop()
+
+    ended, open_sessions, active_id = asyncio.run(scenario())
+    assert ended == ["rob"]
+    assert open_sessions == {active_id}
+
+def test_sessions_past_the_limit_answer_503(data_dir):
+    async def scenario():
+        server = ChatServer(pool=PersonalityPool(), max_sessions=1)
+        await server.start()
+        try:
+            first = await _request(server.port, "POST", "/sessions", {"user": "rob", "ai": "jack"})
+            second = await _request(server.port, "POST", "/sessions", {"user": "lucy", "ai": "jack"})
+            return first[0], second[0], len(server.sessions)
+        finally:
+            await server.stop()
+
+    assert asyncio.run(scenario()) == (201, 503, 1)
+
+def test_ended_session_writes_its_episode_before_returning(data_dir):
+    async def scenario():
+        server = ChatServer(pool=PersonalityPool())
+        await server.start()
+        try:
+            session = await server.create_session("rob", "jack")
+            await server.run_turn(session, "hello there")
+            await server.end_session(session)
+            return session.bot
+        finally:
+            await server.stop()
+
+    bot = asyncio.run(scenario())
+    assert bot._update_executor is None
+    assert len(bot.memory.load_episodes("rob")) == 1
@@ -0,0 +1,42 @@
+# tests/test_token_ledger.py
+import json
+from types import SimpleNamespace
+
+from chatbot import token_ledger as ledger_module
+from chatbot.token_ledger import TokenLedger
+
+def _response(prompt: int, completion: int):
+    return SimpleNamespace(usage=SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion,
+                                                 prompt_tokens_details=None))
+
+def _saved_totals(path):
+    with open(path) as f:
+        rows = json.load(f)["rows"]
+    return sum(row[4] for row in rows), sum(row[5] + row[6] for row in rows)
+
+def test_failed_save_keeps_usage_for_the_next_one(tmp_path, monkeypatch):
+    path = tmp_path / "ledger.json"
+    ledger = TokenLedger(str(path), autosave_every=1000)
+    ledger.record(_response(100, 20), "reply", "jack", "jack->rob")
+    ledger.record(_response(50, 10), "personality", "jack", "jack->rob")
+
+    write = ledger_module.write_json_atomic
+    def fail(*args, **kwargs):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(ledger_module, "write_json_atomic", fail)
+    ledger.save()
+    assert not path.exists()
+
+    monkeypatch.setattr(ledger_module, "write_json_atomic", write)
+    ledger.record(_response(10, 5), "reply", "jack", "jack->rob")
+    ledger.save()
+    assert _saved_totals(path) == (3, 195)
+    assert ledger.totals()["total_tokens"] == 195
+
+def test_autosave_runs_in_the_background(tmp_path):
+    path = tmp_path / "ledger.json"
+    ledger = TokenLedger(str(path), autosave_every=3)
+    for _ in range(3):
+        ledger.record(_response(10, 1), "reply", "lucy")
+    ledger._autosave.result(timeout=10)
+    assert _saved_totals(path) == (3, 33)